@@ -0,0 +1,359 @@
+""" Local HTTP/JSON API over a substory dataset, for phones, overlays and other second-screen clients.
+
+The server runs an asyncio event loop on its own thread, so the GUI's Tk loop never waits on a client.
+Endpoints:
+    GET  /api/substories   filtered and sorted substories, paginated (offset, limit) or streamed as
+                           NDJSON (stream=1); same parameters as the CLI: query, filter_by, status,
+                           chapter, character (repeatable), sort, descending
+    GET  /api/substories/<key>
+    GET  /api/status       the game, dataset version and per-status counts
+    POST /api/status       {"status": ..., "keys": [...]} or {"status": ..., "filter": {...}}
+    GET  /api/events       Server-Sent Events: a "change" event after every edit
+
+GET responses carry an ETag of the dataset version and the game and profile shown; a request with a matching If-None-Match gets
+304 Not Modified without the filters being run. Standalone:
+    python substories_cli.py serve --port 8765
+"""
+import asyncio
+import json
+import threading
+import zlib
+from collections import OrderedDict
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from substories_core import FILTER_BY_FIELDS, FUZZY_FILTER, SORT_KEYS, STATUSES, json_default, record_iid, traced
+
+API_HOST = '127.0.0.1'
+API_PORT = 8765
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+API_STREAM_CHUNK = 500      # records per chunk of a streamed response
+API_EVENT_QUEUE = 64        # change events buffered per client before they are folded into one "reset"
+API_EVENT_KEYS = 500        # record keys listed in a change event at most
+API_RESPONSE_CACHE = 64
+API_MAX_BODY = 1 << 20
+
+STATUS_TEXT = {200: 'OK', 204: 'No Content', 304: 'Not Modified', 400: 'Bad Request', 401: 'Unauthorized',
+               404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+# Function to turn API query parameters into Dataset.filter arguments
+def filter_arguments(params):
+    def values(name):
+        return [value for values in params.get(name, []) for value in values.split(',') if value] or ['All']
+
+    def first(name, default=''):
+        return params.get(name, [default])[0]
+
+    filter_by = first('filter_by', 'Title')
+    if filter_by not in FILTER_BY_FIELDS and filter_by != FUZZY_FILTER:
+        raise ApiError(400, f"filter_by must be one of {', '.join(list(FILTER_BY_FIELDS) + [FUZZY_FILTER])}")
+    sort = first('sort') or None
+    if sort is not None and sort not in SORT_KEYS:
+        raise ApiError(400, f"sort must be one of {', '.join(SORT_KEYS)}")
+    return dict(query=first('query'), filter_by=filter_by, status_filters=values('status'), chapter_filters=values('chapter'),
+                character_filters=values('character'), order_by=sort, descending=first('descending') in ('1', 'true', 'yes'))
+
+def _int_param(params, name, default, low, high):
+    try:
+        value = int(params.get(name, [default])[0])
+    except ValueError:
+        raise ApiError(400, f"{name} must be a whole number")
+    return max(low, min(high, value))
+
+# Function to give a record as plain JSON data, with its key for POST /api/status
+def record_json(record):
+    return dict(record, key=record_iid(record))
+
+class ApiServer:
+    """ The HTTP server. It reads from get_dataset(), the dataset currently shown, on worker threads,
+    and hands status updates to edit(select, values) on a worker thread too; edit must select the records
+    (select(dataset) -> records), apply the values and return the changes, running that wherever the
+    data is owned, e.g. on the Tk thread. Call notify() after every edit so clients get change events.
+    """
+
+    def __init__(self, get_dataset, edit, host=API_HOST, port=API_PORT, token=None, describe=None):
+        self.get_dataset = get_dataset
+        self.edit = edit
+        self.host = host
+        self.port = port
+        self.token = token or None
+        self.describe = describe or (lambda: {})  # extra fields for GET /api/status, e.g. the game and profile
+        self.loop = None
+        self._server = None
+        self._thread = None
+        self._clients = set()   # the event queues of connected /api/events clients
+        self._cache = OrderedDict()  # (dataset version, describe() identity, request target) -> response body
+
+    def start(self):
+        """ Start serving on a background thread; raises OSError if the port cannot be opened """
+        started = threading.Event()
+        failure = []
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            try:
+                self._server = self.loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+            except OSError as e:
+                failure.append(e)
+                started.set()
+                self.loop.close()
+                return
+            started.set()
+            self.loop.run_forever()
+            self._server.close()
+            self.loop.run_until_complete(self._server.wait_closed())
+            self.loop.close()
+
+        self._thread = threading.Thread(target=run, name='api-server', daemon=True)
+        self._thread.start()
+        started.wait()
+        if failure:
+            raise failure[0]
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    def stop(self):
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self.loop.call_soon_threadsafe(self._shutdown)
+        self._thread.join(5)
+
+    def _shutdown(self):
+        for queue in self._clients:
+            # A slow client's queue may be full; the events left in it no longer matter
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+        self.loop.stop()
+
+    def notify(self, json_filename=None, changes=()):
+        """ Push a change event to the /api/events clients; safe to call from any thread """
+        if not self._clients or self.loop is None:
+            return
+        keys = sorted({key for key, _, _ in changes}) if changes else []
+        event = {'version': self.get_dataset().version, 'file': json_filename}
+        if keys and len(keys) <= API_EVENT_KEYS:
+            event['keys'] = keys
+        self.loop.call_soon_threadsafe(self._broadcast, event)
+
+    def _broadcast(self, event):
+        for queue in self._clients:
+            if queue.full():
+                # A slow client gets one event telling it to refetch instead of the backlog
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({'version': event['version'], 'file': event['file'], 'reset': True})
+            else:
+                queue.put_nowait(event)
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except ApiError as e:
+                    # The body was not read, so the connection cannot carry another request
+                    await self._respond(writer, e.status, {'error': str(e)})
+                    break
+                if request is None:
+                    break
+                method, target, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                try:
+                    if self.token and not self._authorized(target, headers):
+                        raise ApiError(401, "missing or wrong API token")
+                    keep_alive = await self._dispatch(writer, method, target, headers, body) and keep_alive
+                except ApiError as e:
+                    await self._respond(writer, e.status, {'error': str(e)})
+                except Exception as e:
+                    print(f"API error for {method} {target}: {e!r}")
+                    await self._respond(writer, 500, {'error': 'internal error'})
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, _ = line.decode('latin-1').split(' ', 2)
+        except ValueError:
+            raise ConnectionError('bad request line')
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get('content-length') or 0)
+        except ValueError:
+            raise ApiError(400, "bad Content-Length")
+        if length < 0:
+            raise ApiError(400, "bad Content-Length")
+        if length > API_MAX_BODY:
+            raise ApiError(413, f"the request body is larger than {API_MAX_BODY} bytes")
+        body = await reader.readexactly(length) if length else b''
+        return method.upper(), target, headers, body
+
+    def _authorized(self, target, headers):
+        if headers.get('authorization') == f'Bearer {self.token}':
+            return True
+        return parse_qs(urlsplit(target).query).get('token', [None])[0] == self.token
+
+    async def _dispatch(self, writer, method, target, headers, body):
+        """ Answer one request; returns False when the connection must not be reused """
+        url = urlsplit(target)
+        path = url.path.rstrip('/')
+        params = parse_qs(url.query)
+        if path == '/api/events':
+            await self._events(writer)
+            return False
+        if path == '/api/status' and method == 'POST':
+            await self._respond(writer, 200, await self._update_status(body))
+            return True
+        if method not in ('GET', 'HEAD'):
+            raise ApiError(405, f"{method} is not supported here")
+        dataset = self.get_dataset()
+        # Switching the profile or game need not change the dataset version, but it changes /api/status
+        identity = json.dumps(self.describe(), sort_keys=True)
+        etag = f'"{dataset.version}-{zlib.crc32(identity.encode()):08x}"'
+        if etag in (tag.strip() for tag in headers.get('if-none-match', '').split(',')):
+            await self._respond(writer, 304, None, etag=etag)
+            return True
+        if path == '/api/substories' and params.get('stream', ['0'])[0] in ('1', 'true', 'yes'):
+            await self._stream(writer, dataset, params, etag, method == 'HEAD')
+            return True
+        cache_key = (dataset.version, identity, target)
+        payload = self._cache.get(cache_key)
+        if payload is None:
+            if path == '/api/substories':
+                payload = await self._read(self._page, dataset, params)
+            elif path.startswith('/api/substories/'):
+                payload = await self._read(self._one, dataset, unquote(path[len('/api/substories/'):]))
+            elif path == '/api/status':
+                payload = await self._read(self._status, dataset)
+            else:
+                raise ApiError(404, f"no such endpoint: {path}")
+            payload = json.dumps(payload, default=json_default).encode()
+            if dataset.version == cache_key[0]:
+                # An edit that landed before the read is not what this version's ETag stands for
+                self._cache[cache_key] = payload
+                if len(self._cache) > API_RESPONSE_CACHE:
+                    self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(cache_key)
+        await self._respond(writer, 200, payload, etag=etag, head=method == 'HEAD')
+        return True
+
+    async def _read(self, func, dataset, *args):
+        """ Run func(dataset, *args) on a worker thread, holding the dataset's lock so no edit runs midway """
+        def run():
+            with dataset.lock:
+                return func(dataset, *args)
+        return await asyncio.get_running_loop().run_in_executor(None, run)
+
+    @traced('api.page')
+    def _page(self, dataset, params):
+        offset = _int_param(params, 'offset', 0, 0, 1 << 31)
+        limit = _int_param(params, 'limit', API_PAGE_SIZE, 1, API_MAX_PAGE_SIZE)
+        substories = dataset.filter(**filter_arguments(params))
+        return {'version': dataset.version, 'total': len(substories), 'offset': offset, 'limit': limit,
+                'items': [record_json(record) for record in substories[offset:offset + limit]]}
+
+    def _one(self, dataset, key):
+        record = dataset.store.get(key)
+        if record is None:
+            raise ApiError(404, f"no substory with key {key}")
+        return dict(record_json(record), version=dataset.version)
+
+    def _status(self, dataset):
+        return dict(self.describe(), file=dataset.json_filename, version=dataset.version, total=len(dataset.records),
+                    statuses=dict(dataset.facets.totals['status']))
+
+    async def _stream(self, writer, dataset, params, etag, head):
+        """ Send the whole filter result as newline-delimited JSON in chunks, without building one large body """
+        substories = await self._read(lambda dataset: dataset.filter(**filter_arguments(params)), dataset)
+        writer.write(self._head(200, {'Content-Type': 'application/x-ndjson', 'Transfer-Encoding': 'chunked', 'ETag': etag}))
+        if not head:
+            for start in range(0, len(substories), API_STREAM_CHUNK):
+                # Each chunk is encoded under the lock too, as the records may be edited between chunks
+                data = await self._read(self._chunk, dataset, substories[start:start + API_STREAM_CHUNK])
+                writer.write(b'%x\r\n%s\r\n' % (len(data), data))
+                await writer.drain()
+            writer.write(b'0\r\n\r\n')
+        await writer.drain()
+
+    @staticmethod
+    def _chunk(dataset, substories):
+        return ''.join(json.dumps(record_json(record), default=json_default) + '\n' for record in substories).encode()
+
+    async def _update_status(self, body):
+        try:
+            request = json.loads(body or b'{}')
+        except ValueError:
+            raise ApiError(400, "the body must be JSON")
+        if not isinstance(request, dict):
+            raise ApiError(400, "the body must be a JSON object")
+        status = request.get('status')
+        if status not in STATUSES:
+            raise ApiError(400, f"status must be one of {', '.join(STATUSES)}")
+        if 'keys' in request:
+            keys = request['keys']
+            if not isinstance(keys, list) or not all(isinstance(key, str) for key in keys):
+                raise ApiError(400, "keys must be a list of substory keys")
+
+            def select(dataset):
+                return [dataset.store[key] for key in keys if key in dataset.store]
+        elif 'filter' in request:
+            if not isinstance(request['filter'], dict):
+                raise ApiError(400, "filter must be an object of filter parameters")
+            arguments = filter_arguments({name: [str(item) for item in value] if isinstance(value, list) else [str(value)]
+                                          for name, value in request['filter'].items()})
+
+            def select(dataset):
+                return dataset.filter(**arguments)
+        else:
+            raise ApiError(400, "give the substories to update as keys or as a filter")
+        changes = await asyncio.get_running_loop().run_in_executor(None, self.edit, select, {'status': status})
+        return {'version': self.get_dataset().version, 'changed': len(changes)}
+
+    async def _events(self, writer):
+        queue = asyncio.Queue(API_EVENT_QUEUE)
+        self._clients.add(queue)
+        try:
+            writer.write(self._head(200, {'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache', 'Connection': 'keep-alive'}))
+            writer.write(b'retry: 2000\n\nevent: hello\ndata: %s\n\n' % json.dumps({'version': self.get_dataset().version}).encode())
+            await writer.drain()
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
+                writer.write(b'event: change\ndata: %s\n\n' % json.dumps(event).encode())
+                await writer.drain()
+        finally:
+            self._clients.discard(queue)
+
+    def _head(self, status, headers):
+        lines = [f'HTTP/1.1 {status} {STATUS_TEXT.get(status, "")}'] + [f'{name}: {value}' for name, value in headers.items()]
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+    async def _respond(self, writer, status, payload, etag=None, head=False):
+        if payload is not None and not isinstance(payload, bytes):
+            payload = json.dumps(payload, default=json_default).encode()
+        headers = {'Content-Type': 'application/json', 'Content-Length': len(payload or b''), 'Cache-Control': 'no-cache'}
+        if etag:
+            headers['ETag'] = etag
+        writer.write(self._head(status, headers))
+        if payload and not head and status != 304:
+            writer.write(payload)
+        await writer.drain()
@@ -1,79 +1,405 @@
-import json
 import os
-import sys
+import queue
+import threading
+import time
+from concurrent.futures import Future
 import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox
+from tkinter import simpledialog
+from tkinter import filedialog
 import configparser
-
-# Define the resource path function
-def resource_path(relative_path):
-    """ Get the absolute path to the resource, works for dev and for PyInstaller """
+from substories_api import API_HOST, API_PORT, ApiServer
+from substories_core import (
+    ABSENT_FIELD, DEFAULT_DATABASE, DEFAULT_PROFILE, FUZZY_FILTER, GAMES, PROGRESS_FIELDS, SNAPSHOT_COMPRESSIONS, STATUSES, WATCH_POLL_MS,
+    PROFILER, DatasetCache, FileWatcher, ProgressProfile, SqliteStore, WriteBehindSaver, apply_record_diff, commit_config, commit_generation,
+    export_records, import_records, list_profiles, load_config, load_revelation_dataset, merge_external_changes, note_generation,
+    read_json_records, record_changes, record_fingerprints, record_iid,
+    RecordStore, resource_path, sync_tree_rows, table_rows, traced, transfer_format, write_changes
+)
+
+startup_started = time.perf_counter()
+startup_marks = []  # (milestone, seconds since startup_started)
+
+# Function to note a startup milestone for the timing report
+def mark_startup(milestone):
+    startup_marks.append((milestone, time.perf_counter() - startup_started))
+
+# Function to finish the startup timing once the first frame is drawn; printed when [STARTUP] report is on
+def report_startup():
+    root.update_idletasks()
+    mark_startup('first paint')
+    if startup_report:
+        print("Startup: " + ', '.join(f"{milestone} {seconds * 1000:.0f} ms" for milestone, seconds in startup_marks))
+
+# Every Tk callback runs in a profiling span named after its function. Commands and bindings are
+# interactions, so "Profile Next Action" captures the next one; after() callbacks (polling) are not
+class ProfiledCallWrapper(tk.CallWrapper):
+    def __call__(self, *args):
+        if not PROFILER.enabled:
+            return super().__call__(*args)
+        name = getattr(self.func, '__name__', type(self.func).__name__)
+        if name == '<lambda>':
+            name = f"<lambda>:{self.func.__code__.co_firstlineno}"
+        with PROFILER.span('tk:' + name, interaction=not getattr(self.func, '__qualname__', '').startswith('Misc.after.')):
+            return super().__call__(*args)
+
+tk.CallWrapper = ProfiledCallWrapper
+
+performance_window = None
+
+# Function to open the performance overlay: rolling p50/p95 latency per span, trace export and a one-off cProfile capture
+def show_performance(event=None):
+    global performance_window
+    if performance_window is not None and performance_window.winfo_exists():
+        performance_window.deiconify()
+        performance_window.lift()
+        return
+    performance_window = window = themed(tk.Toplevel(root))
+    window.title("Performance")
+    window.geometry('560x360')
+
+    columns = ("Span", "Calls", "p50 ms", "p95 ms", "Max ms")
+    spans_tree = ttk.Treeview(window, columns=columns, show='headings')
+    for column in columns:
+        spans_tree.heading(column, text=column)
+        spans_tree.column(column, width=200 if column == "Span" else 80, anchor='w' if column == "Span" else 'e')
+    spans_tree.pack(expand=True, fill=tk.BOTH)
+
+    controls = ttk.Frame(window)
+    controls.pack(pady=5)
+    recording_var = tk.BooleanVar(value=PROFILER.enabled)
+
+    def toggle_recording():
+        PROFILER.enabled = recording_var.get()
+
+    def export_trace():
+        filename = filedialog.asksaveasfilename(parent=window, defaultextension='.json', initialfile='substories-trace.json',
+                                                filetypes=[("Chrome trace", "*.json")])
+        if filename:
+            PROFILER.export_trace(filename)
+
+    def profile_next():
+        recording_var.set(True)
+        PROFILER.enabled = True
+        PROFILER.capture_next(resource_path(time.strftime('profile-%Y%m%d-%H%M%S.prof')))
+        capture_label.configure(text="Profiling the next action...")
+
+    def refresh():
+        if not window.winfo_exists():
+            return
+        rows = [(name, (name, calls, f"{p50 * 1000:.2f}", f"{p95 * 1000:.2f}", f"{slowest * 1000:.2f}"))
+                for name, (calls, p50, p95, slowest) in sorted(PROFILER.stats().items(), key=lambda item: -item[1][2])]
+        sync_tree_rows(spans_tree, rows)
+        if PROFILER.last_capture is not None and capture_label.cget('text').endswith('...'):
+            capture_label.configure(text="Profiled {}: {}".format(*PROFILER.last_capture))
+        window.after(1000, refresh)
+
+    ttk.Checkbutton(controls, text="Record", variable=recording_var, command=toggle_recording).grid(row=0, column=0, padx=5)
+    ttk.Button(controls, text="Export Trace", command=export_trace).grid(row=0, column=1, padx=5)
+    ttk.Button(controls, text="Profile Next Action", command=profile_next).grid(row=0, column=2, padx=5)
+    ttk.Button(controls, text="Reset", command=PROFILER.reset).grid(row=0, column=3, padx=5)
+    capture_label = ttk.Label(window, text="")
+    capture_label.pack(pady=(0, 5))
+    refresh()
+
+# Function to queue edits to a dataset for the background saver; statuses go to the progress profile
+def persist_changes(records, json_filename, changes):
+    guide_changes = profile.record(json_filename, changes)
+    if profile.dirty:
+        save_profile()
+    # The SQLite backend also holds the statuses being shown, for its status filters
+    changes = changes if storage_backend is not None else guide_changes
+    if changes:
+        saver.submit(records, json_filename, changes, journal_enabled, lock=records_lock(records))
+    notify_api(json_filename, changes)
+
+# Function to get the lock that edits to a record list (the dataset's or the revelations) are made under
+def records_lock(records):
+    return revelations_lock if records is revelations else dataset.lock
+
+# Function to tell API clients that the data shown changed
+def notify_api(filename, changes=()):
+    if api_server is not None:
+        api_server.notify(filename, changes)
+
+# Function the API server calls, on one of its threads, for status updates; the edit runs on the Tk thread like one made in the table
+def api_edit(select, values):
+    done = Future()
+    api_calls.put((lambda: api_bulk_edit(select, values), done))
+    return done.result(API_EDIT_TIMEOUT)
+
+def api_bulk_edit(select, values):
+    (field, value), = values.items()
+    changes = dataset.bulk_edit(select(dataset), values, f"{field} to {value} (API)")
+    finish_bulk_edit(changes)
+    return changes
+
+# Function to run the calls the API server handed over to the Tk thread
+def poll_api_calls():
+    while True:
+        try:
+            func, done = api_calls.get_nowait()
+        except queue.Empty:
+            break
+        if done.set_running_or_notify_cancel():
+            try:
+                done.set_result(func())
+            except Exception as e:
+                done.set_exception(e)
+    root.after(API_POLL_MS, poll_api_calls)
+
+# Function to start the HTTP/JSON API server when [API] enabled is set
+def start_api():
+    global api_server
+    server = ApiServer(lambda: dataset, api_edit, api_host, api_port, api_token,
+                       describe=lambda: {'game': json_filename_var.get(), 'profile': profile.name})
     try:
-        # PyInstaller creates a temp folder and stores the path in _MEIPASS
-        base_path = sys._MEIPASS
-    except Exception:
-        base_path = os.path.abspath(".")
-    return os.path.join(base_path, relative_path)
-
-# Function to load data from JSON file
-def load_data(json_filename):
-    json_path = resource_path(json_filename)
-    with open(json_path, 'r') as file:
-        return json.load(file)
-
-# Function to save data to JSON file
-def save_data(substories, json_filename):
-    json_path = resource_path(json_filename)
-    with open(json_path, 'w') as file:
-        json.dump(substories, file, indent=4)
-
-# Function to load revelations from JSON file
-def load_revelations(json_filename):
-    json_path = resource_path(json_filename)
-    with open(json_path, 'r') as file:
-        return json.load(file)
-
-# Function to save revelations data to JSON file
-def save_revelations(revelations, json_filename):
-    json_path = resource_path(json_filename)
-    with open(json_path, 'w') as file:
-        json.dump(revelations, file, indent=4)
-
-# Function to filter substories
-def filter_substories(query, substories, filter_by, status_filters, chapter_filters, character_filters=[]):
-    filtered = substories
-    if filter_by == 'ID':
-        filtered = [substory for substory in substories if query in str(substory['id'])]
-    elif filter_by == 'Title':
-        filtered = [substory for substory in filtered if query.lower() in substory['title'].lower()]
-    elif filter_by == 'Description':
-        filtered = [substory for substory in filtered if query.lower() in substory['description'].lower()]
-
-    if 'All' not in status_filters:
-        filtered = [substory for substory in filtered if substory['status'] in status_filters]
-    
-    if 'All' not in chapter_filters:
-        filtered = [substory for substory in filtered if substory.get('available from', '') in chapter_filters]
+        server.start()
+    except OSError as e:
+        print(f"Error starting the API server on {api_host}:{api_port}: {e}")
+        return
+    api_server = server
+    print(f"API server listening on http://{api_host}:{server.port}/api/substories")
+    poll_api_calls()
+
+def save_profile():
+    saver.submit_snapshot(profile.snapshot(), profile.filename)
+
+# Function to show the current profile's statuses in the open dataset, revelations and table
+def show_profile():
+    dataset.apply_progress(profile)
+    if revelations_filename is not None:
+        with revelations_lock:
+            profile.apply(revelations_filename, revelations)
+        if revelations_tree.winfo_exists():
+            refresh_revelations_table(revelations_tree, revelations)
+    if profile.dirty:
+        save_profile()
+    update_facet_counts()
+    refresh_table(tree, current_filtered_substories())
+    update_undo_buttons()
+    notify_api(json_filename)
+
+# Function to switch to another progress profile
+def switch_profile(new_profile):
+    global profile
+    saver.flush()
+    if file_watcher is not None:
+        file_watcher.unwatch(profile.filename)
+    profile = new_profile
+    if file_watcher is not None:
+        file_watcher.watch(profile.filename)
+    show_profile()
+    profile_combobox['values'] = sorted(set(list_profiles()) | {profile.name}, key=str.casefold)
+    profile_combobox.set(profile.name)
+
+def change_profile(event):
+    if profile_combobox.get() != profile.name:
+        switch_profile(ProgressProfile.load(profile_combobox.get()))
+
+def new_profile():
+    name = simpledialog.askstring("New Profile", "Name of the new profile:", parent=root)
+    if not name:
+        return
+    try:
+        created = ProgressProfile.create(name.strip())
+    except ValueError as e:
+        messagebox.showerror("Invalid Profile", str(e))
+        return
+    switch_profile(created)
+
+# Function to take the statuses another program changed in the current profile's file
+def merge_profile_edits():
+    try:
+        fresh = ProgressProfile.load(profile.name)
+    except (OSError, ValueError) as e:
+        print(f"Error reading profile {profile.name} after an outside change: {e}")
+        return
+    profile.merge(fresh)
+    show_profile()
+
+
+# Function to start watching a data file for outside edits, remembering its contents to merge them against
+def watch_data_file(filename):
+    global watch_fd
+    if file_watcher is None or storage_backend is not None or filename is None or filename in disk_fingerprints:
+        return
+    file_watcher.watch(filename)
+    try:
+        disk_fingerprints[filename] = record_fingerprints(read_json_records(filename))
+    except (OSError, ValueError) as e:
+        print(f"Error reading {filename}: {e}")
+        file_watcher.unwatch(filename)
+    if watch_fd is not None and file_watcher.fileno() is None:
+        # inotify gave up on this directory; poll instead
+        root.tk.deletefilehandler(watch_fd)
+        watch_fd = None
+        root.after(WATCH_POLL_MS, poll_data_files)
+
+def unwatch_data_file(filename):
+    if file_watcher is not None:
+        file_watcher.unwatch(filename)
+        disk_fingerprints.pop(filename, None)
+
+# Function to pick up watched data files that changed on disk
+def check_data_files(*args):
+    for filename, ours in file_watcher.check():
+        if filename == profile.filename:
+            if not ours:
+                merge_profile_edits()
+            continue
+        if filename not in disk_fingerprints:
+            continue
+        if ours:
+            # Our own save: the file now holds what we wrote
+            try:
+                disk_fingerprints[filename] = record_fingerprints(read_json_records(filename))
+            except (OSError, ValueError) as e:
+                print(f"Error reading {filename}: {e}")
+        else:
+            merge_outside_edits(filename)
 
-    if 'All' not in character_filters:
-        filtered = [substory for substory in filtered if substory.get('character', '') in character_filters]
+def poll_data_files():
+    if file_watcher.fileno() is None:
+        check_data_files()
+        root.after(WATCH_POLL_MS, poll_data_files)
 
-    return filtered
+# Function to merge edits made to a data file by another program into the open dataset and table
+def merge_outside_edits(filename):
+    global revelation_store
+    generation = commit_generation(filename)
+    try:
+        fresh = read_json_records(filename)
+    except (OSError, ValueError) as e:
+        # Most likely caught mid-write; the writer finishing triggers another check
+        print(f"Error reading {filename} after an outside change: {e}")
+        return
+    records = dataset.records if filename == json_filename else revelations
+    changed, added, removed, conflicts, disk_fingerprints[filename] = merge_external_changes(records, fresh, disk_fingerprints[filename], PROGRESS_FIELDS)
+    # Our records now hold everything committed up to here, so our next commit need not merge on disk
+    note_generation(filename, generation)
+    if conflicts:
+        titles = sorted({str(record.get('title', record_iid(record))) for record, _, _, _ in conflicts})
+        keep = messagebox.askyesno(
+            "Conflicting Edits",
+            f"{filename} was changed by another program, and {len(conflicts)} of your edits conflict with it:\n\n"
+            + '\n'.join(titles[:10]) + ('\n...' if len(titles) > 10 else '')
+            + "\n\nKeep your edits? Choose No to take the values from the file."
+        )
+        if not keep:
+            changed += [(record, {field: value}) for record, field, _, value in conflicts]
+            # Journal the file's values too, so replaying our earlier edits cannot bring ours back
+            persist_changes(records, filename, [(record_iid(record), field, value) for record, field, _, value in conflicts if value is not ABSENT_FIELD])
+    if not (changed or added or removed):
+        return
+    if filename == json_filename:
+        dataset.apply_diff(changed, added, removed)
+        dataset_cache.refreshed(dataset)
+        update_facet_counts()
+        refresh_table(tree, current_filtered_substories())
+        notify_api(filename)
+    else:
+        with revelations_lock:
+            apply_record_diff(revelations, changed, added, removed)
+        if added or removed:
+            revelation_store = RecordStore(revelations)
+        if revelations_tree.winfo_exists():
+            refresh_revelations_table(revelations_tree, revelations)
 
 # Function to refresh the table view
+@traced()
 def refresh_table(tree, substories):
-    for row in tree.get_children():
-        tree.delete(row)
-    for substory in substories:
-        if json_filename == 'y4subst.json':
-            values = (substory['id'], substory['title'], substory['description'], substory['available from'], substory['status'], substory['character'])
+    sync_tree_rows(tree, table_rows(substories, game.columns))
+
+class LiveSearch:
+    """ Search-as-you-type: debounces key events and runs the filters on a worker thread.
+
+    Only the newest query matters. A query still waiting for the worker is replaced by a
+    newer one, and results of a query that was overtaken are dropped. Results are handed
+    back to the Tk thread by polling with root.after, so no Tk call happens off the main thread.
+    """
+
+    def __init__(self, root, delay_ms=100, poll_ms=16):
+        self.root = root
+        self.delay_ms = delay_ms
+        self.poll_ms = poll_ms
+        self.generation = 0
+        self._after_id = None
+        self._polling = False
+        self._cond = threading.Condition()
+        self._request = None
+        self._running = False
+        self._result = None
+        self._thread = threading.Thread(target=self._run, name='live-search', daemon=True)
+        self._thread.start()
+
+    def schedule(self, event=None):
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+        self._after_id = self.root.after(self.delay_ms, self._dispatch)
+
+    def cancel(self):
+        """ Drop pending and in-flight queries, e.g. because the table is being refreshed synchronously """
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+            self._after_id = None
+        with self._cond:
+            self.generation += 1
+            self._request = None
+
+    def _dispatch(self):
+        self._after_id = None
+        query, filter_by, status_filters, chapter_filters, character_filters = get_current_filters()
+        args = (query, filter_by, status_filters or ['All'], chapter_filters or ['All'], character_filters or ['All'])
+        with self._cond:
+            self.generation += 1
+            self._request = (self.generation, args)
+            self._cond.notify()
+        if not self._polling:
+            self._polling = True
+            self.root.after(self.poll_ms, self._poll)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._request is None:
+                    self._cond.wait()
+                generation, args = self._request
+                self._request = None
+                self._running = True
+            result = error = None
+            try:
+                # Dataset.filter holds the dataset's lock, so edits on the Tk thread wait for it and vice versa
+                result = run_filter(*args)
+            except Exception as e:
+                # e.g. sqlite3.OperationalError from the SQLite backend; the worker lives on for the next query
+                error = e
+            finally:
+                with self._cond:
+                    self._running = False
+                    if generation == self.generation:
+                        self._result = (generation, args, result, error)
+
+    def _poll(self):
+        with self._cond:
+            delivered, self._result = self._result, None
+            waiting = self._request is not None or self._running
+        if delivered is not None:
+            generation, args, result, error = delivered
+            if generation == self.generation:
+                label_search_error.config(text="" if error is None else f"Search failed: {error}")
+                if error is None:
+                    refresh_table(tree, result)
+        if waiting:
+            self.root.after(self.poll_ms, self._poll)
         else:
-            values = (substory['id'], substory['title'], substory['description'], substory['available from'], substory['status'])
-        tree.insert("", "end", values=values)
+            self._polling = False
 
 # Function to handle filtering
+@traced()
 def on_filter():
+    live_search.cancel()
     query, filter_by, status_filters, chapter_filters, character_filters = get_current_filters()
     if not status_filters:
         status_filters = ['All']
@@ -81,60 +407,197 @@ def on_filter():
         chapter_filters = ['All']
     if not character_filters:
         character_filters = ['All']
-    filtered_substories = filter_substories(query, substories, filter_by, status_filters, chapter_filters, character_filters)
+    filtered_substories = run_filter(query, filter_by, status_filters, chapter_filters, character_filters)
     if 'chapter 10' in chapter_filters:
         messagebox.showinfo("Chapter 10 Reminder", "Remember to check substories started previously, some of them can only be completed from now on !!!")
     if not filtered_substories:
         messagebox.showinfo("No Substories Found", "No substories found matching the filters.")
     refresh_table(tree, filtered_substories)
 
+# Function to run the filters, in the current sort order
+def run_filter(query, filter_by, status_filters, chapter_filters, character_filters):
+    return dataset.filter(query, filter_by, status_filters, chapter_filters, character_filters, current_sort)
+
+# Function to re-run the current filters, e.g. after an edit
+def current_filtered_substories():
+    # The table is about to be refreshed synchronously, so any live search in flight is obsolete
+    live_search.cancel()
+    query, filter_by, status_filters, chapter_filters, character_filters = get_current_filters()
+    return run_filter(query, filter_by, status_filters or ['All'], chapter_filters or ['All'], character_filters or ['All'])
+
 # Function to get current filter settings
 def get_current_filters():
     return (entry_search.get(), filter_option.get(),
-            [status_listbox.get(i) for i in status_listbox.curselection()],
-            [chapter_listbox.get(i) for i in chapter_listbox.curselection()],
-            [character_listbox.get(i) for i in character_listbox.curselection()] if json_filename == 'y4subst.json' else [])
+            selected_values(status_listbox), selected_values(chapter_listbox),
+            selected_values(character_listbox) if game.characters else [])
+
+# Function to get the filter values selected in a listbox (its rows also show counts)
+def selected_values(listbox):
+    return [listbox.values[i] for i in listbox.curselection()]
+
+# Function to fill a filter listbox with values; update_facet_counts adds the counts
+def fill_facet_listbox(listbox, values):
+    listbox.values = list(values)
+    listbox.delete(0, tk.END)
+    for value in listbox.values:
+        listbox.insert(tk.END, value)
+
+# Function to label the filter listboxes with live counts, e.g. "chapter 4 (23/41 done)"
+def update_facet_counts():
+    facets = dataset.facets
+    all_done, all_total = facets.totals['status']['Completed'], len(dataset.records)
+    for facet, listbox in (('status', status_listbox), ('chapter', chapter_listbox), ('character', character_listbox)):
+        counts = facets.counts(facet)
+        for position, value in enumerate(listbox.values):
+            done, total = (all_done, all_total) if value == 'All' else counts.get(value, (0, 0))
+            text = f"{value} ({total})" if facet == 'status' else f"{value} ({done}/{total} done)"
+            if listbox.get(position) != text:
+                # Listbox rows cannot be relabelled in place; replace the row and keep its selection
+                selected = listbox.selection_includes(position)
+                listbox.delete(position)
+                listbox.insert(position, text)
+                if selected:
+                    listbox.selection_set(position)
 
 # Function to handle status change
 def change_status(event):
-    selected_items = tree.selection()
-    if selected_items:
-        new_status = status_combobox.get()
-        selected_ids = [int(tree.item(item, 'values')[0]) for item in selected_items]
-        for substory_id in selected_ids:
-            substory = next(sub for sub in substories if sub['id'] == substory_id)
-            substory['status'] = new_status
-        save_data(substories, json_filename)
-
-        # Get current filters and reapply them after saving data
-        query, filter_by, status_filters, chapter_filters, character_filters = get_current_filters()
-        filtered_substories = filter_substories(query, substories, filter_by, status_filters, chapter_filters, character_filters)
-        refresh_table(tree, filtered_substories)
-
-        # Re-select the items based on their IDs
-        for item in tree.get_children():
-            if int(tree.item(item, 'values')[0]) in selected_ids:
-                tree.selection_add(item)
-                tree.focus(item)
-
-# Function to handle sorting columns
-def sort_by_column(column_index):
-    global substories
-    if column_index == 0:  # Sort by ID
-        substories = sorted(substories, key=lambda x: x['id'], reverse=sort_reverse[column_index])
-    elif column_index == 1:  # Sort by Title
-        substories = sorted(substories, key=lambda x: x['title'], reverse=sort_reverse[column_index])
-    elif column_index == 2:  # Sort by Description
-        substories = sorted(substories, key=lambda x: x['description'], reverse=sort_reverse[column_index])
-    elif column_index == 3:  # Sort by Character (Yakuza 4 only)
-        substories = sorted(substories, key=lambda x: x.get('character', ''), reverse=sort_reverse[column_index])
-    elif column_index == 4:  # Sort by Available From
-        substories = sorted(substories, key=lambda x: x.get('available from', ''), reverse=sort_reverse[column_index])
-    elif column_index == 5:  # Sort by Status
-        substories = sorted(substories, key=lambda x: x['status'], reverse=sort_reverse[column_index])
-    
-    sort_reverse[column_index] = not sort_reverse[column_index]
-    refresh_table(tree, substories)
+    bulk_edit('status', status_combobox.get())
+
+# Function to handle chapter change
+def change_chapter(event):
+    bulk_edit('available from', chapter_combobox.get())
+
+# Function to set a field on the selected rows, or on every row of the current filter result, as one undoable edit
+def bulk_edit(field, value):
+    if apply_to_var.get() == APPLY_TO_FILTERED:
+        substories = current_filtered_substories()
+        if len(substories) > 1 and not messagebox.askyesno(
+                "Change All Filtered", f"Set {field} to \"{value}\" for all {len(substories)} substories in the current view?"):
+            return
+    else:
+        substories = [dataset.store[item] for item in tree.selection()]
+    if substories:
+        finish_bulk_edit(dataset.bulk_edit(substories, {field: value}, f"{field} to {value}"))
+
+# Function to save the changes of a bulk edit, undo or redo in one write and show them in one table update
+def finish_bulk_edit(changes):
+    if changes:
+        persist_changes(dataset.records, json_filename, changes)
+        update_facet_counts()
+
+        # Reapply the current filters; rows keep their item IDs, so the selection survives
+        refresh_table(tree, current_filtered_substories())
+    update_undo_buttons()
+
+# Function to merge substories from a JSON Lines or CSV file, e.g. a community guide, into the open game by ID
+def import_substories():
+    filename = filedialog.askopenfilename(parent=root, title="Import Substories", filetypes=TRANSFER_FILETYPES)
+    if not filename:
+        return
+    try:
+        with open(filename, 'r', newline='', encoding='utf-8') as file:
+            result = import_records(dataset.records, file, transfer_format(filename), 'substories', game)
+    except (OSError, ValueError) as e:
+        messagebox.showerror("Import Failed", str(e))
+        return
+    report = f"{os.path.basename(filename)}: {result.summary()}." + ''.join(f"\nLine {line}: {message}" for line, message in result.errors[:10])
+    if not (result.changed or result.added):
+        messagebox.showinfo("Import", report)
+        return
+    if not messagebox.askyesno("Import", report + "\n\nApply these changes?"):
+        return
+    dataset.apply_diff(result.changed, result.added)
+    if result.added:
+        # New records cannot be journaled, so they are written now, after any edits still queued
+        saver.flush()
+        guide_changes = profile.record(json_filename, result.changes)
+        if profile.dirty:
+            save_profile()
+        try:
+            write_changes(dataset.records, json_filename, result.changes if storage_backend is not None else guide_changes,
+                          journal_enabled, storage_backend, result.added)
+        except OSError as e:
+            messagebox.showerror("Import Failed", f"Error saving {json_filename}: {e}")
+        notify_api(json_filename, result.changes)
+    else:
+        persist_changes(dataset.records, json_filename, result.changes)
+    update_facet_counts()
+    refresh_table(tree, current_filtered_substories())
+
+# Function to write the substories in the current view, in its order, to a JSON Lines or CSV file
+def export_view():
+    filename = filedialog.asksaveasfilename(parent=root, title="Export View", defaultextension='.csv', filetypes=TRANSFER_FILETYPES)
+    if not filename:
+        return
+    try:
+        output_format = transfer_format(filename)
+        with open(filename, 'w', newline='', encoding='utf-8') as file:
+            export_records(current_filtered_substories(), file, output_format)
+    except (OSError, ValueError) as e:
+        messagebox.showerror("Export Failed", str(e))
+
+def undo_edit(event=None):
+    finish_bulk_edit(dataset.undo())
+
+def redo_edit(event=None):
+    finish_bulk_edit(dataset.redo())
+
+# Function to enable the undo and redo buttons when there is something to undo or redo, naming the edit
+def update_undo_buttons():
+    history = dataset.history
+    button_undo.config(state=tk.NORMAL if history.done else tk.DISABLED,
+                       text=f"Undo {history.done[-1].label}" if history.done else "Undo")
+    button_redo.config(state=tk.NORMAL if history.undone else tk.DISABLED,
+                       text=f"Redo {history.undone[-1].label}" if history.undone else "Redo")
+
+# Function to handle sorting columns; extend (shift-click) adds the column as a tie-breaker
+@traced()
+def sort_by_column(column, extend=False):
+    global current_sort
+    directions = dict(current_sort)
+    if extend and column in directions:
+        current_sort = [(c, not d if c == column else d) for c, d in current_sort]
+    elif extend:
+        current_sort = current_sort + [(column, False)]
+    elif [c for c, _ in current_sort] == [column]:
+        current_sort = [(column, not directions[column])]
+    else:
+        current_sort = [(column, False)]
+    update_sort_indicators()
+    refresh_table(tree, current_filtered_substories())
+
+# Function to handle shift-clicks on the table headings
+def on_heading_shift_click(event):
+    if tree.identify_region(event.x, event.y) == 'heading':
+        sort_by_column(tree.column(tree.identify_column(event.x), 'id'), extend=True)
+        return 'break'
+
+# Function to show the sort direction (and priority, when sorting by several columns) in the headings
+def update_sort_indicators():
+    positions = {column: (number, descending) for number, (column, descending) in enumerate(current_sort, 1)}
+    for column in tree['columns']:
+        text = column
+        if column in positions:
+            number, descending = positions[column]
+            text += ' \u25bc' if descending else ' \u25b2'
+            if len(current_sort) > 1:
+                text += str(number)
+        tree.heading(column, text=text)
+
+# Function to set up the table columns for the current game
+def configure_table_columns():
+    global current_sort
+    columns = game.columns
+    if tuple(tree['columns']) != columns:
+        # Rows of the other game are laid out differently; start from an empty table
+        tree.delete(*tree.get_children())
+        tree.shown_values = {}
+        tree['columns'] = columns
+        for column in columns:
+            tree.heading(column, command=lambda column=column: sort_by_column(column))
+            tree.column(column, width=column_widths.get(column) or game.column_width(column))
+    current_sort = [(column, descending) for column, descending in current_sort if column in columns]
+    update_sort_indicators()
 
 # Function to change font size only for the Treeview
 def change_font_size(delta):
@@ -158,7 +621,7 @@ def change_detail_font_size(detail_frame, description_text, delta):
     detail_font_size += delta
     new_font = (current_font_family, detail_font_size)
     for widget in detail_frame.winfo_children():
-        if isinstance(widget, (tk.Label, tk.Entry, tk.Text, ttk.Combobox, tk.Button)):
+        if isinstance(widget, (ttk.Label, ttk.Entry, tk.Text)):
             widget.configure(font=new_font)
     description_text.configure(font=new_font)
 
@@ -168,302 +631,273 @@ def reset_detail_font_size(detail_frame, description_text):
     detail_font_size = default_font_size
     new_font = (current_font_family, detail_font_size)
     for widget in detail_frame.winfo_children():
-        if isinstance(widget, (tk.Label, tk.Entry, tk.Text, ttk.Combobox, tk.Button)):
+        if isinstance(widget, (ttk.Label, ttk.Entry, tk.Text)):
             widget.configure(font=new_font)
     description_text.configure(font=new_font)
 
-def apply_theme_to_widget(widget, widget_style):
-    try:
-        if isinstance(widget, tk.Entry):
-            widget.configure(background='#333333', foreground='#FFFFFF')
-        elif isinstance(widget, tk.Text):
-            widget.configure(background='#333333', foreground='#FFFFFF')
-        elif isinstance(widget, ttk.Combobox):
-            widget_style.configure("TCombobox", fieldbackground='#555555', background='#333333', foreground='#FFFFFF')
-        elif isinstance(widget, tk.Frame):
-            widget.configure(background='#333333')
-        elif isinstance(widget, tk.Label):
-            widget.configure(background='#333333', foreground='#FFFFFF')
-        elif isinstance(widget, tk.Button):
-            widget.configure(background='#333333', foreground='#FFFFFF')
-        elif isinstance(widget, ttk.Button):
-            widget_style.configure("TButton", background='#333333', foreground='#FFFFFF')
-    except tk.TclError as e:
-        print(f"Error configuring widget: {e}")
-
-def apply_theme_to_window(window, widgets):
-    widget_style = ttk.Style()
-    if dark_mode_var.get():
-        window.configure(background='#333333')
-        for widget in widgets:
-            apply_theme_to_widget(widget, widget_style)
-            if isinstance(widget, tk.Frame):
-                for child in widget.winfo_children():
-                    apply_theme_to_widget(child, widget_style)
-    else:
-        window.configure(background='#f0f0f0')
-        for widget in widgets:
-            try:
-                if isinstance(widget, tk.Entry):
-                    widget.configure(background='#FFFFFF', foreground='#000000')
-                elif isinstance(widget, tk.Text):
-                    widget.configure(background='#FFFFFF', foreground='#000000')
-                elif isinstance(widget, ttk.Combobox):
-                    widget_style.configure("TCombobox", fieldbackground='#FFFFFF', background='#f0f0f0', foreground='#000000')
-                elif isinstance(widget, tk.Frame):
-                    widget.configure(background='#f0f0f0')
-                elif isinstance(widget, tk.Label):
-                    widget.configure(background='#f0f0f0', foreground='#000000')
-                elif isinstance(widget, tk.Button):
-                    widget.configure(background='#f0f0f0', foreground='#000000')
-                elif isinstance(widget, ttk.Button):
-                    widget_style.configure("TButton", background='#f0f0f0', foreground='#000000')
-                if isinstance(widget, tk.Frame):
-                    for child in widget.winfo_children():
-                        if isinstance(child, tk.Entry):
-                            child.configure(background='#FFFFFF', foreground='#000000')
-                        elif isinstance(child, tk.Text):
-                            child.configure(background='#FFFFFF', foreground='#000000')
-                        elif isinstance(child, ttk.Combobox):
-                            widget_style.configure("TCombobox", fieldbackground='#FFFFFF', background='#f0f0f0', foreground='#000000')
-                        elif isinstance(child, tk.Frame):
-                            child.configure(background='#f0f0f0')
-                        elif isinstance(child, tk.Label):
-                            child.configure(background='#f0f0f0', foreground='#000000')
-                        elif isinstance(child, tk.Button):
-                            child.configure(background='#f0f0f0', foreground='#000000')
-                        elif isinstance(child, ttk.Button):
-                            widget_style.configure("TButton", background='#f0f0f0', foreground='#000000')
-            except tk.TclError as e:
-                print(f"Error configuring widget: {e}")
-
+class DetailEditor:
+    """ The detail window for one record type, built once and reused for every record opened.
+
+    Records open as tabs, but the tabs are only labels: all of them share one form, which is
+    refilled in place when another tab is selected. The edits of a record are applied when its
+    tab is left or closed, and closing the window hides it for the next double-click. Once
+    max_tabs records are open, the oldest tab is reused for the next one.
+    """
+    max_tabs = 8
+
+    def __init__(self, noun, fields, store, lock, commit, set_status):
+        self.noun = noun            # shown in the window title
+        self.fields = fields        # (label, field, kind): kind is 'entry', 'text', or a function returning the choices
+        self.store = store          # function returning the RecordStore the records belong to
+        self.lock = lock            # function returning the lock edits to the records are made under
+        self.commit = commit        # commit(record, changes) after edits were applied to record
+        self.set_status = set_status
+        self.window = None
+        self.records = []           # the open records, in tab order
+        self.current = None
+        self._tabs = []
+        self._spare_tabs = []
+
+    @traced('detail_window.build')
+    def _build(self):
+        self.window = themed(tk.Toplevel(root))
+        self.window.geometry('900x430')
+        self.window.resizable(True, True)  # Enable resizing
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+        self.notebook = ttk.Notebook(self.window)
+        self.notebook.pack(side="top", fill="x")
+        self.notebook.bind("<<NotebookTabChanged>>", self._tab_changed)
+
+        # Adding a canvas and scrollbar for the form
+        self.canvas = themed(tk.Canvas(self.window, highlightthickness=0))
+        v_scrollbar = ttk.Scrollbar(self.window, orient="vertical", command=self.canvas.yview)
+        h_scrollbar = ttk.Scrollbar(self.window, orient="horizontal", command=self.canvas.xview)
+        self.canvas.configure(yscrollcommand=v_scrollbar.set, xscrollcommand=h_scrollbar.set)
+        v_scrollbar.pack(side="right", fill="y")
+        h_scrollbar.pack(side="bottom", fill="x")
+        self.canvas.pack(side="left", fill="both", expand=True)
+
+        form = ttk.Frame(self.canvas)
+        self.canvas.create_window((0, 0), window=form, anchor="nw")
+        form.bind("<Configure>", lambda e: self.canvas.configure(scrollregion=self.canvas.bbox("all")))
+        form.grid_columnconfigure(1, weight=1)
+
+        self.inputs = {}
+        for row, (label, field, kind) in enumerate(self.fields):
+            ttk.Label(form, text=f"{label}:").grid(row=row, column=0, sticky='ne' if kind == 'text' else 'e', padx=5, pady=5)
+            if kind == 'entry':
+                widget = ttk.Entry(form)
+            elif kind == 'text':
+                widget = themed(tk.Text(form, wrap=tk.WORD, height=10, width=80))
+            else:
+                widget = ttk.Combobox(form)
+            widget.grid(row=row, column=1, sticky='w', padx=5, pady=5)
+            self.inputs[field] = widget
+        if 'status' in self.inputs:
+            self.inputs['status'].bind("<<ComboboxSelected>>", lambda e: self.set_status(self.current, self.inputs['status'].get()))
+
+        # Adding font size controls and closing the current tab
+        button_frame = ttk.Frame(form)
+        button_frame.grid(row=len(self.fields), column=0, columnspan=2, pady=10)
+        description_text = self.inputs.get('description')
+        buttons = [
+            ("Increase Font Size", lambda: change_detail_font_size(form, description_text, 2)),
+            ("Decrease Font Size", lambda: change_detail_font_size(form, description_text, -2)),
+            ("Reset Font Size", lambda: reset_detail_font_size(form, description_text)),
+            ("Close Tab", self.close_tab),
+        ]
+        for column, (text, command) in enumerate(buttons):
+            button_frame.grid_columnconfigure(column, weight=1)
+            ttk.Button(button_frame, text=text, command=command).grid(row=0, column=column, padx=5)
+
+    # Function to open a record, in its own tab if it is not open yet
+    @traced('detail_window.open')
+    def open(self, record):
+        if self.window is None:
+            self._build()
+        if not self._apply():
+            return
+        index = self._index(record)
+        if index is None:
+            if len(self.records) < self.max_tabs:
+                tab = self._spare_tabs.pop() if self._spare_tabs else ttk.Frame(self.notebook, height=1)
+            else:
+                # Reuse the oldest tab, moving it to the end
+                tab = self._tabs.pop(0)
+                self.records.pop(0)
+                self.notebook.forget(tab)
+            self.notebook.add(tab)
+            self._tabs.append(tab)
+            self.records.append(record)
+            index = len(self.records) - 1
+        self._show(index)
+        self.window.deiconify()
+        self.window.lift()
+
+    # Function to fill the form with the record of a tab
+    def _show(self, index):
+        record = self.current = self.records[index]
+        for label, field, kind in self.fields:
+            widget = self.inputs[field]
+            if kind == 'entry':
+                widget.delete(0, tk.END)
+                widget.insert(0, record.get(field, ''))
+            elif kind == 'text':
+                widget.delete("1.0", tk.END)
+                widget.insert(tk.END, record.get(field, ''))
+            else:
+                widget.configure(values=kind())
+                widget.set(record.get(field, ''))
+        self._label(index)
+        self.window.title(f"Details of {self.noun} {record['id']}")
+        self.notebook.select(self._tabs[index])
+        self.canvas.yview_moveto(0)
+
+    # Function to find an open record's tab; records are compared by identity, as equal records can be open twice
+    def _index(self, record):
+        return next((i for i, open_record in enumerate(self.records) if open_record is record), None)
+
+    def _label(self, index):
+        record = self.records[index]
+        title = record.get('title', '')
+        self.notebook.tab(self._tabs[index], text=f"{record['id']} {title[:24] + '…' if len(title) > 25 else title}")
+
+    # Function to apply the form's edits to the current record; returns False if the ID was rejected
+    def _apply(self):
+        record = self.current
+        if record is None:
+            return True
+        changes = apply_id_edit(self.store(), self.lock(), record, self.inputs['id'].get(), self.window)
+        if changes is None:
+            return False
+        edited = {}
+        for label, field, kind in self.fields:
+            if field != 'id':
+                edited[field] = self.inputs[field].get("1.0", tk.END).strip() if kind == 'text' else self.inputs[field].get()
+        changes += record_changes(record, edited)
+        if changes:
+            # The live search, the API and the saver read the records on other threads, under their lock
+            with self.lock():
+                record.update(edited)
+                self.commit(record, changes)
+            self._label(self._index(record))
+        return True
+
+    def _tab_changed(self, event):
+        if not self.records:
+            return
+        index = self.notebook.index('current')
+        if self.records[index] is self.current:
+            return
+        if self._apply():
+            self._show(index)
+        else:
+            self.notebook.select(self._tabs[self._index(self.current)])
+
+    def _forget(self, index):
+        tab = self._tabs.pop(index)
+        self.records.pop(index)
+        self.notebook.forget(tab)
+        self._spare_tabs.append(tab)
+
+    # Function to close the current tab, applying its edits
+    def close_tab(self):
+        if not self._apply():
+            return
+        index = self._index(self.current)
+        self.current = None
+        self._forget(index)
+        if self.records:
+            self._show(min(index, len(self.records) - 1))
+        else:
+            self.window.withdraw()
+
+    # Function to apply the current edits and hide the window; with force the tabs are closed even if the edits were rejected
+    def close(self, force=False):
+        if self.window is None or not (self._apply() or force):
+            return
+        self.current = None
+        while self.records:
+            self._forget(0)
+        self.window.withdraw()
+
+# Function to open the selected substory in the substory detail window
 def show_details(event):
     selected_item = tree.selection()
     if selected_item:
-        substory_id = int(tree.item(selected_item, 'values')[0])
-        substory = next(sub for sub in substories if sub['id'] == substory_id)
-        
-        detail_window = tk.Toplevel(root)
-        detail_window.title(f"Details of Substory {substory['id']}")
-        detail_window.geometry('900x400')
-        detail_window.resizable(True, True)  # Enable resizing
-        
-        # Adding a canvas and scrollbar for the entire detail window
-        canvas = tk.Canvas(detail_window, background='#333333' if dark_mode_var.get() else '#f0f0f0')
-        v_scrollbar = ttk.Scrollbar(detail_window, orient="vertical", command=canvas.yview)
-        h_scrollbar = ttk.Scrollbar(detail_window, orient="horizontal", command=canvas.xview)
-        canvas.configure(yscrollcommand=v_scrollbar.set, xscrollcommand=hsb.set)
-        v_scrollbar.pack(side="right", fill="y")
-        h_scrollbar.pack(side="bottom", fill="x")
-        canvas.pack(side="left", fill="both", expand=True)
-
-        detail_frame = tk.Frame(canvas, background='#333333' if dark_mode_var.get() else '#f0f0f0')
-        canvas.create_window((0, 0), window=detail_frame, anchor="nw")
-
-        detail_frame.bind("<Configure>", lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
-
-        detail_frame.grid_columnconfigure(1, weight=1)
-
-        widgets = []
-
-        widgets.append(tk.Label(detail_frame, text="ID:", background='#333333' if dark_mode_var.get() else '#f0f0f0', foreground='#FFFFFF' if dark_mode_var.get() else '#000000'))
-        widgets[-1].grid(row=0, column=0, sticky='e', padx=5, pady=5)
-        id_entry = tk.Entry(detail_frame, background='#333333' if dark_mode_var.get() else '#FFFFFF', foreground='#FFFFFF' if dark_mode_var.get() else '#000000')
-        id_entry.insert(0, substory['id'])
-        id_entry.grid(row=0, column=1, sticky='w', padx=5, pady=5)
-        widgets.append(id_entry)
-
-        widgets.append(tk.Label(detail_frame, text="Title:", background='#333333' if dark_mode_var.get() else '#f0f0f0', foreground='#FFFFFF' if dark_mode_var.get() else '#000000'))
-        widgets[-1].grid(row=1, column=0, sticky='e', padx=5, pady=5)
-        title_entry = tk.Entry(detail_frame, background='#333333' if dark_mode_var.get() else '#FFFFFF', foreground='#FFFFFF' if dark_mode_var.get() else '#000000')
-        title_entry.insert(0, substory['title'])
-        title_entry.grid(row=1, column=1, sticky='w', padx=5, pady=5)
-        widgets.append(title_entry)
-
-        widgets.append(tk.Label(detail_frame, text="Description:", background='#333333' if dark_mode_var.get() else '#f0f0f0', foreground='#FFFFFF' if dark_mode_var.get() else '#000000'))
-        widgets[-1].grid(row=2, column=0, sticky='ne', padx=5, pady=5)
-        description_text = tk.Text(detail_frame, wrap=tk.WORD, height=10, width=80, background='#333333' if dark_mode_var.get() else '#FFFFFF', foreground='#FFFFFF' if dark_mode_var.get() else '#000000')
-        description_text.grid(row=2, column=1, sticky='w', padx=5, pady=5)
-        description_text.insert(tk.END, substory['description'])
-        widgets.append(description_text)
-
-        widgets.append(tk.Label(detail_frame, text="Available From:", background='#333333' if dark_mode_var.get() else '#f0f0f0', foreground='#FFFFFF' if dark_mode_var.get() else '#000000'))
-        widgets[-1].grid(row=3, column=0, sticky='e', padx=5, pady=5)
-        chapter_option = ttk.Combobox(detail_frame, values=['chapter 3', 'chapter 4', 'chapter 5','chapter 6','chapter 7','chapter 9','chapter 10','chapter 12'])
-        chapter_option.set(substory.get('available from', ''))
-        chapter_option.grid(row=3, column=1, sticky='w', padx=5, pady=5)
-        widgets.append(chapter_option)
-
-        widgets.append(tk.Label(detail_frame, text="Status:", background='#333333' if dark_mode_var.get() else '#f0f0f0', foreground='#FFFFFF' if dark_mode_var.get() else '#000000'))
-        widgets[-1].grid(row=4, column=0, sticky='e', padx=5, pady=5)
-        status_option = ttk.Combobox(detail_frame, values=['Completed', 'Not Completed', 'In Progress'])
-        status_option.set(substory['status'])
-        status_option.grid(row=4, column=1, sticky='w', padx=5, pady=5)
-        status_option.bind("<<ComboboxSelected>>", lambda e: update_status(substory, status_option.get()))
-        widgets.append(status_option)
-
-        # Adding font size controls for the detail window
-        button_frame = tk.Frame(detail_frame, background='#333333' if dark_mode_var.get() else '#f0f0f0')
-        button_frame.grid(row=5, column=0, columnspan=2, pady=10)
-        button_frame.grid_columnconfigure(0, weight=1)
-        button_frame.grid_columnconfigure(1, weight=1)
-        button_frame.grid_columnconfigure(2, weight=1)
-        widgets.append(button_frame)
-
-        button_increase_font = tk.Button(button_frame, text="Increase Font Size", command=lambda: change_detail_font_size(detail_frame, description_text, 2), background='#333333' if dark_mode_var.get() else '#f0f0f0', foreground='#FFFFFF' if dark_mode_var.get() else '#000000')
-        button_increase_font.grid(row=0, column=0, padx=5)
-        widgets.append(button_increase_font)
-
-        button_decrease_font = tk.Button(button_frame, text="Decrease Font Size", command=lambda: change_detail_font_size(detail_frame, description_text, -2), background='#333333' if dark_mode_var.get() else '#f0f0f0', foreground='#FFFFFF' if dark_mode_var.get() else '#000000')
-        button_decrease_font.grid(row=0, column=1, padx=5)
-        widgets.append(button_decrease_font)
-
-        button_reset_font = tk.Button(button_frame, text="Reset Font Size", command=lambda: reset_detail_font_size(detail_frame, description_text), background='#333333' if dark_mode_var.get() else '#f0f0f0', foreground='#FFFFFF' if dark_mode_var.get() else '#000000')
-        button_reset_font.grid(row=0, column=2, padx=5)
-        widgets.append(button_reset_font)
-
-        apply_theme_to_window(detail_window, widgets)
-
-        def on_close():
-            substory['id'] = int(id_entry.get())
-            substory['title'] = title_entry.get()
-            substory['description'] = description_text.get("1.0", tk.END).strip()
-            substory['available from'] = chapter_option.get()
-            substory['status'] = status_option.get()
-            save_data(substories, json_filename)
-            
-            # Refresh the table without resetting the filters
-            query, filter_by, status_filters, chapter_filters, character_filters = get_current_filters()
-            filtered_substories = filter_substories(query, substories, filter_by, status_filters, chapter_filters, character_filters)
-            refresh_table(tree, filtered_substories)
-            
-            detail_window.destroy()
-
-        detail_window.protocol("WM_DELETE_WINDOW", on_close)
+        substory_editor.open(dataset.store[selected_item[0]])
+
+# Function to save a substory edited in the detail window and show it in the table
+def commit_substory(substory, changes):
+    dataset.edited(substory)
+    persist_changes(dataset.records, json_filename, changes)
+    update_facet_counts()
+
+    # Refresh the table without resetting the filters
+    refresh_table(tree, current_filtered_substories())
+
+# Function to apply an ID edited in a detail window; returns its journal changes, or None if the ID was rejected
+def apply_id_edit(store, lock, record, text, window):
+    try:
+        new_id = int(text)
+    except ValueError:
+        messagebox.showerror("Invalid ID", "The ID must be a whole number.", parent=window)
+        return None
+    changes = record_changes(record, {'id': new_id})
+    try:
+        with lock:
+            store.rekey(record, new_id)
+    except ValueError as e:
+        messagebox.showerror("Duplicate ID", str(e), parent=window)
+        return None
+    return changes
 
 def update_status(substory, new_status):
-    substory['status'] = new_status
-    save_data(substories, json_filename)
-    refresh_table(tree, substories)
-    
-    # Re-select the items
-    for item in tree.get_children():
-        if int(tree.item(item, 'values')[0]) == substory['id']:
-            tree.selection_add(item)
-            tree.focus(item)
-
-# Function to open a new window with revelation details
-def show_revelation_details(event, json_filename):
+    persist_changes(dataset.records, json_filename, record_changes(substory, {'status': new_status}))
+    with dataset.lock:
+        substory['status'] = new_status
+        dataset.edited(substory)
+    update_facet_counts()
+    refresh_table(tree, current_filtered_substories())
+
+# Function to open the selected revelation in the revelation detail window
+def show_revelation_details(event):
     selected_item = revelations_tree.selection()
     if selected_item:
-        revelation_id = int(revelations_tree.item(selected_item, 'values')[0])
-        revelation = next(rev for rev in revelations if rev['id'] == revelation_id)
-        
-        detail_window = tk.Toplevel(root)
-        detail_window.title(f"Details of Revelation {revelation['id']}")
-        detail_window.geometry('900x400')
-        detail_window.resizable(True, True)  # Enable resizing
-        
-        # Adding a canvas and scrollbar for the entire detail window
-        canvas = tk.Canvas(detail_window, background='#333333' if dark_mode_var.get() else '#f0f0f0')
-        v_scrollbar = ttk.Scrollbar(detail_window, orient="vertical", command=canvas.yview)
-        h_scrollbar = ttk.Scrollbar(detail_window, orient="horizontal", command=canvas.xview)
-        canvas.configure(yscrollcommand=v_scrollbar.set, xscrollcommand=hsb.set)
-        v_scrollbar.pack(side="right", fill="y")
-        h_scrollbar.pack(side="bottom", fill="x")
-        canvas.pack(side="left", fill="both", expand=True)
-
-        detail_frame = tk.Frame(canvas, background='#333333' if dark_mode_var.get() else '#f0f0f0')
-        canvas.create_window((0, 0), window=detail_frame, anchor="nw")
-
-        detail_frame.bind("<Configure>", lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
-
-        detail_frame.grid_columnconfigure(1, weight=1)
-
-        widgets = []
-
-        widgets.append(tk.Label(detail_frame, text="ID:", background='#333333' if dark_mode_var.get() else '#f0f0f0', foreground='#FFFFFF' if dark_mode_var.get() else '#000000'))
-        widgets[-1].grid(row=0, column=0, sticky='e', padx=5, pady=5)
-        id_entry = tk.Entry(detail_frame, background='#333333' if dark_mode_var.get() else '#FFFFFF', foreground='#FFFFFF' if dark_mode_var.get() else '#000000')
-        id_entry.insert(0, revelation['id'])
-        id_entry.grid(row=0, column=1, sticky='w', padx=5, pady=5)
-        widgets.append(id_entry)
-
-        widgets.append(tk.Label(detail_frame, text="Title:", background='#333333' if dark_mode_var.get() else '#f0f0f0', foreground='#FFFFFF' if dark_mode_var.get() else '#000000'))
-        widgets[-1].grid(row=1, column=0, sticky='e', padx=5, pady=5)
-        title_entry = tk.Entry(detail_frame, background='#333333' if dark_mode_var.get() else '#FFFFFF', foreground='#FFFFFF' if dark_mode_var.get() else '#000000')
-        title_entry.insert(0, revelation['title'])
-        title_entry.grid(row=1, column=1, sticky='w', padx=5, pady=5)
-        widgets.append(title_entry)
-
-        widgets.append(tk.Label(detail_frame, text="Description:", background='#333333' if dark_mode_var.get() else '#f0f0f0', foreground='#FFFFFF' if dark_mode_var.get() else '#000000'))
-        widgets[-1].grid(row=2, column=0, sticky='ne', padx=5, pady=5)
-        description_text = tk.Text(detail_frame, wrap=tk.WORD, height=10, width=80, background='#333333' if dark_mode_var.get() else '#FFFFFF', foreground='#FFFFFF' if dark_mode_var.get() else '#000000')
-        description_text.grid(row=2, column=1, sticky='w', padx=5, pady=5)
-        description_text.insert(tk.END, revelation['description'])
-        widgets.append(description_text)
-
-        widgets.append(tk.Label(detail_frame, text="Status:", background='#333333' if dark_mode_var.get() else '#f0f0f0', foreground='#FFFFFF' if dark_mode_var.get() else '#000000'))
-        widgets[-1].grid(row=3, column=0, sticky='e', padx=5, pady=5)
-        status_option = ttk.Combobox(detail_frame, values=['Completed', 'Not Completed'])
-        status_option.set(revelation['status'])
-        status_option.grid(row=3, column=1, sticky='w', padx=5, pady=5)
-        status_option.bind("<<ComboboxSelected>>", lambda e: update_revelation_status(revelation, status_option.get(), json_filename))
-        widgets.append(status_option)
-
-        # Adding font size controls for the detail window
-        button_frame = tk.Frame(detail_frame, background='#333333' if dark_mode_var.get() else '#f0f0f0')
-        button_frame.grid(row=4, column=0, columnspan=2, pady=10)
-        button_frame.grid_columnconfigure(0, weight=1)
-        button_frame.grid_columnconfigure(1, weight=1)
-        button_frame.grid_columnconfigure(2, weight=1)
-        widgets.append(button_frame)
-
-        button_increase_font = tk.Button(button_frame, text="Increase Font Size", command=lambda: change_detail_font_size(detail_frame, description_text, 2), background='#333333' if dark_mode_var.get() else '#f0f0f0', foreground='#FFFFFF' if dark_mode_var.get() else '#000000')
-        button_increase_font.grid(row=0, column=0, padx=5)
-        widgets.append(button_increase_font)
-
-        button_decrease_font = tk.Button(button_frame, text="Decrease Font Size", command=lambda: change_detail_font_size(detail_frame, description_text, -2), background='#333333' if dark_mode_var.get() else '#f0f0f0', foreground='#FFFFFF' if dark_mode_var.get() else '#000000')
-        button_decrease_font.grid(row=0, column=1, padx=5)
-        widgets.append(button_decrease_font)
-
-        button_reset_font = tk.Button(button_frame, text="Reset Font Size", command=lambda: reset_detail_font_size(detail_frame, description_text), background='#333333' if dark_mode_var.get() else '#f0f0f0', foreground='#FFFFFF' if dark_mode_var.get() else '#000000')
-        button_reset_font.grid(row=0, column=2, padx=5)
-        widgets.append(button_reset_font)
-
-        apply_theme_to_window(detail_window, widgets)
-
-        def on_close():
-            revelation['id'] = int(id_entry.get())
-            revelation['title'] = title_entry.get()
-            revelation['description'] = description_text.get("1.0", tk.END).strip()
-            revelation['status'] = status_option.get()
-            save_revelations(revelations, json_filename)
-
-            # Refresh the table without resetting the filters
-            refresh_revelations_table(revelations_tree, revelations)
-            
-            detail_window.destroy()
+        revelation_editor.open(revelation_store[selected_item[0]])
 
-        detail_window.protocol("WM_DELETE_WINDOW", on_close)
+# Function to save a revelation edited in the detail window and show it in the table
+def commit_revelation(revelation, changes):
+    persist_changes(revelations, revelations_filename, changes)
+    if revelations_tree.winfo_exists():
+        refresh_revelations_table(revelations_tree, revelations)
 
 def update_revelation_status(revelation, new_status, json_filename):
-    revelation['status'] = new_status
-    save_revelations(revelations, json_filename)
-    refresh_revelations_table(revelations_tree, revelations)
+    persist_changes(revelations, json_filename, record_changes(revelation, {'status': new_status}))
+    with revelations_lock:
+        revelation['status'] = new_status
+    if revelations_tree.winfo_exists():
+        refresh_revelations_table(revelations_tree, revelations)
 
 def refresh_revelations_table(tree, revelations):
-    for row in tree.get_children():
-        tree.delete(row)
-    for revelation in revelations:
-        tree.insert("", "end", values=(revelation['id'], revelation['title'], revelation['description'], revelation['status']))
+    sync_tree_rows(tree, [(record_iid(revelation), (revelation['id'], revelation['title'], revelation['description'], revelation['status'])) for revelation in revelations])
 
 # Function to open the revelations window
+@traced()
 def show_revelations(json_filename):
-    global revelations, revelations_tree
-    revelations = load_revelations(json_filename)
+    global revelations, revelation_store, revelations_tree, revelations_filename
+    revelation_editor.close(force=True)
+    saver.flush()
+    unwatch_data_file(revelations_filename)
+    revelations_filename = json_filename
+    revelations = load_revelation_dataset(json_filename, storage_backend)
+    profile.apply(json_filename, revelations)
+    if profile.dirty:
+        save_profile()
+    watch_data_file(json_filename)
+    revelation_store = RecordStore(revelations)
     
-    revelations_window = tk.Toplevel(root)
+    revelations_window = themed(tk.Toplevel(root))
     revelations_window.title("Revelations")
     revelations_window.geometry('800x400')
     revelations_window.resizable(True, True)  # Enable resizing
@@ -496,10 +930,10 @@ def show_revelations(json_filename):
     revelations_window.grid_columnconfigure(0, weight=1)
 
     # Adding a separate combobox for status change in the main window using grid
-    status_combobox_frame = tk.Frame(revelations_window, background='#333333' if dark_mode_var.get() else '#f0f0f0')
+    status_combobox_frame = ttk.Frame(revelations_window)
     status_combobox_frame.grid(row=2, column=0, columnspan=2, pady=5)
 
-    tk.Label(status_combobox_frame, text="Change Status:", background='#333333' if dark_mode_var.get() else '#f0f0f0', foreground='#FFFFFF' if dark_mode_var.get() else '#000000').grid(row=0, column=0, padx=5)
+    ttk.Label(status_combobox_frame, text="Change Status:").grid(row=0, column=0, padx=5)
     status_combobox = ttk.Combobox(status_combobox_frame, values=['Completed', 'Not Completed'], state='readonly')
     status_combobox.grid(row=0, column=1, padx=5)
     
@@ -507,27 +941,25 @@ def show_revelations(json_filename):
         selected_items = revelations_tree.selection()
         if selected_items:
             new_status = status_combobox.get()
-            selected_ids = [int(revelations_tree.item(item, 'values')[0]) for item in selected_items]
-            for revelation_id in selected_ids:
-                revelation = next(rev for rev in revelations if rev['id'] == revelation_id)
-                update_revelation_status(revelation, new_status, json_filename)
+            changes = []
+            for item in selected_items:
+                revelation = revelation_store[item]
+                changes += record_changes(revelation, {'status': new_status})
+                with revelations_lock:
+                    revelation['status'] = new_status
+            # One queued write and one table refresh for the whole selection
+            persist_changes(revelations, json_filename, changes)
             refresh_revelations_table(revelations_tree, revelations)
-            
-            # Re-select the items based on their IDs
-            for item in revelations_tree.get_children():
-                if int(revelations_tree.item(item, 'values')[0]) in selected_ids:
-                    revelations_tree.selection_add(item)
-                    revelations_tree.focus(item)
 
     status_combobox.bind("<<ComboboxSelected>>", change_revelation_status)
 
-    # Adding character filter for Yakuza 4 revelations
-    if json_filename == 'Y4_Revelations.json':
-        character_filter_frame = tk.Frame(revelations_window, background='#333333' if dark_mode_var.get() else '#f0f0f0')
+    # Adding character filter for games with several playable characters
+    if game.characters:
+        character_filter_frame = ttk.Frame(revelations_window)
         character_filter_frame.grid(row=3, column=0, columnspan=2, pady=5)
         
-        character_listbox = tk.Listbox(character_filter_frame, selectmode=tk.MULTIPLE, exportselection=0, height=4)
-        characters = ['All', 'Akiyama', 'Saejima', 'Tanimura', 'Kiryu']  # Replace with actual character names
+        character_listbox = themed(tk.Listbox(character_filter_frame, selectmode=tk.MULTIPLE, exportselection=0, height=4))
+        characters = ['All'] + game.characters
         for character in characters:
             character_listbox.insert(tk.END, character)
         character_listbox.grid(row=0, column=1, padx=5, pady=5)
@@ -540,31 +972,24 @@ def show_revelations(json_filename):
                 filtered_revelations = [revelation for revelation in revelations if revelation.get('character') in selected_characters]
             refresh_revelations_table(revelations_tree, filtered_revelations)
         
-        button_filter_character = tk.Button(character_filter_frame, text="Filter by Character", command=filter_revelations_by_character, background='#333333' if dark_mode_var.get() else '#f0f0f0', foreground='#FFFFFF' if dark_mode_var.get() else '#000000')
+        button_filter_character = ttk.Button(character_filter_frame, text="Filter by Character", command=filter_revelations_by_character)
         button_filter_character.grid(row=0, column=0, padx=5, pady=5)
 
     refresh_revelations_table(revelations_tree, revelations)
 
     # Binding events
-    revelations_tree.bind("<Double-1>", lambda event: show_revelation_details(event, json_filename))
-
-    apply_theme_to_window(revelations_window, [status_combobox_frame, status_combobox])
-
-# Load configuration settings
-def load_config():
-    config = configparser.ConfigParser()
-    config.read(resource_path('config.ini'))
-    return config
+    revelations_tree.bind("<Double-1>", show_revelation_details)
 
 # Save configuration settings
+@traced()
 def save_config():
     config = configparser.ConfigParser()
     config['FILTERS'] = {
         'query': entry_search.get(),
         'filter_by': filter_option.get(),
-        'status_filter': ','.join([status_listbox.get(i) for i in status_listbox.curselection()]),
-        'chapter_filter': ','.join([chapter_listbox.get(i) for i in chapter_listbox.curselection()]),
-        'character_filter': ','.join([character_listbox.get(i) for i in character_listbox.curselection()]),
+        'status_filter': ','.join(selected_values(status_listbox)),
+        'chapter_filter': ','.join(selected_values(chapter_listbox)),
+        'character_filter': ','.join(selected_values(character_listbox)),
         'json_file': json_filename_var.get()
     }
     config['WINDOW'] = {
@@ -574,8 +999,31 @@ def save_config():
     config['THEME'] = {
         'dark_mode': dark_mode_var.get()
     }
-    with open(resource_path('config.ini'), 'w') as configfile:
-        config.write(configfile)
+    config['PROFILE'] = {
+        'name': profile.name
+    }
+    config['STORAGE'] = {
+        'journal': journal_enabled,
+        'backend': 'sqlite' if storage_backend is not None else 'json',
+        'database': database_name,
+        'compact_records': compact_enabled,
+        'lazy_descriptions': lazy_enabled,
+        'watch_files': watch_enabled,
+        'snapshot': snapshot_mode
+    }
+    config['STARTUP'] = {
+        'report': startup_report
+    }
+    config['PROFILING'] = {
+        'enabled': PROFILER.enabled
+    }
+    config['API'] = {
+        'enabled': api_enabled,
+        'host': api_host,
+        'port': api_port,
+        'token': api_token
+    }
+    commit_config(config)
 
 # Apply configuration settings
 def apply_config(config):
@@ -587,22 +1035,20 @@ def apply_config(config):
         # Setting status filter
         status_filters = filters.get('status_filter', 'All').split(',')
         for i in range(status_listbox.size()):
-            if status_listbox.get(i) in status_filters:
+            if status_listbox.values[i] in status_filters:
                 status_listbox.select_set(i)
         
         # Setting chapter filter
         chapter_filters = filters.get('chapter_filter', 'All').split(',')
         for i in range(chapter_listbox.size()):
-            if chapter_listbox.get(i) in chapter_filters:
+            if chapter_listbox.values[i] in chapter_filters:
                 chapter_listbox.select_set(i)
         
         # Setting character filter
         character_filters = filters.get('character_filter', 'All').split(',')
         for i in range(character_listbox.size()):
-            if character_listbox.get(i) in character_filters:
+            if character_listbox.values[i] in character_filters:
                 character_listbox.select_set(i)
-        
-        json_filename_var.set(filters.get('json_file', 'Yakuza 3'))
     
     if 'WINDOW' in config:
         window = config['WINDOW']
@@ -613,93 +1059,197 @@ def apply_config(config):
     if 'THEME' in config:
         theme = config['THEME']
         dark_mode_var.set(theme.getboolean('dark_mode', False))
-        apply_theme()
+    apply_theme()
 
 def toggle_dark_mode():
     apply_theme()
     save_config()
 
-def apply_theme():
-    if dark_mode_var.get():
-        style.theme_use('alt')
-        style.configure('TFrame', background='#333333')
-        style.configure('TLabel', background='#333333', foreground='#FFFFFF')
-        style.configure('TButton', background='#555555', foreground='#FFFFFF')
-        style.configure('TCombobox', fieldbackground='#555555', background='#333333', foreground='#FFFFFF')
-        style.configure('TCheckbutton', background='#333333', foreground='#FFFFFF')
-        style.configure('Treeview', background='#555555', foreground='#FFFFFF', fieldbackground='#555555')
-        style.configure('Treeview.Heading', background='#333333', foreground='#FFFFFF')
-        root.configure(background='#333333')  # Set background color of main window
-        frame_filter.configure(background='#333333')  # Set background color of filtering frame
+# Colour palettes of the light and dark themes, applied by apply_theme
+PALETTES = {
+    'light': {'theme': 'default', 'background': '#f0f0f0', 'foreground': '#000000', 'field': '#FFFFFF', 'button': '#f0f0f0',
+              'active': '#e0e0e0', 'disabled': '#a3a3a3', 'select': '#4a6984', 'select_foreground': '#FFFFFF'},
+    'dark': {'theme': 'alt', 'background': '#333333', 'foreground': '#FFFFFF', 'field': '#555555', 'button': '#555555',
+             'active': '#666666', 'disabled': '#888888', 'select': '#4a6984', 'select_foreground': '#FFFFFF'},
+}
+
+# Option database entries giving classic Tk widgets their palette colour when they are created
+THEME_OPTIONS = [
+    ('*Toplevel.background', 'background'), ('*Canvas.background', 'background'),
+    ('*Listbox.background', 'field'), ('*Listbox.foreground', 'foreground'),
+    ('*Listbox.selectBackground', 'select'), ('*Listbox.selectForeground', 'select_foreground'),
+    ('*Text.background', 'field'), ('*Text.foreground', 'foreground'), ('*Text.insertBackground', 'foreground'),
+    ('*Text.selectBackground', 'select'), ('*Text.selectForeground', 'select_foreground'),
+]
+
+themed_widgets = []  # classic Tk widgets re-themed by apply_theme; ttk widgets follow the styles by themselves
+
+# Function to have apply_theme re-theme a classic Tk widget (a window, canvas, listbox or text), which ttk styles do not reach
+def themed(widget):
+    themed_widgets.append(widget)
+    return widget
+
+# Function to give a classic Tk widget the palette's colours
+def configure_themed(widget, palette):
+    if isinstance(widget, (tk.Tk, tk.Toplevel, tk.Canvas)):
+        widget.configure(background=palette['background'])
     else:
-        style.theme_use('default')
-        style.configure('TFrame', background='#f0f0f0')
-        style.configure('TLabel', background='#f0f0f0', foreground='#000000')
-        style.configure('TButton', background='#f0f0f0', foreground='#000000')
-        style.configure('TCombobox', fieldbackground='#FFFFFF', background='#f0f0f0', foreground='#000000')
-        style.configure('TCheckbutton', background='#f0f0f0', foreground='#000000')
-        style.configure('Treeview', background='#FFFFFF', foreground='#000000', fieldbackground='#FFFFFF')
-        style.configure('Treeview.Heading', background='#f0f0f0', foreground='#000000')
-        root.configure(background='#f0f0f0')  # Reset background color of main window
-        frame_filter.configure(background='#f0f0f0')  # Reset background color of filtering frame
+        widget.configure(background=palette['field'], foreground=palette['foreground'],
+                         selectbackground=palette['select'], selectforeground=palette['select_foreground'])
+        if isinstance(widget, tk.Text):
+            widget.configure(insertbackground=palette['foreground'])
+
+# Function to map a palette onto the named ttk styles
+def theme_styles(palette):
+    text = {'background': palette['background'], 'foreground': palette['foreground']}
+    font = (current_font_family, current_font_size)
+    return {
+        '.': text,
+        'TFrame': {'background': palette['background']},
+        'TLabel': text,
+        'TCheckbutton': text,
+        'TButton': {'background': palette['button'], 'foreground': palette['foreground']},
+        'TEntry': {'fieldbackground': palette['field'], 'foreground': palette['foreground'], 'insertcolor': palette['foreground']},
+        'TCombobox': {'fieldbackground': palette['field'], 'background': palette['background'], 'foreground': palette['foreground']},
+        'TNotebook': {'background': palette['background']},
+        'TNotebook.Tab': {'background': palette['button'], 'foreground': palette['foreground']},
+        'Treeview': {'background': palette['field'], 'foreground': palette['foreground'], 'fieldbackground': palette['field'], 'font': font},
+        'Treeview.Heading': {'background': palette['background'], 'foreground': palette['foreground'], 'font': font},
+    }
+
+# Function to re-theme every window: named ttk styles cover the ttk widgets, the option database covers
+# classic widgets created later, and themed_widgets holds the few classic ones already open
+@traced()
+def apply_theme():
+    palette = PALETTES['dark' if dark_mode_var.get() else 'light']
+    style.theme_use(palette['theme'])
+    for name, options in theme_styles(palette).items():
+        style.configure(name, **options)
+    style.map('TCombobox', fieldbackground=[('readonly', palette['field'])], foreground=[('readonly', palette['foreground'])])
+    style.map('TEntry', fieldbackground=[('readonly', palette['field'])])
+    style.map('TButton', background=[('active', palette['active']), ('disabled', palette['background'])],
+              foreground=[('disabled', palette['disabled'])])
+    for pattern, colour in THEME_OPTIONS:
+        root.option_add(pattern, palette[colour])
+    themed_widgets[:] = [widget for widget in themed_widgets if widget.winfo_exists()]
+    for widget in themed_widgets:
+        configure_themed(widget, palette)
 
 def show_character_filter_window():
-    character_filter_window = tk.Toplevel(root)
+    character_filter_window = themed(tk.Toplevel(root))
     character_filter_window.title("Character Filter")
     character_filter_window.geometry('300x200')
 
-    label_character = tk.Label(character_filter_window, text="Character:")
+    label_character = ttk.Label(character_filter_window, text="Character:")
     label_character.pack(pady=5)
 
-    character_listbox = tk.Listbox(character_filter_window, selectmode=tk.MULTIPLE, exportselection=0, height=6)
+    character_listbox = themed(tk.Listbox(character_filter_window, selectmode=tk.MULTIPLE, exportselection=0, height=6))
     characters = ['All', 'Character 1', 'Character 2', 'Character 3']  # Replace with actual character names
     for character in characters:
         character_listbox.insert(tk.END, character)
     character_listbox.pack(pady=5)
 
-    button_apply_filter = tk.Button(character_filter_window, text="Apply Filter", command=apply_character_filter)
+    button_apply_filter = ttk.Button(character_filter_window, text="Apply Filter", command=apply_character_filter)
     button_apply_filter.pack(pady=10)
 
-# Mapping of JSON filenames to display names
-json_file_display_names = {
-    'substories.json': 'Yakuza 3',
-    'y4subst.json': 'Yakuza 4'
-}
-
 def change_json_file(event):
-    global substories, json_filename
-    display_name = json_filename_var.get()
-    json_filename = {v: k for k, v in json_file_display_names.items()}[display_name]
-    substories = load_data(json_filename)
-    
-    if json_filename == 'y4subst.json':
-        chapters = ['All', 'chapter 2', 'chapter 3', 'chapter 4', 'finale']
-        label_character.pack()
-        character_listbox.pack()
-    else:
-        chapters = ['All', 'chapter 3', 'chapter 4', 'chapter 5', 'chapter 6', 'chapter 7', 'chapter 9', 'chapter 10', 'chapter 12']
-        label_character.pack_forget()
-        character_listbox.pack_forget()
-
-    chapter_listbox.delete(0, tk.END)
-    for chapter in chapters:
-        chapter_listbox.insert(tk.END, chapter)
-
+    load_game()
     on_filter()
 
+# Function to load the selected game's dataset and set up the table and filters for it
+@traced()
+def load_game():
+    global dataset, json_filename, game
+    # Finish edits and pending writes before switching; the outgoing dataset stays cached for switching back
+    substory_editor.close(force=True)
+    saver.flush()
+    unwatch_data_file(json_filename)
+    game = GAMES[json_filename_var.get()]
+    json_filename = game.file
+    dataset = dataset_cache.get(json_filename, storage_backend, compact_enabled, lazy_enabled)
+    dataset.apply_progress(profile)
+    if profile.dirty:
+        save_profile()
+    watch_data_file(json_filename)
+    configure_table_columns()
+
+    if game.characters:
+        label_character.grid()
+        character_listbox.grid()
+    else:
+        label_character.grid_remove()
+        character_listbox.grid_remove()
+    fill_facet_listbox(character_listbox, ['All'] + game.characters)
+    fill_facet_listbox(chapter_listbox, ['All'] + game.chapters)
+    chapter_combobox.configure(values=game.chapters)
+    update_undo_buttons()
+    notify_api(json_filename)
+    button_revelations.config(state=tk.NORMAL if game.revelations else tk.DISABLED)
+    update_facet_counts()
+
 # Creating the main application window
-root = tk.Tk()
+root = themed(tk.Tk())
 root.title("Yakuza Substories Manager")
 root.geometry('1024x768')  # Set default window size
 root.resizable(True, True)  # Enable window resizing
 
-# Initialize JSON filename variable with display names
-json_filename_var = tk.StringVar(value=json_file_display_names['substories.json'])
-json_filename = {v: k for k, v in json_file_display_names.items()}[json_filename_var.get()]
-
-# Loading data
-substories = load_data(json_filename)
-sort_reverse = [False, False, False, False, False, False]  # Sorting flags for columns
+# Settings are needed before the first load
+config = load_config()
+startup_report = config.getboolean('STARTUP', 'report', fallback=False)
+PROFILER.enabled = config.getboolean('PROFILING', 'enabled', fallback=False)
+
+# Initialize JSON filename variable with display names, starting with the game used last
+last_game = config.get('FILTERS', 'json_file', fallback='')
+json_filename_var = tk.StringVar(value=last_game if last_game in GAMES else next(iter(GAMES)))
+game = GAMES[json_filename_var.get()]
+json_filename = game.file
+
+journal_enabled = config.getboolean('STORAGE', 'journal', fallback=True)
+compact_enabled = config.getboolean('STORAGE', 'compact_records', fallback=False)  # slot-based records for very large datasets
+lazy_enabled = config.getboolean('STORAGE', 'lazy_descriptions', fallback=False)  # descriptions stay on disk until opened
+database_name = config.get('STORAGE', 'database', fallback=DEFAULT_DATABASE)
+storage_backend = None
+if config.get('STORAGE', 'backend', fallback='json') == 'sqlite':
+    storage_backend = SqliteStore(resource_path(database_name))
+current_sort = []  # (column, descending) pairs, most significant first
+saver = WriteBehindSaver(backend=storage_backend)
+live_search = LiveSearch(root)
+snapshot_mode = config.get('STORAGE', 'snapshot', fallback='off')  # startup snapshot compression (see SNAPSHOT_COMPRESSIONS), or off
+dataset_cache = DatasetCache(snapshot=snapshot_mode if snapshot_mode in SNAPSHOT_COMPRESSIONS else None)
+
+# The progress profile holding the statuses; the guide files are not written for status changes
+try:
+    profile = ProgressProfile.load(config.get('PROFILE', 'name', fallback=DEFAULT_PROFILE))
+except ValueError as e:
+    print(f"Error loading the profile: {e}")
+    profile = ProgressProfile.load(DEFAULT_PROFILE)
+
+# The optional HTTP/JSON API for phones and overlays, started once the first dataset is loaded (see substories_api)
+API_POLL_MS = 50
+API_EDIT_TIMEOUT = 10
+api_enabled = config.getboolean('API', 'enabled', fallback=False)
+api_host = config.get('API', 'host', fallback=API_HOST)
+api_port = config.getint('API', 'port', fallback=API_PORT)
+api_token = config.get('API', 'token', fallback='')
+api_server = None
+api_calls = queue.SimpleQueue()  # (function, Future) pairs from the API server's threads, run on the Tk thread
+
+# Watching the data files and the profile for outside edits; with the SQLite backend the JSON files are only an import source
+watch_enabled = config.getboolean('STORAGE', 'watch_files', fallback=True)
+file_watcher = FileWatcher() if watch_enabled else None
+disk_fingerprints = {}  # data file -> fingerprints of its records as last read or written
+watch_fd = file_watcher.fileno() if file_watcher is not None else None
+if watch_fd is not None:
+    root.tk.createfilehandler(watch_fd, tk.READABLE, check_data_files)
+elif file_watcher is not None:
+    root.after(WATCH_POLL_MS, poll_data_files)
+if file_watcher is not None:
+    file_watcher.watch(profile.filename)
+
+dataset = None  # loaded by load_game() once the window is built
+revelations_filename = None
+revelations = None
+revelations_lock = threading.RLock()  # held for edits to the revelations, which the saver writes on its thread
 current_font_family = 'Helvetica'
 default_font_size = 12  # Default font size
 current_font_size = default_font_size
@@ -711,108 +1261,114 @@ style.configure("Treeview", font=(current_font_family, current_font_size))
 style.configure("Treeview.Heading", font=(current_font_family, current_font_size))
 
 # Creating the frame for filtering options
-frame_filter = tk.Frame(root)
+frame_filter = ttk.Frame(root)
 frame_filter.pack(pady=10)
 
-label_search = tk.Label(frame_filter, text="Search:")
+label_search = ttk.Label(frame_filter, text="Search:")
 label_search.grid(row=0, column=0)
 
-entry_search = tk.Entry(frame_filter)
+entry_search = ttk.Entry(frame_filter)
 entry_search.grid(row=0, column=1, padx=5)
 
-filter_option = ttk.Combobox(frame_filter, values=['ID', 'Title', 'Description'])
+filter_option = ttk.Combobox(frame_filter, values=['ID', 'Title', 'Description', FUZZY_FILTER])
 filter_option.set('Title')
 filter_option.grid(row=0, column=2)
 
+# Shows why a live search failed, until the next one succeeds
+label_search_error = ttk.Label(frame_filter, text="", foreground="red")
+label_search_error.grid(row=0, column=3, columnspan=3, padx=5, sticky=tk.W)
+
+# Filter live while typing or changing the search field
+entry_search.bind("<KeyRelease>", live_search.schedule)
+filter_option.bind("<<ComboboxSelected>>", live_search.schedule)
+
 # Adding Status Filter
-label_status = tk.Label(frame_filter, text="Status:")
+label_status = ttk.Label(frame_filter, text="Status:")
 label_status.grid(row=1, column=0, padx=5, pady=5)
 
-status_listbox = tk.Listbox(frame_filter, selectmode=tk.MULTIPLE, exportselection=0, height=4)
-statuses = ['All', 'Completed', 'Not Completed', 'In Progress']
-for status in statuses:
-    status_listbox.insert(tk.END, status)
+status_listbox = themed(tk.Listbox(frame_filter, selectmode=tk.MULTIPLE, exportselection=0, height=4))
+fill_facet_listbox(status_listbox, ['All'] + STATUSES)
+status_listbox.bind("<<ListboxSelect>>", live_search.schedule)
 status_listbox.grid(row=1, column=1, padx=5, pady=5)
 
 # Adding Chapter Filter
-label_chapter = tk.Label(frame_filter, text="Chapter:")
+label_chapter = ttk.Label(frame_filter, text="Chapter:")
 label_chapter.grid(row=1, column=2, padx=5, pady=5)
 
-chapter_listbox = tk.Listbox(frame_filter, selectmode=tk.MULTIPLE, exportselection=0, height=4)
-chapters = ['All', 'chapter 3', 'chapter 4', 'chapter 5', 'chapter 6', 'chapter 7', 'chapter 9', 'chapter 10', 'chapter 12']
-for chapter in chapters:
-    chapter_listbox.insert(tk.END, chapter)
+chapter_listbox = themed(tk.Listbox(frame_filter, selectmode=tk.MULTIPLE, exportselection=0, height=4))
+fill_facet_listbox(chapter_listbox, ['All'] + game.chapters)
+chapter_listbox.bind("<<ListboxSelect>>", live_search.schedule)
 chapter_listbox.grid(row=1, column=3, padx=5, pady=5)
 
 # Adding Character Filter
-label_character = tk.Label(frame_filter, text="Character:")
+label_character = ttk.Label(frame_filter, text="Character:")
 label_character.grid(row=1, column=4, padx=5, pady=5)
 
-character_listbox = tk.Listbox(frame_filter, selectmode=tk.MULTIPLE, exportselection=0, height=4)
-characters = ['All', 'Akiyama', 'Saejima', 'Tanimura', 'Kiryu']  # Replace with actual character names
-for character in characters:
-    character_listbox.insert(tk.END, character)
+character_listbox = themed(tk.Listbox(frame_filter, selectmode=tk.MULTIPLE, exportselection=0, height=4))
+fill_facet_listbox(character_listbox, ['All'] + game.characters)
+character_listbox.bind("<<ListboxSelect>>", live_search.schedule)
 character_listbox.grid(row=1, column=5, padx=5, pady=5)
-if json_filename != 'y4subst.json':
-    label_character.pack_forget()
-    character_listbox.pack_forget()
+if not game.characters:
+    label_character.grid_remove()
+    character_listbox.grid_remove()
 
 # Adding the filter button
-button_filter = tk.Button(frame_filter, text="Filter", command=on_filter)
+button_filter = ttk.Button(frame_filter, text="Filter", command=on_filter)
 button_filter.grid(row=0, column=6, padx=5, pady=5)
 
 # Adding font size controls for the Treeview
-button_increase_font = tk.Button(frame_filter, text="Increase Font Size", command=lambda: change_font_size(2))
+button_increase_font = ttk.Button(frame_filter, text="Increase Font Size", command=lambda: change_font_size(2))
 button_increase_font.grid(row=2, column=0, padx=5, pady=5)
 
-button_decrease_font = tk.Button(frame_filter, text="Decrease Font Size", command=lambda: change_font_size(-2))
+button_decrease_font = ttk.Button(frame_filter, text="Decrease Font Size", command=lambda: change_font_size(-2))
 button_decrease_font.grid(row=2, column=1, padx=5, pady=5)
 
 # Adding reset font size button
-button_reset_font = tk.Button(frame_filter, text="Reset Font Size", command=reset_font_size)
+button_reset_font = ttk.Button(frame_filter, text="Reset Font Size", command=reset_font_size)
 button_reset_font.grid(row=2, column=2, padx=5, pady=5)
 
 # Adding button to show revelations
-button_revelations = tk.Button(frame_filter, text="Show Revelations", command=lambda: show_revelations('revelations.json' if json_filename == 'substories.json' else 'Y4_Revelations.json'))
+button_revelations = ttk.Button(frame_filter, text="Show Revelations", command=lambda: show_revelations(game.revelations))
 button_revelations.grid(row=2, column=3, padx=5, pady=5)
 
 # Adding dark mode toggle
 dark_mode_var = tk.BooleanVar()
-dark_mode_checkbutton = tk.Checkbutton(frame_filter, text="Dark Mode", variable=dark_mode_var, command=toggle_dark_mode)
+dark_mode_checkbutton = ttk.Checkbutton(frame_filter, text="Dark Mode", variable=dark_mode_var, command=toggle_dark_mode)
 dark_mode_checkbutton.grid(row=2, column=4, padx=5, pady=5)
 
+# Adding progress profile selection
+profile_frame = ttk.Frame(frame_filter)
+profile_frame.grid(row=2, column=5, columnspan=2, padx=5, pady=5)
+ttk.Label(profile_frame, text="Profile:").pack(side=tk.LEFT)
+profile_combobox = ttk.Combobox(profile_frame, values=sorted(set(list_profiles()) | {profile.name}, key=str.casefold), state='readonly', width=12)
+profile_combobox.set(profile.name)
+profile_combobox.pack(side=tk.LEFT)
+profile_combobox.bind("<<ComboboxSelected>>", change_profile)
+button_new_profile = ttk.Button(profile_frame, text="New Profile", command=new_profile)
+button_new_profile.pack(side=tk.LEFT, padx=5)
+
+# Adding the performance overlay
+button_performance = ttk.Button(frame_filter, text="Performance", command=show_performance)
+button_performance.grid(row=1, column=6, padx=5, pady=5)
+root.bind("<F12>", show_performance)
+
 # Adding JSON file selection
-label_json_file = tk.Label(frame_filter, text="Select JSON file:")
+label_json_file = ttk.Label(frame_filter, text="Select JSON file:")
 label_json_file.grid(row=0, column=4, padx=5, pady=5)
 
-json_file_combobox = ttk.Combobox(frame_filter, textvariable=json_filename_var, values=list(json_file_display_names.values()))
+json_file_combobox = ttk.Combobox(frame_filter, textvariable=json_filename_var, values=list(GAMES))
 json_file_combobox.grid(row=0, column=5, padx=5, pady=5)
 json_file_combobox.bind("<<ComboboxSelected>>", change_json_file)
 
 # Creating a frame for the Treeview and scrollbars
-frame_tree = tk.Frame(root)
+frame_tree = ttk.Frame(root)
 frame_tree.pack(expand=True, fill=tk.BOTH)
 
-# Creating the table to display substories
-columns = ("ID", "Title", "Description", "Available From", "Status")
-if json_filename == 'y4subst.json':
-    columns = ("ID", "Title", "Description", "Character", "Available From", "Status")
-
-tree = ttk.Treeview(frame_tree, columns=columns, show='headings', selectmode='extended')
-tree.heading("ID", text="ID", command=lambda: sort_by_column(0))
-tree.heading("Title", text="Title", command=lambda: sort_by_column(1))
-tree.heading("Description", text="Description", command=lambda: sort_by_column(2))
-tree.heading("Available From", text="Available From", command=lambda: sort_by_column(3))
-tree.heading("Status", text="Status", command=lambda: sort_by_column(4))
-
-# Set column widths
-tree.column("ID", width=50)
-tree.column("Title", width=200)
-tree.column("Description", width=300)
-tree.column("Available From", width=100)
-tree.column("Status", width=100)
-if json_filename == 'y4subst.json':
-    tree.column("Character", width=100)
+# Creating the table to display substories; configure_table_columns sets up the game's columns
+column_widths = {"ID": 50, "Title": 200, "Description": 300, "Available From": 100, "Status": 100}  # extra columns take their width from games.json
+tree = ttk.Treeview(frame_tree, columns=(), show='headings', selectmode='extended')
+tree.bind("<Shift-ButtonPress-1>", on_heading_shift_click)
+configure_table_columns()
 
 # Creating scrollbars
 vsb = ttk.Scrollbar(frame_tree, orient="vertical", command=tree.yview)
@@ -829,35 +1385,90 @@ frame_tree.grid_rowconfigure(0, weight=1)
 frame_tree.grid_columnconfigure(0, weight=1)
 
 # Adding a separate combobox for status change in the main window
-status_combobox_frame = tk.Frame(root)
+status_combobox_frame = ttk.Frame(root)
 status_combobox_frame.pack(pady=5)
 
-tk.Label(status_combobox_frame, text="Change Status:").pack(side=tk.LEFT)
-status_combobox = ttk.Combobox(status_combobox_frame, values=['Completed', 'Not Completed', 'In Progress'], state='readonly')
+ttk.Label(status_combobox_frame, text="Change Status:").pack(side=tk.LEFT)
+status_combobox = ttk.Combobox(status_combobox_frame, values=STATUSES, state='readonly')
 status_combobox.pack(side=tk.LEFT)
 status_combobox.bind("<<ComboboxSelected>>", change_status)
 
+# Adding chapter change, where bulk edits apply, and undo/redo of bulk edits
+ttk.Label(status_combobox_frame, text="Change Chapter:").pack(side=tk.LEFT, padx=(10, 0))
+chapter_combobox = ttk.Combobox(status_combobox_frame, values=game.chapters, state='readonly', width=12)
+chapter_combobox.pack(side=tk.LEFT)
+chapter_combobox.bind("<<ComboboxSelected>>", change_chapter)
+
+APPLY_TO_SELECTION = "Selected Rows"
+APPLY_TO_FILTERED = "All Filtered"
+ttk.Label(status_combobox_frame, text="Apply To:").pack(side=tk.LEFT, padx=(10, 0))
+apply_to_var = tk.StringVar(value=APPLY_TO_SELECTION)
+apply_to_combobox = ttk.Combobox(status_combobox_frame, textvariable=apply_to_var, values=[APPLY_TO_SELECTION, APPLY_TO_FILTERED], state='readonly', width=13)
+apply_to_combobox.pack(side=tk.LEFT)
+
+button_undo = ttk.Button(status_combobox_frame, text="Undo", command=undo_edit, state=tk.DISABLED)
+button_undo.pack(side=tk.LEFT, padx=(10, 0))
+button_redo = ttk.Button(status_combobox_frame, text="Redo", command=redo_edit, state=tk.DISABLED)
+button_redo.pack(side=tk.LEFT, padx=5)
+TRANSFER_FILETYPES = [("CSV", "*.csv"), ("JSON Lines", "*.jsonl")]
+ttk.Button(status_combobox_frame, text="Import...", command=import_substories).pack(side=tk.LEFT, padx=(10, 0))
+ttk.Button(status_combobox_frame, text="Export View...", command=export_view).pack(side=tk.LEFT, padx=5)
+root.bind("<Control-z>", undo_edit)
+root.bind("<Control-y>", redo_edit)
+root.bind("<Control-Shift-Z>", redo_edit)
+
+# The detail windows, built on first use and kept for the next record
+substory_editor = DetailEditor("Substory", [
+    ("ID", 'id', 'entry'), ("Title", 'title', 'entry'), ("Description", 'description', 'text'),
+    ("Available From", 'available from', lambda: game.chapters), ("Status", 'status', lambda: STATUSES)
+], lambda: dataset.store, lambda: dataset.lock, commit_substory, update_status)
+revelation_editor = DetailEditor("Revelation", [
+    ("ID", 'id', 'entry'), ("Title", 'title', 'entry'), ("Description", 'description', 'text'),
+    ("Status", 'status', lambda: ['Completed', 'Not Completed'])
+], lambda: revelation_store, lambda: revelations_lock, commit_revelation,
+   lambda revelation, new_status: update_revelation_status(revelation, new_status, revelations_filename))
+
 # Save configuration settings on exit
 def on_exit():
+    substory_editor.close(force=True)
+    revelation_editor.close(force=True)
     save_config()
+    if api_server is not None:
+        api_server.stop()
+    # Fold each guide's journal of text edits into its file once the pending writes are done
+    if storage_backend is None:
+        for cached in dataset_cache.datasets():
+            saver.submit(cached.records, cached.json_filename, [], journal_enabled, compact=True, lock=cached.lock)
+        if revelations_filename is not None:
+            saver.submit(revelations, revelations_filename, [], journal_enabled, compact=True, lock=revelations_lock)
+    unsaved = saver.close()
+    if unsaved:
+        messagebox.showerror("Unsaved Edits", "Your latest edits to these files could not be saved:\n\n" + '\n'.join(unsaved)
+                             + "\n\nThe errors were printed to the console.")
+    if file_watcher is not None:
+        file_watcher.close()
+    if storage_backend is not None:
+        storage_backend.close()
     root.destroy()
 
 root.protocol("WM_DELETE_WINDOW", on_exit)
 
-# Load and apply configuration settings
-config = load_config()
+mark_startup('window built')
 
-# Apply the JSON file selection logic initially
-change_json_file(None)
-
-# Initial table refresh
-on_filter()
+# Load the configured game once, restore the saved filters for it, then filter once
+load_game()
+mark_startup('dataset loaded from ' + ('snapshot' if dataset.from_snapshot else 'source'))
 
 # Binding events
 tree.bind("<Double-1>", show_details)
 
 # Apply configuration settings after the UI has been built
 apply_config(config)
+on_filter()
+mark_startup('first filter')
+if api_enabled:
+    start_api()
 
 # Start the main loop
+root.after(0, report_startup)
 root.mainloop()
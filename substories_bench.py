@@ -0,0 +1,334 @@
+""" Benchmarks for the substory core on synthetic datasets of any size.
+
+Generates datasets in the substories.json / y4subst.json schema, times loading, indexing,
+filtering, sorting, table refreshes and saving, and prints the results as JSON. A stored
+run can be passed back with --baseline to flag regressions.
+
+Examples:
+    python substories_bench.py --sizes 1000,10000,100000 --output bench.json
+    python substories_bench.py --baseline bench.json --tolerance 0.25
+    python substories_bench.py --generate 50000 --game "Yakuza 4" --output big_y4.json
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+from substories_core import (
+    GAMES, SORT_KEYS, Dataset, SearchIndex, append_journal, export_records, filter_substories, import_records, load_data, load_lazy_data,
+    ProgressProfile, merge_external_changes, record_fingerprints, record_iid, save_data, sort_substories, sync_tree_rows, table_rows,
+    write_changes, write_json_atomic
+)
+
+STATUS_WEIGHTS = {'Completed': 0.35, 'Not Completed': 0.55, 'In Progress': 0.10}
+
+# Word pool used when the bundled guides are not available
+FALLBACK_WORDS = (
+    "head to the park and talk with the man outside serena then go back to the office "
+    "choose the second answer defeat the punks follow him to the shop near the station "
+    "haruka kiryu akiyama saejima tanimura kamurocho ryukyu theater underground hostess club"
+).split()
+
+class Corpus:
+    """ Word, description length and per-game chapter distributions taken from the bundled guides """
+
+    def __init__(self, rng):
+        self.rng = rng
+        records = []
+        self.chapters = {}
+        for game in GAMES.values():
+            try:
+                guide = load_data(game.file)
+            except OSError:
+                guide = []
+            records += guide
+            # Only the chapters the game registry lists, as the app offers no others
+            chapters = Counter(r['available from'] for r in guide if r.get('available from') in game.chapters)
+            self.chapters[game.name] = chapters or Counter(game.chapters)
+        self.words = [word for record in records for word in (record['title'] + ' ' + record['description']).split()] or FALLBACK_WORDS
+        self.lengths = [len(record['description']) for record in records] or [565]
+
+    def text(self, length):
+        words, size = [], 0
+        while size < length:
+            word = self.rng.choice(self.words)
+            words.append(word)
+            size += len(word) + 1
+        return ' '.join(words)
+
+    def weighted(self, counter):
+        return self.rng.choices(list(counter), weights=list(counter.values()))[0]
+
+def generate_substories(count, game='Yakuza 3', seed=0):
+    """ Return count synthetic substories in the schema of the given game's data file """
+    rng = random.Random(seed)
+    corpus = Corpus(rng)
+    characters = GAMES[game].characters
+    statuses, weights = list(STATUS_WEIGHTS), list(STATUS_WEIGHTS.values())
+    substories = []
+    for number in range(count):
+        status = rng.choices(statuses, weights=weights)[0]
+        substory = {
+            'id': number + 1,
+            'title': corpus.text(rng.randint(8, 30)).title(),
+            'description': corpus.text(max(40, int(rng.choice(corpus.lengths) * rng.uniform(0.7, 1.3)))),
+            'completed': status == 'Completed',
+            'available from': corpus.weighted(corpus.chapters[game]),
+            'status': status,
+        }
+        if characters:
+            # Games with several playable characters number substories per character
+            substory['id'] = number // len(characters) + 1
+            substory['character'] = characters[number % len(characters)]
+        substories.append(substory)
+    return substories
+
+class StubTree:
+    """ Stand-in for ttk.Treeview with the calls used by sync_tree_rows """
+
+    def __init__(self):
+        self.children = []
+
+    def get_children(self, item=''):
+        return tuple(self.children)
+
+    def delete(self, *iids):
+        gone = set(iids)
+        self.children = [iid for iid in self.children if iid not in gone]
+
+    def set_children(self, item, *iids):
+        self.children = list(iids)
+
+    def insert(self, parent, index, iid=None, values=()):
+        self.children.insert(index, iid)
+
+    def item(self, iid, values=None):
+        pass
+
+def make_tree(use_tk):
+    if use_tk:
+        try:
+            import tkinter as tk
+            from tkinter import ttk
+            root = tk.Tk()
+            root.withdraw()
+            return ttk.Treeview(root, columns=('ID', 'Title', 'Description', 'Available From', 'Status', 'Character'), show='headings')
+        except Exception as e:
+            print(f"Falling back to a stub tree: {e}", file=sys.stderr)
+    return StubTree()
+
+def measure(func, repeat):
+    """ Run func repeat times with the garbage collector off; return timings in milliseconds """
+    timings = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return timings
+
+def measure_memory(load):
+    """ Return the bytes still allocated by what load() returns """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        loaded = load()
+        gc.collect()
+        allocated = tracemalloc.get_traced_memory()[0]
+        del loaded  # held until measured, so its memory is counted
+        return allocated
+    finally:
+        tracemalloc.stop()
+
+def benchmark_size(count, game, repeat, use_tk, seed):
+    results = []
+
+    def record(name, func, runs=repeat):
+        timings = measure(func, runs)
+        results.append({
+            'name': name, 'size': count, 'game': game, 'runs': runs,
+            'median_ms': round(statistics.median(timings), 4), 'min_ms': round(min(timings), 4),
+        })
+
+    substories = generate_substories(count, game, seed)
+    with_character = game == 'Yakuza 4'
+    columns = GAMES[game].columns
+    workdir = tempfile.mkdtemp(prefix='substories_bench_')
+    json_path = os.path.join(workdir, 'bench.json')
+    write_json_atomic(substories, json_path)
+
+    record('load_data', lambda: load_data(json_path))
+    record('load_data[compact]', lambda: load_data(json_path, compact=True))
+    load_lazy_data(json_path)  # builds the description sidecars
+    record('load_data[lazy]', lambda: load_lazy_data(json_path))
+    memory = {
+        'memory[dict]': lambda: load_data(json_path),
+        'memory[compact]': lambda: load_data(json_path, compact=True),
+        'memory[lazy]': lambda: load_lazy_data(json_path),
+        'memory_dataset[dict]': lambda: Dataset(json_path, load_data(json_path)),
+        'memory_dataset[lazy]': lambda: Dataset(json_path, load_lazy_data(json_path)),
+    }
+    for name, load in memory.items():
+        results.append({'name': name, 'size': count, 'game': game, 'bytes': measure_memory(load)})
+    record('index_build', lambda: SearchIndex(substories), runs=max(1, repeat // 2))
+    # Startup: a full parse and index build against a restore from the binary snapshot
+    record('dataset_load[json]', lambda: Dataset.load(json_path), runs=max(1, repeat // 2))
+    Dataset.load(json_path, snapshot='none')  # writes the snapshot
+    record('dataset_load[snapshot]', lambda: Dataset.load(json_path, snapshot='none'))
+    dataset = Dataset(json_path, substories)
+
+    rng = random.Random(seed)
+    word = rng.choice(substories[len(substories) // 2]['description'].split()).strip('.,!?"\'').lower() or 'the'
+    title_word = substories[len(substories) // 3]['title'].split()[0]
+    chapter = substories[0]['available from']
+    character = [substories[0].get('character', 'All')] if with_character else ['All']
+    cases = {
+        'ID': ('ID', str(substories[-1]['id'])[:2], ['All'], ['All'], ['All']),
+        'Title': ('Title', title_word, ['All'], ['All'], ['All']),
+        'Description': ('Description', word, ['All'], ['All'], ['All']),
+        'status': ('Title', '', ['Not Completed'], ['All'], ['All']),
+        'chapter': ('Title', '', ['All'], [chapter], ['All']),
+        'character': ('Title', '', ['All'], ['All'], character),
+        'combined': ('Description', word, ['Not Completed', 'In Progress'], [chapter], character),
+    }
+    misspelled = title_word[:-2] + title_word[-1] if len(title_word) > 3 else title_word
+    fuzzy_query = f'{misspelled} {word}'
+    record('fuzzy_search', lambda: dataset.filter(fuzzy_query, 'Fuzzy'))
+    record('fuzzy_search[status]', lambda: dataset.filter(fuzzy_query, 'Fuzzy', ['Not Completed']))
+    lazy_dataset = Dataset(json_path, load_lazy_data(json_path))
+    for case, (filter_by, query, statuses, chapters, characters) in cases.items():
+        record(f'filter_substories[{case}]', lambda: filter_substories(query, substories, filter_by, statuses, chapters, characters, dataset.index, dataset.facets))
+        record(f'filter_substories_lazy[{case}]', lambda: lazy_dataset.filter(query, filter_by, statuses, chapters, characters))
+        record(f'filter_substories_scan[{case}]', lambda: filter_substories(query, substories, filter_by, statuses, chapters, characters))
+
+    for column in SORT_KEYS:
+        record(f'sort_by_column[{column}]', lambda: sort_substories(substories, column))
+        record(f'sort_cached[{column}]', lambda: dataset.filter(order_by=column))
+    record('sort_cached[Status,Available From]', lambda: dataset.filter(order_by=[('Status', False), ('Available From', True)]))
+    record('sort_cached_filtered[Title]', lambda: dataset.filter(status_filters=['In Progress'], order_by='Title'))
+
+    # Full table fill, a no-op refresh, and a refresh after one status edit
+    record('refresh_table[fill]', lambda: sync_tree_rows(make_tree(False), table_rows(substories, columns)), runs=max(1, repeat // 2))
+    tree = make_tree(use_tk)
+    sync_tree_rows(tree, table_rows(substories, columns))
+    record('refresh_table[unchanged]', lambda: sync_tree_rows(tree, table_rows(substories, columns)))
+
+    def edit_and_refresh():
+        target = substories[len(substories) // 2]
+        target['status'] = 'Completed' if target['status'] != 'Completed' else 'Not Completed'
+        sync_tree_rows(tree, table_rows(substories, columns))
+    record('refresh_table[one_edit]', edit_and_refresh)
+
+    record('save_data', lambda: save_data(substories, json_path), runs=max(1, repeat // 2))
+    key = table_rows(substories[:1], columns)[0][0]
+    record('journal_append', lambda: append_journal(json_path, [(key, 'status', 'Completed')]))
+    # The same append as a commit: lock, generation check and bump
+    record('journal_commit', lambda: write_changes(substories, json_path, [(key, 'status', 'Completed')]))
+
+    # Switching between two progress profiles: only records whose status differs are touched
+    profiles = [ProgressProfile(name, {json_path: {record_iid(substory): rng.choice(['Completed', 'In Progress'])
+                                                    for substory in substories if rng.random() < 0.5}}) for name in ('a', 'b')]
+    switches = iter(range(1 << 30))
+    record('profile_switch', lambda: dataset.apply_progress(profiles[next(switches) % 2]))
+
+    # Setting the status of a whole filtered view as one transaction, then undoing it
+    pending = dataset.filter(status_filters=['Not Completed'])
+    record('bulk_edit+undo[filtered]', lambda: (dataset.bulk_edit(pending, {'status': 'Completed'}), dataset.undo()))
+
+    # Merging an outside edit of one record: the diff against the file fingerprints
+    base = record_fingerprints(substories)
+    fresh = [dict(substory) for substory in substories]
+    fresh[len(fresh) // 3]['status'] = 'In Progress'
+    record('merge_external[one_edit]', lambda: merge_external_changes(substories, fresh, base))
+
+    # Streaming the dataset out as JSON Lines and merging it back in by ID (every row unchanged)
+    transfer_path = os.path.join(workdir, 'bench.jsonl')
+
+    def export_jsonl():
+        with open(transfer_path, 'w', encoding='utf-8') as file:
+            export_records(substories, file, 'jsonl')
+
+    def import_jsonl():
+        with open(transfer_path, 'r', encoding='utf-8') as file:
+            return import_records(substories, file, 'jsonl', 'substories', GAMES[game])
+    record('export[jsonl]', export_jsonl, runs=max(1, repeat // 2))
+    record('import[jsonl]', import_jsonl, runs=max(1, repeat // 2))
+
+    for name in os.listdir(workdir):
+        os.remove(os.path.join(workdir, name))
+    os.rmdir(workdir)
+    return results
+
+def compare(results, baseline, tolerance):
+    """ Return the results that are slower than the baseline by more than tolerance (a fraction) """
+    previous = {(r['name'], r['size'], r['game']): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        before = previous.get((result['name'], result['size'], result['game']))
+        if 'median_ms' not in result:
+            continue
+        if before and result['median_ms'] > before['median_ms'] * (1 + tolerance) and result['median_ms'] - before['median_ms'] > 0.05:
+            regressions.append(dict(result, baseline_ms=before['median_ms'], ratio=round(result['median_ms'] / max(before['median_ms'], 1e-9), 2)))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the substory core on synthetic datasets.')
+    parser.add_argument('--sizes', default='1000,10000,100000', help='comma-separated record counts (up to 1000000)')
+    parser.add_argument('--game', choices=list(GAMES), default='Yakuza 3', help='schema of the generated data')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per measurement')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tk', action='store_true', help='refresh a real (withdrawn) ttk.Treeview instead of a stub')
+    parser.add_argument('--baseline', help='earlier JSON output to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown against the baseline, as a fraction')
+    parser.add_argument('--generate', type=int, metavar='COUNT', help='only write a synthetic dataset of COUNT records to --output')
+    parser.add_argument('-o', '--output', help='write JSON here instead of stdout')
+    args = parser.parse_args(argv)
+
+    if args.generate:
+        substories = generate_substories(args.generate, args.game, args.seed)
+        if args.output:
+            write_json_atomic(substories, args.output)
+        else:
+            json.dump(substories, sys.stdout, indent=4)
+        return 0
+
+    results = []
+    for size in (int(size) for size in args.sizes.split(',')):
+        print(f"Benchmarking {size} records...", file=sys.stderr)
+        results += benchmark_size(size, args.game, args.repeat, args.tk, args.seed)
+    report = {
+        'meta': {
+            'python': platform.python_version(), 'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'repeat': args.repeat, 'seed': args.seed,
+        },
+        'results': results,
+    }
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as file:
+            report['regressions'] = compare(results, json.load(file), args.tolerance)
+        for regression in report['regressions']:
+            print(f"REGRESSION {regression['name']} @ {regression['size']}: {regression['baseline_ms']} -> {regression['median_ms']} ms", file=sys.stderr)
+        status = 1 if report['regressions'] else 0
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=4)
+    else:
+        json.dump(report, sys.stdout, indent=4)
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main())
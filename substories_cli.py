@@ -0,0 +1,210 @@
+""" Command-line access to the substory datasets, for scripting progress without starting the GUI.
+
+Examples:
+    python substories_cli.py query --game "Yakuza 4" --character Kiryu --status "Not Completed"
+    python substories_cli.py update --status Completed --chapter "chapter 3" --ids 1-40
+    python substories_cli.py export --format csv --output progress.csv
+    python substories_cli.py import community-guide.jsonl --game "Yakuza 4"
+    python substories_cli.py serve --host 0.0.0.0 --port 8765
+"""
+import argparse
+import sys
+import threading
+
+from substories_core import (
+    DEFAULT_DATABASE, DEFAULT_PROFILE, FILTER_BY_FIELDS, FUZZY_FILTER, GAMES, SNAPSHOT_COMPRESSIONS, SORT_KEYS, STATUSES, Dataset,
+    ProgressProfile,
+    SqliteStore, WriteBehindSaver, apply_record_diff, commit_json, export_records, import_records, list_profiles, load_config,
+    load_revelation_dataset, parse_id_ranges, resource_path, transfer_format, write_changes
+)
+
+def id_ranges(text):
+    try:
+        return parse_id_ranges(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def add_filter_arguments(parser, status_filter=True):
+    parser.add_argument('-q', '--query', default='', help='search query, same syntax as the GUI search box')
+    parser.add_argument('--filter-by', choices=list(FILTER_BY_FIELDS) + [FUZZY_FILTER], default='Title',
+                        help='field searched by plain query words, or Fuzzy for typo-tolerant ranked results')
+    if status_filter:
+        parser.add_argument('--status', action='append', default=[], choices=STATUSES, help='only this status (repeatable)')
+    parser.add_argument('--chapter', action='append', default=[], help='only this chapter, e.g. "chapter 3" (repeatable)')
+    parser.add_argument('--character', action='append', default=[], help='only this character (repeatable, Yakuza 4)')
+    parser.add_argument('--ids', type=id_ranges, help='only these IDs, e.g. 1-40,45')
+    parser.add_argument('--sort', choices=list(SORT_KEYS), help='sort by this column')
+    parser.add_argument('--reverse', action='store_true', help='sort in descending order')
+
+def build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--game', choices=list(GAMES), default=next(iter(GAMES), None))
+    common.add_argument('--backend', choices=['json', 'sqlite'], help='storage backend (default: from config.ini)')
+    common.add_argument('--profile', help='progress profile whose statuses to use (default: from config.ini); see the profiles command')
+    parser = argparse.ArgumentParser(description='Query, export and bulk-update Yakuza substory progress.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    query = commands.add_parser('query', parents=[common], help='list matching substories')
+    add_filter_arguments(query)
+    query.add_argument('--format', choices=['table', 'json', 'csv'], default='table')
+
+    export = commands.add_parser('export', parents=[common], help='write matching substories to a file or stdout')
+    add_filter_arguments(export)
+    export.add_argument('--format', choices=['json', 'jsonl', 'csv'], default='json')
+    export.add_argument('-o', '--output', help='output file (default: stdout)')
+    export.add_argument('--revelations', action='store_true', help="export the game's revelations (filtered by --status, --character and --ids)")
+
+    import_ = commands.add_parser('import', parents=[common], help='merge substories from a JSON Lines or CSV file by ID')
+    import_.add_argument('file', help='file to import, or - for stdin')
+    import_.add_argument('--format', choices=['jsonl', 'csv'], help='file format (default: from the file extension)')
+    import_.add_argument('--revelations', action='store_true', help="import into the game's revelations")
+    import_.add_argument('--dry-run', action='store_true', help='check the file and report what would change without saving')
+
+    update = commands.add_parser('update', parents=[common], help='set the status of every matching substory')
+    add_filter_arguments(update, status_filter=False)
+    update.add_argument('--where-status', action='append', default=[], choices=STATUSES, help='only substories currently in this status (repeatable)')
+    update.add_argument('--status', required=True, choices=STATUSES, help='new status')
+    update.add_argument('--dry-run', action='store_true', help='list what would change without saving')
+
+    serve = commands.add_parser('serve', parents=[common], help='serve the HTTP/JSON API until interrupted (see substories_api)')
+    serve.add_argument('--host', help='address to listen on (default: from config.ini, else 127.0.0.1)')
+    serve.add_argument('--port', type=int, help='port to listen on (default: from config.ini, else 8765)')
+    serve.add_argument('--token', help='require this token from clients (default: from config.ini)')
+
+    commands.add_parser('profiles', help='list the progress profiles')
+    return parser
+
+def select(dataset, args, status_filters):
+    substories = dataset.filter(args.query, args.filter_by, status_filters, args.chapter, args.character, args.sort, args.reverse)
+    if args.ids:
+        substories = [substory for substory in substories if substory['id'] in args.ids]
+    return substories
+
+def select_revelations(revelations, args):
+    return [revelation for revelation in revelations
+            if (not args.status or revelation.get('status') in args.status)
+            and (not args.character or revelation.get('character') in args.character)
+            and (not args.ids or revelation['id'] in args.ids)]
+
+def write_records(substories, output_format, file, kind='substories'):
+    if output_format != 'table':
+        export_records(substories, file, output_format, kind)
+        return
+    for substory in substories:
+        character = f"{substory['character']:<9} " if 'character' in substory else ''
+        print(f"{substory['id']:>4}  {character}{substory.get('available from', ''):<11} {substory['status']:<14} {substory['title']}", file=file)
+
+def export(records, kind, args):
+    if args.output:
+        with open(args.output, 'w', newline='' if args.format == 'csv' else None, encoding='utf-8') as file:
+            write_records(records, args.format, file, kind)
+    else:
+        write_records(records, args.format, sys.stdout, kind)
+
+# Function to merge a JSON Lines or CSV file into records (a Dataset's for substories) and save the result
+def import_file(records, dataset, json_filename, kind, profile, backend, config, args):
+    file = sys.stdin if args.file == '-' else open(args.file, 'r', newline='', encoding='utf-8')
+    try:
+        result = import_records(records, file, args.format or transfer_format(args.file), kind, GAMES[args.game])
+    finally:
+        if file is not sys.stdin:
+            file.close()
+    for line, message in result.errors:
+        print(f"{args.file}:{line}: {message}", file=sys.stderr)
+    if result.rejected > len(result.errors):
+        print(f"... and {result.rejected - len(result.errors)} more rejected rows", file=sys.stderr)
+    if not args.dry_run and (result.changed or result.added):
+        if dataset is not None:
+            dataset.apply_diff(result.changed, result.added)
+        else:
+            apply_record_diff(records, result.changed, result.added)
+        guide_changes = profile.record(json_filename, result.changes)
+        if profile.dirty:
+            commit_json(profile.snapshot(), profile.filename)
+        write_changes(records if dataset is None else dataset.records, json_filename, result.changes if backend is not None else guide_changes,
+                      config.getboolean('STORAGE', 'journal', fallback=True), backend, result.added)
+    print(f"{'Would import' if args.dry_run else 'Imported'} {kind}: {result.summary()}")
+
+def serve(dataset, profile, json_filename, backend, config, args):
+    from substories_api import API_HOST, API_PORT, ApiServer
+    saver = WriteBehindSaver(backend=backend)
+    journal = config.getboolean('STORAGE', 'journal', fallback=True)
+
+    def edit(select, values):
+        with dataset.lock:
+            changes = dataset.bulk_edit(select(dataset), values, 'API')
+            guide_changes = profile.record(json_filename, changes)
+            if profile.dirty:
+                saver.submit_snapshot(profile.snapshot(), profile.filename)
+        saver.submit(dataset.records, json_filename, changes if backend is not None else guide_changes, journal, lock=dataset.lock)
+        server.notify(json_filename, changes)
+        return changes
+
+    server = ApiServer(lambda: dataset, edit, args.host or config.get('API', 'host', fallback=API_HOST),
+                       args.port or config.getint('API', 'port', fallback=API_PORT), args.token or config.get('API', 'token', fallback=None),
+                       describe=lambda: {'game': args.game, 'profile': profile.name})
+    server.start()
+    print(f"Serving {args.game} on http://{server.host}:{server.port}/api/substories, Ctrl+C to stop", file=sys.stderr)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        for filename in saver.close():
+            print(f"Edits to {filename} could not be saved", file=sys.stderr)
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    config = load_config()
+    if args.command == 'profiles':
+        for name in list_profiles():
+            print(name)
+        return 0
+    backend_name = args.backend or config.get('STORAGE', 'backend', fallback='json')
+    backend = SqliteStore(resource_path(config.get('STORAGE', 'database', fallback=DEFAULT_DATABASE))) if backend_name == 'sqlite' else None
+    json_filename = GAMES[args.game].file
+    snapshot = config.get('STORAGE', 'snapshot', fallback='off')
+    dataset = Dataset.load(json_filename, backend, config.getboolean('STORAGE', 'compact_records', fallback=False),
+                           config.getboolean('STORAGE', 'lazy_descriptions', fallback=False),
+                           snapshot=snapshot if snapshot in SNAPSHOT_COMPRESSIONS else None)
+    profile = ProgressProfile.load(args.profile or config.get('PROFILE', 'name', fallback=DEFAULT_PROFILE))
+    dataset.apply_progress(profile)
+    revelations_filename = GAMES[args.game].revelations
+    if getattr(args, 'revelations', False):
+        if not revelations_filename:
+            print(f"{args.game} has no revelations", file=sys.stderr)
+            return 1
+        revelations = load_revelation_dataset(revelations_filename, backend)
+        profile.apply(revelations_filename, revelations)
+
+    try:
+        if args.command == 'import' and args.revelations:
+            import_file(revelations, None, revelations_filename, 'revelations', profile, backend, config, args)
+        elif args.command == 'import':
+            import_file(dataset.records, dataset, json_filename, 'substories', profile, backend, config, args)
+    except (OSError, ValueError) as e:
+        print(f"Error importing {args.file}: {e}", file=sys.stderr)
+        return 1
+    if args.command == 'query':
+        write_records(select(dataset, args, args.status), args.format, sys.stdout)
+    elif args.command == 'export' and args.revelations:
+        export(select_revelations(revelations, args), 'revelations', args)
+    elif args.command == 'export':
+        export(select(dataset, args, args.status), 'substories', args)
+    elif args.command == 'serve':
+        serve(dataset, profile, json_filename, backend, config, args)
+    elif args.command == 'update':
+        changes = dataset.bulk_edit(select(dataset, args, args.where_status), {'status': args.status})
+        guide_changes = profile.record(json_filename, changes)
+        if not args.dry_run:
+            commit_json(profile.snapshot(), profile.filename)
+            write_changes(dataset.records, json_filename, changes if backend is not None else guide_changes,
+                          config.getboolean('STORAGE', 'journal', fallback=True), backend)
+        print(f"{len(changes)} substories {'would be set' if args.dry_run else 'set'} to {args.status}")
+    if backend is not None:
+        backend.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
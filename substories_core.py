@@ -0,0 +1,2874 @@
+""" Headless core of the Yakuza Substories Manager: data model, search, sorting and persistence.
+
+Nothing here imports tkinter, so the GUI, the command-line tool and scripts can all share it.
+"""
+import bisect
+import functools
+import heapq
+import json
+import marshal
+import os
+import re
+import sys
+import threading
+import time
+from array import array
+from collections import Counter, OrderedDict
+from collections.abc import MutableMapping
+from contextlib import nullcontext
+from operator import itemgetter
+from itertools import chain, compress, count
+
+# configparser, csv, sqlite3 and tempfile are imported where they are used to keep importing this module cheap
+
+STATUSES = ['Completed', 'Not Completed', 'In Progress']
+
+# Define the resource path function
+def resource_path(relative_path):
+    """ Get the absolute path to the resource, works for dev and for PyInstaller """
+    try:
+        # PyInstaller creates a temp folder and stores the path in _MEIPASS
+        base_path = sys._MEIPASS
+    except Exception:
+        base_path = os.path.abspath(".")
+    return os.path.join(base_path, relative_path)
+
+# Hot-path timing spans. PROFILER stays off unless enabled ([PROFILING] enabled in config.ini); while off,
+# span() hands out one shared no-op context manager and traced functions call straight through
+PROFILE_SAMPLES = 512        # latest durations kept per span for the percentiles
+PROFILE_TRACE_EVENTS = 100000
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+    __slots__ = ('profiler', 'name', 'interaction', 'start', 'capture')
+
+    def __init__(self, profiler, name, interaction):
+        self.profiler = profiler
+        self.name = name
+        self.interaction = interaction
+        self.capture = None
+
+    def __enter__(self):
+        profiler = self.profiler
+        if self.interaction and profiler._capture_file is not None and profiler._capturing is None:
+            import cProfile
+            self.capture = profiler._capturing = cProfile.Profile()
+            self.capture.enable()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter()
+        if self.capture is not None:
+            self.capture.disable()
+            self.profiler._captured(self.name, self.capture)
+        self.profiler.record(self.name, self.start, end)
+        return False
+
+class Profiler:
+    """ Named timing spans: rolling percentiles per span, a Chrome trace-event log, and an opt-in cProfile capture.
+
+    Spans may be recorded from any thread. capture_next() arms cProfile for the next interaction span
+    (a Tk event handler in the GUI); its stats are written to a file and printed.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.origin = time.perf_counter()
+        self._samples = {}
+        self._events = []
+        self._lock = threading.Lock()
+        self._capture_file = None
+        self._capturing = None
+        self.last_capture = None
+
+    def span(self, name, interaction=False):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, interaction)
+
+    def traced(self, name=None, interaction=False):
+        """ Decorator timing every call of a function as a span, named after the function by default """
+        def decorate(func):
+            span_name = name or func.__name__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with _Span(self, span_name, interaction):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def record(self, name, start, end):
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = [0, []]
+            samples[0] += 1
+            durations = samples[1]
+            if len(durations) >= PROFILE_SAMPLES:
+                del durations[:PROFILE_SAMPLES // 2]
+            durations.append(end - start)
+            if len(self._events) < PROFILE_TRACE_EVENTS:
+                self._events.append((name, start, end, threading.get_ident()))
+
+    def stats(self):
+        """ Return {span: (calls, p50, p95, max)} in seconds, over each span's latest samples """
+        with self._lock:
+            samples = {name: (calls, sorted(durations)) for name, (calls, durations) in self._samples.items()}
+        return {name: (calls, durations[len(durations) // 2], durations[min(len(durations) - 1, len(durations) * 95 // 100)], durations[-1])
+                for name, (calls, durations) in samples.items()}
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._events.clear()
+
+    def trace_events(self):
+        """ Return the recorded spans as Chrome trace-event format (chrome://tracing, Perfetto) """
+        with self._lock:
+            events = list(self._events)
+        pid = os.getpid()
+        return {'traceEvents': [{'name': name, 'ph': 'X', 'ts': round((start - self.origin) * 1e6, 1),
+                                 'dur': round((end - start) * 1e6, 1), 'pid': pid, 'tid': thread}
+                                for name, start, end, thread in events],
+                'displayTimeUnit': 'ms'}
+
+    def export_trace(self, json_filename):
+        write_json_atomic(self.trace_events(), json_filename, indent=None)
+
+    def capture_next(self, stats_filename):
+        """ Profile the next interaction span with cProfile and write its stats to stats_filename """
+        self._capture_file = stats_filename
+
+    def _captured(self, name, capture):
+        import pstats
+        stats_filename, self._capture_file, self._capturing = self._capture_file, None, None
+        capture.dump_stats(stats_filename)
+        self.last_capture = (name, stats_filename)
+        print(f"Profiled {name}, stats written to {stats_filename}:")
+        pstats.Stats(capture).sort_stats('cumulative').print_stats(15)
+
+PROFILER = Profiler()
+traced = PROFILER.traced
+
+# Edits are appended to a sidecar journal next to each data file and folded back into
+# the JSON snapshot once the journal grows past this size. Statuses are not journaled here; they
+# live in the progress profiles (see ProgressProfile)
+JOURNAL_SUFFIX = '.journal'
+JOURNAL_COMPACT_BYTES = 256 * 1024
+
+# Several instances (the GUI, the command-line tool, the API server) may share the data files, the
+# profiles and config.ini. Reads take no lock; a write takes an advisory lock on <file>.lock just for
+# the commit and counts up the file's generation kept in it. A writer whose copy of the file is older
+# than the generation it finds is stale: it merges what is on disk instead of overwriting it
+LOCK_SUFFIX = '.lock'
+CONFIG_FILE = 'config.ini'
+_GENERATION_BYTES = 21
+_WINDOWS_LOCK_OFFSET = 64  # msvcrt locks a byte range, so lock one past the generation readers read
+_known_generations = {}  # file path -> generation our copy of the file reflects (0: from before any commit)
+_synced_documents = {}   # file path -> JSON document as of that generation, the base of three-way merges
+_path_locks = {}         # file path -> threading.Lock, for the threads of this process
+_path_locks_guard = threading.Lock()
+
+def _parse_generation(data):
+    try:
+        return int(data or 0)
+    except ValueError:
+        return -1  # never equal to a generation we know, so the next commit merges
+
+# Function to read a file's generation, which needs no lock as a commit writes it in one go
+def commit_generation(json_filename):
+    try:
+        with open(resource_path(json_filename) + LOCK_SUFFIX, 'rb') as file:
+            return _parse_generation(file.read(_GENERATION_BYTES))
+    except FileNotFoundError:
+        return 0
+
+# Function to record the generation of a file just read (taken before reading it), and for small JSON
+# files the document read, which later commits merge against
+def note_generation(json_filename, generation, document=None):
+    path = resource_path(json_filename)
+    _known_generations[path] = generation
+    if document is None:
+        _synced_documents.pop(path, None)
+    else:
+        _synced_documents[path] = document
+
+# Function to tell whether no other process has committed to a file since we last read or wrote it
+def is_current(json_filename):
+    return commit_generation(json_filename) == _known_generations.get(resource_path(json_filename), 0)
+
+def _lock_file(fd):
+    if os.name == 'nt':
+        import msvcrt
+        os.lseek(fd, _WINDOWS_LOCK_OFFSET, os.SEEK_SET)
+        while True:
+            try:
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue  # LK_LOCK gives up after ten seconds; a commit never takes that long, so keep waiting
+    import fcntl
+    fcntl.flock(fd, fcntl.LOCK_EX)
+
+def _unlock_file(fd):
+    if os.name == 'nt':
+        import msvcrt
+        os.lseek(fd, _WINDOWS_LOCK_OFFSET, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+class CommitLock:
+    """ Exclusive right to commit to a shared file, held for one short write.
+
+    Entering reads the file's generation and sets stale when another process committed since
+    we read the file; leaving counts the generation up, whatever was written. Only a writer
+    that was current moves on to the new generation (and, given document, to that base for
+    merges): a stale one merged on disk what it has not merged in memory yet.
+    """
+
+    def __init__(self, json_filename):
+        self.path = resource_path(json_filename)
+        self.document = None
+
+    def __enter__(self):
+        with _path_locks_guard:
+            self._thread_lock = _path_locks.setdefault(self.path, threading.Lock())
+        self._thread_lock.acquire()
+        try:
+            self._fd = os.open(self.path + LOCK_SUFFIX, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                _lock_file(self._fd)
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                self.generation = _parse_generation(os.read(self._fd, _GENERATION_BYTES))
+            except BaseException:
+                os.close(self._fd)
+                raise
+        except BaseException:
+            self._thread_lock.release()
+            raise
+        self.stale = self.generation != _known_generations.get(self.path, 0)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.generation = max(self.generation, 0) + 1
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            os.write(self._fd, b'%020d\n' % self.generation)
+            if self.stale or exc_type is not None:
+                # Whatever we wrote is not what we hold, so our own write must not look like ours
+                _written_stamps.pop(self.path, None)
+            else:
+                _known_generations[self.path] = self.generation
+                if self.document is not None:
+                    _synced_documents[self.path] = self.document
+        finally:
+            try:
+                _unlock_file(self._fd)
+            finally:
+                os.close(self._fd)
+                self._thread_lock.release()
+
+# Function to merge two edited versions of a JSON document three-way against the version both started
+# from: a dict is merged key by key, and where both sides changed the same value, ours wins
+def merge_documents(ours, base, theirs):
+    if ours == base:
+        return theirs
+    if theirs == base or ours == theirs:
+        return ours
+    if isinstance(ours, dict) and isinstance(theirs, dict):
+        base = base if isinstance(base, dict) else {}
+        merged = {}
+        for key in chain(ours, (key for key in theirs if key not in ours)):
+            value = merge_documents(ours.get(key, _ABSENT), base.get(key, _ABSENT), theirs.get(key, _ABSENT))
+            if value is not _ABSENT:
+                merged[key] = value
+        return merged
+    return ours
+
+# Function to commit a small JSON document, e.g. a progress profile; when another process committed
+# since we read it, writes merge(ours, base, theirs) instead. Returns whether it had to merge
+@traced()
+def commit_json(data, json_filename, merge=merge_documents, indent=4):
+    with CommitLock(json_filename) as lock:
+        if lock.stale:
+            try:
+                with open(lock.path, 'r') as file:
+                    theirs = json.load(file)
+            except FileNotFoundError:
+                theirs = None
+            data = merge(data, _synced_documents.get(lock.path), theirs)
+        else:
+            lock.document = data
+        write_json_atomic(data, json_filename, indent)
+        return lock.stale
+
+# Function to commit config.ini, merged key by key with any edits another instance saved meanwhile
+def commit_config(config):
+    import configparser
+    with CommitLock(CONFIG_FILE) as lock:
+        document = {section: dict(config[section]) for section in config.sections()}
+        if lock.stale:
+            fresh = configparser.ConfigParser()
+            fresh.read(lock.path)
+            document = merge_documents(document, _synced_documents.get(lock.path), {section: dict(fresh[section]) for section in fresh.sections()})
+            config = configparser.ConfigParser()
+            config.read_dict(document)
+        else:
+            lock.document = document
+        _replace_file(lock.path, config.write)
+
+# Function to load data from JSON file
+@traced()
+def load_data(json_filename, compact=False):
+    json_path = resource_path(json_filename)
+    generation = commit_generation(json_filename)
+    with open(json_path, 'r') as file:
+        substories = json.load(file)
+    if compact:
+        compact_records(substories)
+    replay_journal(substories, json_filename)
+    note_generation(json_filename, generation)
+    return substories
+
+# Function to save data to JSON file; given the edits made since it was read, (record key, field, new
+# value), they are merged into the file if another process committed to it meanwhile
+@traced()
+def save_data(substories, json_filename, changes=None):
+    with CommitLock(json_filename) as lock:
+        _rewrite_records(lock, substories, json_filename, changes)
+
+# Function to load revelations from JSON file
+@traced()
+def load_revelations(json_filename):
+    json_path = resource_path(json_filename)
+    generation = commit_generation(json_filename)
+    with open(json_path, 'r') as file:
+        revelations = json.load(file)
+    replay_journal(revelations, json_filename)
+    note_generation(json_filename, generation)
+    return revelations
+
+# Function to save revelations data to JSON file, merging like save_data
+@traced()
+def save_revelations(revelations, json_filename, changes=None):
+    with CommitLock(json_filename) as lock:
+        _rewrite_records(lock, revelations, json_filename, changes)
+
+# Function to rewrite a data file, under its CommitLock, and fold its journal in. A stale writer starts
+# from the file and journal as they are now and applies its changes and added records on top, so edits
+# another process made to other records survive; without changes it can only overwrite them
+def _rewrite_records(lock, records, json_filename, changes, added=()):
+    if lock.stale:
+        if changes is None:
+            print(f"Warning: {json_filename} was changed by another program; overwriting its edits")
+        else:
+            records = read_json_records(json_filename)
+            apply_keyed_changes(records, changes)
+            keys = {record_iid(record) for record in records}
+            records.extend(record for record in added if record_iid(record) not in keys)
+    write_json_atomic(records, json_filename)
+    discard_journal(json_filename)
+
+# Function to write a file through a temporary file and a rename, so a crash never leaves it truncated;
+# write is called with the open temporary file. The file keeps its permissions (mkstemp makes it 0600),
+# and a new one gets the usual ones for the umask
+def _replace_file(path, write, mode='w'):
+    import tempfile
+    try:
+        permissions = os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        umask = os.umask(0o022)
+        os.umask(umask)
+        permissions = 0o666 & ~umask
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as file:
+            write(file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.chmod(temp_path, permissions)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+# Function to write a JSON file atomically (see _replace_file); shared files go through a CommitLock
+def write_json_atomic(data, json_filename, indent=4):
+    json_path = resource_path(json_filename)
+    _replace_file(json_path, lambda file: json.dump(data, file, indent=indent, default=json_default))
+    _written_stamps[json_path] = _file_stamp(json_path)
+    if data and isinstance(data, list) and isinstance(data[0], LazyRecord):
+        refresh_description_index(data, json_path)
+
+def journal_path(json_filename):
+    return resource_path(json_filename) + JOURNAL_SUFFIX
+
+# Function to append edits, a list of (record key, field, new value), to a data file's journal; returns the
+# journal size. Callers hold the file's CommitLock, so a torn last line left by a crash can be cut off first
+def append_journal(json_filename, changes):
+    lines = ''.join(json.dumps({'key': key, 'field': field, 'value': value}) + '\n' for key, field, value in changes)
+    with open(journal_path(json_filename), 'a+b') as file:
+        size = file.seek(0, os.SEEK_END)
+        if size:
+            file.seek(size - 1)
+            if file.read(1) != b'\n':
+                file.seek(0)
+                file.truncate(file.read().rfind(b'\n') + 1)
+        file.write(lines.encode())
+        file.flush()
+        os.fsync(file.fileno())
+        return file.tell()
+
+# Function to apply (record key, field, new value) edits to records by key; returns how many applied
+def apply_keyed_changes(records, changes):
+    by_key = {}
+    for record in records:
+        by_key.setdefault(record_iid(record), record)
+    applied = 0
+    for key, field, value in changes:
+        record = by_key.get(key)
+        if record is None:
+            continue
+        if field in ('id', 'character'):
+            # Both are part of the record key, so later changes name the record by its new key
+            del by_key[key]
+            record[field] = value
+            by_key[record_iid(record)] = record
+        else:
+            record[field] = value
+        applied += 1
+    return applied
+
+def _journal_entries(file):
+    for line in iter(file.readline, b''):
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            # A torn last line, from a crash or an append still in progress: the next append cuts it off
+            return
+        yield entry['key'], entry['field'], entry['value']
+
+# Function to apply a data file's journal to freshly loaded records
+def replay_journal(records, json_filename):
+    try:
+        with open(journal_path(json_filename), 'rb') as file:
+            return apply_keyed_changes(records, _journal_entries(file))
+    except FileNotFoundError:
+        return 0
+
+def discard_journal(json_filename):
+    try:
+        os.remove(journal_path(json_filename))
+    except FileNotFoundError:
+        pass
+
+# Function to write edits to a dataset: to the SQLite backend if given, else journal them,
+# or rewrite the whole file when journaling is off. Records added to the dataset (added, already
+# in records) cannot be journaled, so they take a rewrite too
+@traced()
+def write_changes(records, json_filename, changes, journal=True, backend=None, added=()):
+    if not (changes or added):
+        return
+    if backend is not None:
+        if added:
+            backend.append_records(json_filename, added)
+        backend.apply_changes(json_filename, changes)
+        return
+    with CommitLock(json_filename) as lock:
+        if not journal or added:
+            _rewrite_records(lock, records, json_filename, changes, added)
+        elif append_journal(json_filename, changes) > JOURNAL_COMPACT_BYTES:
+            # The journal holds our changes now, so a stale writer folds it in as it is
+            _rewrite_records(lock, records, json_filename, [])
+
+# Function to fold a data file's journal into a fresh snapshot of the file
+def compact_journal(records, json_filename):
+    if os.path.exists(journal_path(json_filename)):
+        with CommitLock(json_filename) as lock:
+            _rewrite_records(lock, records, json_filename, [])
+
+class WriteBehindSaver:
+    """ Background thread that writes dataset edits after a short debounce.
+
+    Edits submitted while a write is pending are coalesced per data file, so a burst of
+    clicks costs one journal append (or one rewrite) and the Tk thread never waits on disk.
+    A write that fails is retried after retry_delay, doubling up to max_retry_delay.
+    """
+
+    def __init__(self, delay=0.5, max_delay=2.0, backend=None, retry_delay=1.0, max_retry_delay=30.0):
+        self.backend = backend
+        self.delay = delay
+        self.max_delay = max_delay
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._failures = 0
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._deadline = None
+        self._first_submit = None
+        self._busy = False
+        self._passes = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='write-behind-saver', daemon=True)
+        self._thread.start()
+
+    def submit(self, records, json_filename, changes, journal=True, compact=False, snapshot=False, lock=None):
+        """ Queue changes to records for writing; lock, e.g. Dataset.lock, is held while the records are written,
+        so an edit made on another thread cannot land in the middle of the file """
+        with self._cond:
+            entry = self._pending.setdefault(json_filename, {'records': records, 'changes': [], 'journal': journal, 'compact': False})
+            entry['records'] = records
+            entry['lock'] = lock
+            entry['snapshot'] = snapshot
+            entry['changes'].extend(changes)
+            entry['journal'] = journal
+            entry['compact'] = entry['compact'] or compact
+            now = time.monotonic()
+            if self._first_submit is None:
+                self._first_submit = now
+            # Debounce, but never hold edits back longer than max_delay under a steady stream of them
+            self._deadline = min(now + self.delay, self._first_submit + self.max_delay)
+            self._cond.notify_all()
+
+    def submit_snapshot(self, data, json_filename):
+        """ Queue a commit of JSON data, e.g. a progress profile (see commit_json); a newer snapshot replaces a pending one """
+        self.submit(data, json_filename, [], journal=False, snapshot=True)
+
+    def flush(self):
+        """ Write everything pending now and wait for it, e.g. before re-reading a data file """
+        with self._cond:
+            if not self._pending and not self._busy:
+                return
+            # A write already in progress may have started before the latest edits, so wait for one more pass
+            target = self._passes + (2 if self._busy else 1)
+            self._deadline = time.monotonic()
+            self._cond.notify_all()
+            while self._passes < target and not self._closed:
+                self._cond.wait()
+
+    def close(self):
+        """ Write everything pending and stop; returns the data files whose edits could not be saved """
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        return sorted(self._pending)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and (self._deadline is None or time.monotonic() < self._deadline):
+                    self._cond.wait(None if self._deadline is None else self._deadline - time.monotonic())
+                if self._closed:
+                    return
+                batch, self._pending = self._pending, {}
+                self._deadline = self._first_submit = None
+                self._busy = True
+            failed = {}
+            try:
+                for json_filename, entry in batch.items():
+                    try:
+                        if entry['snapshot']:
+                            commit_json(entry['records'], json_filename)
+                            continue
+                        with entry['lock'] or nullcontext():
+                            write_changes(entry['records'], json_filename, entry['changes'], entry['journal'], self.backend)
+                            if entry['compact']:
+                                compact_journal(entry['records'], json_filename)
+                    except Exception as e:
+                        # Not only OSError: e.g. sqlite3.OperationalError when the database is locked
+                        print(f"Error saving {json_filename}: {e}")
+                        failed[json_filename] = entry
+            finally:
+                with self._cond:
+                    # Failed edits stay queued ahead of newer ones and are retried with the next write; waiters in
+                    # flush() are released either way, so a failing write can never hang them
+                    for json_filename, entry in failed.items():
+                        newer = self._pending.get(json_filename)
+                        if newer is not None:
+                            entry['changes'].extend(newer['changes'])
+                            entry.update(records=newer['records'], lock=newer['lock'], journal=newer['journal'], compact=entry['compact'] or newer['compact'])
+                        self._pending[json_filename] = entry
+                    if failed:
+                        # Retry on our own rather than waiting for the next edit, backing off while the writes keep failing
+                        self._failures += 1
+                        retry_at = time.monotonic() + min(self.retry_delay * 2 ** (self._failures - 1), self.max_retry_delay)
+                        self._deadline = retry_at if self._deadline is None else min(self._deadline, retry_at)
+                    else:
+                        self._failures = 0
+                    self._busy = False
+                    self._passes += 1
+                    self._cond.notify_all()
+
+# Function to list the (record key, field, new value) changes between a record and edited values for it
+def record_changes(record, values):
+    key = record_iid(record)
+    return [(key, field, value) for field, value in values.items() if record.get(field) != value]
+
+# Tokenizer shared by the search index and the query parser
+_WORD_RE = re.compile(r"\w+")
+
+def tokenize(text):
+    return _WORD_RE.findall(text.lower())
+
+# Query syntax: words, "quoted phrases", title:/desc:/id: prefixes, AND/OR/NOT and parentheses.
+# Adjacent terms are implicitly ANDed, bare words match token prefixes, id: also accepts ranges (id:1-40).
+_QUERY_TOKEN_RE = re.compile(r'[()]|(?:(\w+):)?"([^"]*)"?|[^\s()"]+')
+QUERY_FIELDS = {'title': 'title', 'desc': 'description', 'description': 'description', 'id': 'id'}
+FILTER_BY_FIELDS = {'ID': 'id', 'Title': 'title', 'Description': 'description'}
+
+def parse_query(query, default_field='title'):
+    """ Parse a search query into a small AST of ('term'|'and'|'or'|'not'|'all', ...) tuples """
+    tokens = []
+    for match in _QUERY_TOKEN_RE.finditer(query):
+        text = match.group(0)
+        if text in ('(', ')'):
+            tokens.append((text, None))
+        elif match.group(2) is not None:
+            field = QUERY_FIELDS.get((match.group(1) or '').lower(), default_field)
+            tokens.append(('term', (field, match.group(2), True)))
+        elif text in ('AND', 'OR', 'NOT'):
+            tokens.append((text, None))
+        else:
+            field, sep, value = text.partition(':')
+            if sep and field.lower() in QUERY_FIELDS:
+                tokens.append(('term', (QUERY_FIELDS[field.lower()], value, False)))
+            else:
+                tokens.append(('term', (default_field, text, False)))
+
+    pos = 0
+
+    def peek():
+        return tokens[pos][0] if pos < len(tokens) else None
+
+    def parse_or():
+        nonlocal pos
+        children = [parse_and()]
+        while peek() == 'OR':
+            pos += 1
+            children.append(parse_and())
+        children = [child for child in children if child is not None]
+        if not children:
+            return None
+        return children[0] if len(children) == 1 else ('or', children)
+
+    def parse_and():
+        nonlocal pos
+        children = []
+        while peek() not in (None, ')', 'OR'):
+            if peek() == 'AND':
+                pos += 1
+                continue
+            child = parse_not()
+            if child is not None:
+                children.append(child)
+        if not children:
+            return None
+        return children[0] if len(children) == 1 else ('and', children)
+
+    def parse_not():
+        nonlocal pos
+        if peek() == 'NOT':
+            pos += 1
+            child = parse_not()
+            return ('not', child) if child is not None else None
+        if peek() not in ('term', '('):
+            return None
+        kind, value = tokens[pos]
+        pos += 1
+        if kind == '(':
+            child = parse_or()
+            if peek() == ')':
+                pos += 1
+            return child
+        field, text, is_phrase = value
+        if field == 'id':
+            return ('term', field, text.strip(), is_phrase) if text.strip() else None
+        words = tokenize(text)
+        if not words:
+            return None
+        return ('term', field, words, is_phrase or len(words) > 1)
+
+    tree = None
+    while pos < len(tokens):
+        # Stray closing parentheses are skipped so a half-typed query still parses
+        node = parse_or()
+        if node is not None:
+            tree = node if tree is None else ('and', [tree, node])
+        if peek() == ')':
+            pos += 1
+    return tree or ('all',)
+
+# Fuzzy search: how alike a word must be to a query word, how many close words each query word may
+# expand to, how many ranked results to return, and how much a title hit counts against a description hit
+FUZZY_FILTER = 'Fuzzy'
+FUZZY_THRESHOLD = 0.3
+FUZZY_WORDS = 25
+FUZZY_LIMIT = 500
+FUZZY_WEIGHTS = {'title': 2.0, 'description': 1.0}
+
+# Function to get a word's character trigrams, padded so word starts and ends count too
+def trigrams(word):
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class TrigramIndex:
+    """ Character-trigram index over a vocabulary, for finding the words closest to a misspelled one """
+
+    def __init__(self, words=()):
+        self._grams = {}   # trigram -> set of words containing it
+        self._sizes = {}   # word -> number of distinct trigrams
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        if word in self._sizes:
+            return
+        grams = trigrams(word)
+        self._sizes[word] = len(grams)
+        for gram in grams:
+            self._grams.setdefault(gram, set()).add(word)
+
+    def remove(self, word):
+        if self._sizes.pop(word, None) is None:
+            return
+        for gram in trigrams(word):
+            words = self._grams.get(gram)
+            if words is not None:
+                words.discard(word)
+                if not words:
+                    del self._grams[gram]
+
+    def similar(self, word, threshold=FUZZY_THRESHOLD, limit=FUZZY_WORDS):
+        """ Return up to limit (similarity, word) pairs, best first, with trigram Jaccard similarity >= threshold """
+        grams = trigrams(word)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._grams.get(gram, ()))
+        size, sizes = len(grams), self._sizes
+        scored = ((count / (size + sizes[other] - count), other) for other, count in shared.items())
+        return heapq.nlargest(limit, (pair for pair in scored if pair[0] >= threshold))
+
+class _PackedPostings(dict):
+    """ Postings restored from a snapshot: token -> packed record positions, turned into a set of id()s when first used """
+
+    def __init__(self, packed, ids):
+        super().__init__(packed)
+        self._ids = ids
+
+    def __getitem__(self, token):
+        docs = dict.__getitem__(self, token)
+        if type(docs) is bytes:
+            docs = array('i')
+            docs.frombytes(dict.__getitem__(self, token))
+            docs = self[token] = set(map(self._ids.__getitem__, docs))
+        return docs
+
+    def get(self, token, default=None):
+        return self[token] if token in self else default
+
+class SearchIndex:
+    """ Token-level inverted index over substory titles, descriptions and IDs.
+
+    Postings map a token to the set of id()s of the records containing it, so a query
+    result can be applied to any ordering of the same record list. Fields given a scanner,
+    a function (words, is_phrase) -> set of id()s, are searched through it instead of
+    being indexed.
+    """
+    TEXT_FIELDS = ('title', 'description')
+
+    def __init__(self, records=(), scanners=None):
+        self.records = {}
+        self._values = {}
+        self.scanners = scanners or {}
+        self._postings = {field: {} for field in self.TEXT_FIELDS + ('id',) if field not in self.scanners}
+        self._vocab = {field: None for field in self._postings}
+        self._trigrams = {field: None for field in self._postings}  # built on the first fuzzy search
+        for record in records:
+            self.add(record)
+
+    def _field_tokens(self, field, value):
+        if field == 'id':
+            return {str(value)}
+        return set(tokenize(value))
+
+    def _link(self, field, key, tokens):
+        postings = self._postings[field]
+        vocab = self._vocab[field]
+        for token in tokens:
+            docs = postings.get(token)
+            if docs is None:
+                docs = postings[token] = set()
+                if vocab is not None:
+                    bisect.insort(vocab, token)
+                if self._trigrams[field] is not None:
+                    self._trigrams[field].add(token)
+            docs.add(key)
+
+    def _unlink(self, field, key, tokens):
+        postings = self._postings[field]
+        vocab = self._vocab[field]
+        for token in tokens:
+            docs = postings.get(token)
+            if docs is None:
+                continue
+            docs.discard(key)
+            if not docs:
+                del postings[token]
+                if vocab is not None:
+                    del vocab[bisect.bisect_left(vocab, token)]
+                if self._trigrams[field] is not None:
+                    self._trigrams[field].remove(token)
+
+    def add(self, record):
+        key = id(record)
+        if key in self.records:
+            self.update(record)
+            return
+        self.records[key] = record
+        values = {field: record.get(field, '') for field in self._postings}
+        self._values[key] = values
+        for field, value in values.items():
+            self._link(field, key, self._field_tokens(field, value))
+
+    def remove(self, record):
+        key = id(record)
+        values = self._values.pop(key, None)
+        if values is None:
+            return
+        del self.records[key]
+        for field, value in values.items():
+            self._unlink(field, key, self._field_tokens(field, value))
+
+    def update(self, record):
+        """ Re-index only the fields of an edited record whose value actually changed """
+        key = id(record)
+        values = self._values.get(key)
+        if values is None:
+            self.add(record)
+            return
+        for field, old_value in values.items():
+            new_value = record.get(field, '')
+            if new_value is old_value or new_value == old_value:
+                continue
+            old_tokens = self._field_tokens(field, old_value)
+            new_tokens = self._field_tokens(field, new_value)
+            self._unlink(field, key, old_tokens - new_tokens)
+            self._link(field, key, new_tokens - old_tokens)
+            values[field] = new_value
+
+    def _prefix_docs(self, field, prefix):
+        postings = self._postings[field]
+        vocab = self._vocab[field]
+        if vocab is None:
+            vocab = self._vocab[field] = sorted(postings)
+        start = bisect.bisect_left(vocab, prefix)
+        end = bisect.bisect_left(vocab, prefix + '\U0010ffff')
+        if end - start == 1:
+            return postings[vocab[start]]
+        return set().union(*(postings[token] for token in vocab[start:end]))
+
+    def _id_docs(self, text, exact):
+        low, sep, high = text.partition('-')
+        if sep and low.strip().isdigit() and high.strip().isdigit():
+            low, high = int(low), int(high)
+            postings = self._postings['id']
+            if high - low >= len(postings):
+                # A range wider than the index: test the IDs there are rather than every number in it
+                keys = [key for key in postings if key.isdigit() and low <= int(key) <= high]
+            else:
+                keys = map(str, range(low, high + 1))
+            return set().union(*(postings.get(key, ()) for key in keys))
+        if exact:
+            return self._postings['id'].get(text, set())
+        return self._prefix_docs('id', text)
+
+    def _phrase_docs(self, field, words):
+        candidates = sorted((self._postings[field].get(word, set()) for word in set(words)), key=len)
+        docs = set(candidates[0]).intersection(*candidates[1:])
+        # Verify word adjacency only on the records that contain every word
+        size = len(words)
+        matched = set()
+        for key in docs:
+            tokens = tokenize(self._values[key][field])
+            if any(tokens[i:i + size] == words for i in range(len(tokens) - size + 1)):
+                matched.add(key)
+        return matched
+
+    def _evaluate(self, node):
+        kind = node[0]
+        if kind == 'all':
+            return set(self.records)
+        if kind == 'term':
+            _, field, value, is_phrase = node
+            if field == 'id':
+                return self._id_docs(value, is_phrase)
+            if field in self.scanners:
+                return self.scanners[field](value, is_phrase) & self.records.keys()
+            if is_phrase:
+                return self._phrase_docs(field, value)
+            return self._prefix_docs(field, value[0])
+        if kind == 'not':
+            return set(self.records) - self._evaluate(node[1])
+        if kind == 'or':
+            return set().union(*(self._evaluate(child) for child in node[1]))
+        # AND: intersect the positive operands smallest first, then subtract the negated ones
+        positives = [self._evaluate(child) for child in node[1] if child[0] != 'not']
+        negatives = [self._evaluate(child[1]) for child in node[1] if child[0] == 'not']
+        if positives:
+            positives.sort(key=len)
+            result = set(positives[0]).intersection(*positives[1:])
+        else:
+            result = set(self.records)
+        for docs in negatives:
+            result -= docs
+        return result
+
+    def pack(self, records):
+        """ The postings with each record given as its position in records, for a snapshot (see unpack) """
+        positions = {id(record): position for position, record in enumerate(records)}
+        return {field: {token: array('i', map(positions.__getitem__, postings[token])).tobytes() for token in postings}
+                for field, postings in self._postings.items()}
+
+    @classmethod
+    def unpack(cls, records, packed):
+        """ Restore a pack() result over the same records; each token's postings are unpacked on first use """
+        index = cls()
+        ids = [id(record) for record in records]
+        index.records = dict(zip(ids, records))
+        index._postings = {field: _PackedPostings(postings, ids) for field, postings in packed.items()}
+        index._vocab = {field: None for field in index._postings}
+        index._trigrams = {field: None for field in index._postings}
+        fields = list(index._postings)
+        index._values = {id(record): {field: record.get(field, '') for field in fields} for record in records}
+        return index
+
+    def search(self, query, default_field='title'):
+        """ Return the set of id()s of the records matching the query """
+        return self._evaluate(parse_query(query, default_field))
+
+    @traced('fuzzy_search')
+    def fuzzy_search(self, query, candidates=None, limit=FUZZY_LIMIT, weights=FUZZY_WEIGHTS):
+        """ Return up to limit (score, id()) pairs, best first, for records with words close to the query's.
+
+        Each query word expands to the indexed words with similar trigrams; a record scores the
+        best similarity per query word and field, weighted per field. Only the records whose
+        id() is in candidates (if given) are ranked.
+        """
+        scores = Counter()
+        for word in set(tokenize(query)):
+            for field, weight in weights.items():
+                if field not in self._postings:
+                    continue
+                trigram_index = self._trigrams[field]
+                if trigram_index is None:
+                    trigram_index = self._trigrams[field] = TrigramIndex(self._postings[field])
+                # Lowest similarity first, so a record keeps the best one via the later updates
+                best = {}
+                for similarity, token in reversed(trigram_index.similar(word)):
+                    best.update(dict.fromkeys(self._postings[field][token], similarity * weight))
+                scores.update(best)
+        items = scores.items()
+        if candidates is not None:
+            items = ((key, score) for key, score in items if key in candidates)
+        return [(score, key) for key, score in heapq.nlargest(limit, items, key=itemgetter(1))]
+
+_DIGITS_RE = re.compile(r'(\d+)')
+
+# Natural, case-insensitive sort key: "chapter 10" sorts after "chapter 9"
+def natural_key(text):
+    return tuple(int(part) if index % 2 else part for index, part in enumerate(_DIGITS_RE.split(text.casefold())))
+
+# Sort key for an "available from" chapter: numbered chapters in order, then the finale
+def chapter_key(chapter):
+    return (chapter.strip().casefold() == 'finale', natural_key(chapter))
+
+# Statuses sort in the order a playthrough moves through them
+STATUS_ORDER = {'Not Completed': 0, 'In Progress': 1, 'Completed': 2}
+
+# Sort keys per table column
+SORT_KEYS = {
+    'ID': lambda x: x['id'],
+    'Title': lambda x: natural_key(x['title']),
+    'Description': lambda x: description_preview(x).casefold(),
+    'Character': lambda x: x.get('character', '').casefold(),
+    'Available From': lambda x: chapter_key(x.get('available from', '')),
+    'Status': lambda x: (STATUS_ORDER.get(x['status'], len(STATUS_ORDER)), x['status']),
+}
+
+# Function to turn a column name (plus direction) or a list of (column, descending) pairs into a sort order
+def sort_order(order_by, descending=False):
+    if order_by is None:
+        return ()
+    if isinstance(order_by, str):
+        return ((order_by, descending),)
+    return tuple((column, bool(desc)) for column, desc in order_by)
+
+# Function to sort substories by one or more table columns; ties keep their current order
+@traced()
+def sort_substories(substories, order_by, reverse=False):
+    result = list(substories)
+    for column, descending in reversed(sort_order(order_by, reverse)):
+        result.sort(key=SORT_KEYS[column], reverse=descending)
+    return result
+
+class SortCache:
+    """ Precomputed sort keys, dense ranks and cached sort permutations for a record list.
+
+    Keys are computed once per column; an edit only invalidates the columns whose key
+    changed. Sorting the whole list is a lookup of the cached permutation, and a filtered
+    view is either picked out of that permutation or sorted by the small integer ranks.
+    """
+    MAX_ORDERS = 8
+
+    def __init__(self, records):
+        self.records = records
+        self._keys = {}     # column -> {id(record): sort key}
+        self._ranks = {}    # column -> {id(record): dense rank}, equal keys share a rank
+        self._orders = {}   # sort order -> sorted list of all records, least recently used first
+
+    def _column_ranks(self, column):
+        ranks = self._ranks.get(column)
+        if ranks is None:
+            keys = self._keys.get(column)
+            if keys is None:
+                key = SORT_KEYS[column]
+                keys = self._keys[column] = {id(record): key(record) for record in self.records}
+            ranks, rank, previous = {}, -1, object()
+            for doc in sorted(keys, key=keys.__getitem__):
+                if keys[doc] != previous:
+                    rank, previous = rank + 1, keys[doc]
+                ranks[doc] = rank
+            self._ranks[column] = ranks
+        return ranks
+
+    def _sort(self, records, order):
+        if len(order) == 1:
+            (column, descending), = order
+            ranks = self._column_ranks(column)
+            return sorted(records, key=lambda record: ranks[id(record)], reverse=descending)
+        columns = [(self._column_ranks(column), -1 if descending else 1) for column, descending in order]
+        return sorted(records, key=lambda record: tuple(sign * ranks[id(record)] for ranks, sign in columns))
+
+    def ordered(self, order):
+        """ Return all records in the given sort order (a cached list; do not modify it) """
+        order = sort_order(order)
+        permutation = self._orders.pop(order, None)
+        if permutation is None:
+            permutation = self._sort(self.records, order)
+            if len(self._orders) >= self.MAX_ORDERS:
+                del self._orders[next(iter(self._orders))]
+        self._orders[order] = permutation
+        return permutation
+
+    @traced('sort_cached')
+    def sort(self, records, order):
+        """ Sort records, a subset of the cached list in its original order, e.g. a filtered view """
+        order = sort_order(order)
+        if not order:
+            return list(records)
+        if len(records) == len(self.records):
+            return list(self.ordered(order))
+        if len(records) * max(1, len(records).bit_length()) > len(self.records):
+            # Walking the full permutation is cheaper than sorting this many records
+            members = {id(record) for record in records}
+            return [record for record in self.ordered(order) if id(record) in members]
+        return self._sort(records, order)
+
+    def forget(self, column):
+        """ Drop a column's keys and the orders using it, e.g. after many records' values changed at once """
+        self._keys.pop(column, None)
+        self._ranks.pop(column, None)
+        for order in [order for order in self._orders if any(c == column for c, _ in order)]:
+            del self._orders[order]
+
+    def update(self, record):
+        """ Recompute an edited record's keys and drop the cached orders they affect """
+        doc = id(record)
+        for column, keys in self._keys.items():
+            key = SORT_KEYS[column](record)
+            if keys.get(doc) != key:
+                keys[doc] = key
+                self._ranks.pop(column, None)
+                for order in [order for order in self._orders if any(c == column for c, _ in order)]:
+                    del self._orders[order]
+
+# Bits of each byte value, least significant first, for turning a bitset back into records
+_BYTE_BITS = [tuple((byte >> bit) & 1 for bit in range(8)) for byte in range(256)]
+
+class FacetIndex:
+    """ One bitset per status, chapter and character value over a record list, plus per-value counts.
+
+    Bit i of a value's bitset is set when records[i] has that value. An edit flips at most two
+    bits per facet and adjusts a few counters, so the counts shown next to the filter choices
+    never need a recount. Filtering ORs the chosen values' bitsets within a facet and ANDs the
+    facets together.
+    """
+    FACETS = {'status': 'status', 'chapter': 'available from', 'character': 'character'}
+    DONE_STATUS = 'Completed'
+
+    def __init__(self, records):
+        self.records = records
+        self._positions = {}
+        self._values = []   # per position: (status, chapter, character)
+        self._bits = {facet: {} for facet in self.FACETS}
+        self.totals = {facet: Counter() for facet in self.FACETS}
+        self.done = {facet: Counter() for facet in self.FACETS}
+        for record in records:
+            self._append(record)
+
+    def _record_values(self, record):
+        return tuple(record.get(field, '') for field in self.FACETS.values())
+
+    def _count(self, values, sign):
+        done = values[0] == self.DONE_STATUS
+        for facet, value in zip(self.FACETS, values):
+            self.totals[facet][value] += sign
+            if done:
+                self.done[facet][value] += sign
+
+    def _set_bit(self, facet, value, position, on):
+        bits = self._bits[facet].get(value)
+        if bits is None:
+            bits = self._bits[facet][value] = bytearray(len(self.records) // 8 + 1)
+        byte = position >> 3
+        if byte >= len(bits):
+            bits.extend(bytes(byte + 1 - len(bits)))
+        if on:
+            bits[byte] |= 1 << (position & 7)
+        else:
+            bits[byte] &= ~(1 << (position & 7)) & 0xFF
+
+    def _append(self, record):
+        position = len(self._values)
+        values = self._record_values(record)
+        self._positions[id(record)] = position
+        self._values.append(values)
+        for facet, value in zip(self.FACETS, values):
+            self._set_bit(facet, value, position, True)
+        self._count(values, 1)
+
+    def update(self, record):
+        """ Move an edited (or newly appended) record to its current facet values """
+        position = self._positions.get(id(record))
+        if position is None:
+            self._append(record)
+            return
+        old_values = self._values[position]
+        values = self._record_values(record)
+        if values == old_values:
+            return
+        for facet, old_value, value in zip(self.FACETS, old_values, values):
+            if value != old_value:
+                self._set_bit(facet, old_value, position, False)
+                self._set_bit(facet, value, position, True)
+        self._count(old_values, -1)
+        self._count(values, 1)
+        self._values[position] = values
+
+    def refresh(self, facet):
+        """ Re-read every record's value of one facet in one pass, e.g. after switching progress profiles or a bulk edit """
+        slot = list(self.FACETS).index(facet)
+        field = self.FACETS[facet]
+        facet_values = [record.get(field, '') for record in self.records]
+        self._values = [values[:slot] + (value,) + values[slot + 1:] for value, values in zip(facet_values, self._values)]
+        bits = self._bits[facet] = {}
+        size = len(self.records) // 8 + 1
+        for position, value in enumerate(facet_values):
+            value_bits = bits.get(value)
+            if value_bits is None:
+                value_bits = bits[value] = bytearray(size)
+            value_bits[position >> 3] |= 1 << (position & 7)
+        self.totals[facet] = Counter(facet_values)
+        done = [values for values in self._values if values[0] == self.DONE_STATUS]
+        for position, done_facet in enumerate(self.FACETS):
+            self.done[done_facet] = Counter(values[position] for values in done)
+
+    def pack(self):
+        """ The bitsets and counts as plain data, for a snapshot (see unpack) """
+        return {
+            'values': self._values,
+            'bits': {facet: {value: bytes(bits) for value, bits in values.items()} for facet, values in self._bits.items()},
+            'totals': {facet: dict(counts) for facet, counts in self.totals.items()},
+            'done': {facet: dict(counts) for facet, counts in self.done.items()},
+        }
+
+    @classmethod
+    def unpack(cls, records, packed):
+        """ Restore a pack() result over the same records """
+        facets = cls(())
+        facets.records = records
+        facets._positions = {id(record): position for position, record in enumerate(records)}
+        facets._values = packed['values']
+        facets._bits = {facet: {value: bytearray(bits) for value, bits in values.items()} for facet, values in packed['bits'].items()}
+        facets.totals = {facet: Counter(counts) for facet, counts in packed['totals'].items()}
+        facets.done = {facet: Counter(counts) for facet, counts in packed['done'].items()}
+        return facets
+
+    def counts(self, facet):
+        """ Return {value: (done, total)} for a facet """
+        done = self.done[facet]
+        return {value: (done[value], total) for value, total in self.totals[facet].items() if total}
+
+    def mask(self, status_filters=('All',), chapter_filters=('All',), character_filters=('All',)):
+        """ Return the bitset (an int) of the records passing the facet filters, or None if none restricts """
+        mask = None
+        for facet, chosen in zip(self.FACETS, (status_filters, chapter_filters, character_filters)):
+            if 'All' in chosen:
+                continue
+            bits = self._bits[facet]
+            facet_mask = 0
+            for value in set(chosen):
+                if value in bits:
+                    facet_mask |= int.from_bytes(bits[value], 'little')
+            mask = facet_mask if mask is None else mask & facet_mask
+            if not mask:
+                return 0
+        return mask
+
+    def select(self, status_filters=('All',), chapter_filters=('All',), character_filters=('All',)):
+        """ Return the records passing the facet filters, in record order """
+        mask = self.mask(status_filters, chapter_filters, character_filters)
+        if mask is None:
+            return list(self.records)
+        data = mask.to_bytes((len(self.records) + 7) // 8, 'little')
+        return list(compress(self.records, chain.from_iterable(map(_BYTE_BITS.__getitem__, data))))
+
+# Function to filter substories; with a FacetIndex over the same list, the status/chapter/character
+# filters are bitset operations instead of passes over the records
+@traced()
+def filter_substories(query, substories, filter_by, status_filters, chapter_filters, character_filters=[], index=None, facets=None):
+    if facets is not None and facets.records is substories:
+        substories = facets.select(status_filters, chapter_filters, character_filters)
+        status_filters = chapter_filters = character_filters = ['All']
+
+    filtered = substories
+    if index is not None:
+        if query.strip():
+            hits = index.search(query, FILTER_BY_FIELDS.get(filter_by, 'title'))
+            filtered = [substory for substory in substories if id(substory) in hits]
+    elif filter_by == 'ID':
+        filtered = [substory for substory in substories if query in str(substory['id'])]
+    elif filter_by == 'Title':
+        filtered = [substory for substory in filtered if query.lower() in substory['title'].lower()]
+    elif filter_by == 'Description':
+        filtered = [substory for substory in filtered if query.lower() in substory['description'].lower()]
+
+    if 'All' not in status_filters:
+        filtered = [substory for substory in filtered if substory['status'] in status_filters]
+    
+    if 'All' not in chapter_filters:
+        filtered = [substory for substory in filtered if substory.get('available from', '') in chapter_filters]
+
+    if 'All' not in character_filters:
+        filtered = [substory for substory in filtered if substory.get('character', '') in character_filters]
+
+    return filtered
+
+# Treeview item ID of a record; Yakuza 4 numbers substories per character, so the character is part of it
+def record_iid(record):
+    if 'character' in record:
+        return f"{record['character']}:{record['id']}"
+    return str(record['id'])
+
+# Function to get a record key after the record's ID changes: '<character>:<id>' or '<id>'
+def rekeyed(key, new_id):
+    prefix, sep, _ = key.rpartition(':')
+    return f'{prefix}{sep}{new_id}'
+
+# Function to get a record key after the record's character changes: '<character>:<id>', or '<id>' without one
+def recharactered(key, new_character):
+    record_id = key.rpartition(':')[2]
+    return f'{new_character}:{record_id}' if new_character else record_id
+
+class RecordStore:
+    """ A dataset's record list plus a dict index from record key (see record_iid) to record """
+
+    def __init__(self, records):
+        self.records = records
+        self._by_key = {}
+        for record in records:
+            # Keep the first record for a duplicated key, as the old linear lookups did
+            self._by_key.setdefault(record_iid(record), record)
+
+    def __len__(self):
+        return len(self._by_key)
+
+    def __contains__(self, key):
+        return key in self._by_key
+
+    def __getitem__(self, key):
+        return self._by_key[key]
+
+    def get(self, key, default=None):
+        return self._by_key.get(key, default)
+
+    def rekey(self, record, new_id):
+        """ Change a record's ID, refusing an ID already used by another record """
+        old_key = record_iid(record)
+        new_key = record_iid(dict(record, id=new_id))
+        if new_key == old_key:
+            return
+        if new_key in self._by_key:
+            raise ValueError(f"ID {new_id} is already used by \"{self._by_key[new_key]['title']}\".")
+        if self._by_key.get(old_key) is record:
+            del self._by_key[old_key]
+        record['id'] = new_id
+        self._by_key[new_key] = record
+
+_ABSENT = object()
+ABSENT_FIELD = _ABSENT  # a field value meaning "the record has no such field", e.g. in merge_external_changes results
+
+class CodeTable:
+    """ Interning table giving each distinct value (a status, chapter, character or field layout) a small integer code """
+
+    def __init__(self):
+        self.values = [_ABSENT]  # code 0 marks a field the record does not have
+        self.codes = {}
+
+    def code(self, value):
+        # Keyed by type as well, so True and 1 keep their own codes
+        key = (type(value), value)
+        code = self.codes.get(key)
+        if code is None:
+            code = self.codes[key] = len(self.values)
+            self.values.append(value)
+        return code
+
+STATUS_CODES = CodeTable()
+CHAPTER_CODES = CodeTable()
+CHARACTER_CODES = CodeTable()
+LAYOUT_CODES = CodeTable()  # field names of a record, in their JSON order
+_LAYOUT_EXTRA_FIELDS = {}   # layout code -> its fields that have no slot of their own
+
+class CompactRecord(MutableMapping):
+    """ A substory or revelation in __slots__ that still behaves like the JSON dict it came from.
+
+    Status, chapter and character are stored as CodeTable codes, and the record's field order
+    as a layout code, so a record costs a fixed-size object instead of a dict plus a copy of
+    every repeated string. Fields outside the usual schema are kept in a small dict.
+    """
+    __slots__ = ('_id', '_title', '_description', '_completed', '_status', '_chapter', '_character', '_layout', '_extra')
+    PLAIN_FIELDS = {'id': '_id', 'title': '_title', 'description': '_description', 'completed': '_completed'}
+    CODED_FIELDS = {'status': ('_status', STATUS_CODES), 'available from': ('_chapter', CHAPTER_CODES), 'character': ('_character', CHARACTER_CODES)}
+
+    def __init__(self, fields=()):
+        if not isinstance(fields, dict):
+            fields = dict(fields)
+        get = fields.get
+        self._id = get('id', _ABSENT)
+        self._title = get('title', _ABSENT)
+        self._description = get('description', _ABSENT)
+        self._completed = get('completed', _ABSENT)
+        self._status = STATUS_CODES.code(fields['status']) if 'status' in fields else 0
+        self._chapter = CHAPTER_CODES.code(fields['available from']) if 'available from' in fields else 0
+        self._character = CHARACTER_CODES.code(fields['character']) if 'character' in fields else 0
+        self._layout = LAYOUT_CODES.code(tuple(fields))
+        extra_fields = _LAYOUT_EXTRA_FIELDS.get(self._layout)
+        if extra_fields is None:
+            extra_fields = _LAYOUT_EXTRA_FIELDS[self._layout] = tuple(
+                field for field in fields if field not in self.PLAIN_FIELDS and field not in self.CODED_FIELDS)
+        self._extra = {field: fields[field] for field in extra_fields} if extra_fields else None
+
+    def __getitem__(self, field):
+        slot = self.PLAIN_FIELDS.get(field)
+        if slot is not None:
+            value = getattr(self, slot)
+        elif field in self.CODED_FIELDS:
+            slot, table = self.CODED_FIELDS[field]
+            value = table.values[getattr(self, slot)]
+        else:
+            value = self._extra.get(field, _ABSENT) if self._extra else _ABSENT
+        if value is _ABSENT:
+            raise KeyError(field)
+        return value
+
+    def __setitem__(self, field, value):
+        slot = self.PLAIN_FIELDS.get(field)
+        if slot is not None:
+            setattr(self, slot, value)
+        elif field in self.CODED_FIELDS:
+            slot, table = self.CODED_FIELDS[field]
+            setattr(self, slot, table.code(value))
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[field] = value
+        layout = LAYOUT_CODES.values[self._layout]
+        if field not in layout:
+            self._layout = LAYOUT_CODES.code(layout + (field,))
+
+    def __delitem__(self, field):
+        layout = LAYOUT_CODES.values[self._layout]
+        if field not in layout:
+            raise KeyError(field)
+        if field in self.PLAIN_FIELDS:
+            setattr(self, self.PLAIN_FIELDS[field], _ABSENT)
+        elif field in self.CODED_FIELDS:
+            setattr(self, self.CODED_FIELDS[field][0], 0)
+        else:
+            del self._extra[field]
+        self._layout = LAYOUT_CODES.code(tuple(name for name in layout if name != field))
+
+    def __contains__(self, field):
+        return field in LAYOUT_CODES.values[self._layout]
+
+    def __iter__(self):
+        return iter(LAYOUT_CODES.values[self._layout])
+
+    def __len__(self):
+        return len(LAYOUT_CODES.values[self._layout])
+
+    def __repr__(self):
+        return f'CompactRecord({self.to_dict()!r})'
+
+    def to_dict(self):
+        return {field: self[field] for field in LAYOUT_CODES.values[self._layout]}
+
+# Function to replace a list's dict records with CompactRecords, one at a time so the dicts are freed as it goes
+def compact_records(records):
+    for position, record in enumerate(records):
+        records[position] = CompactRecord(record)
+    return records
+
+# json.dump hook for CompactRecords
+def json_default(value):
+    if isinstance(value, CompactRecord):
+        return value.to_dict()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+# Lazy descriptions: a data file's descriptions are copied once into a sidecar blob, NUL-separated,
+# next to a JSON index holding their byte offsets and every record's other fields (with a short
+# preview in place of the description). The index is rebuilt whenever the data file changes
+# behind our back, and rewritten whenever we save the data file ourselves.
+DESCRIPTION_BLOB_SUFFIX = '.desc'
+DESCRIPTION_INDEX_SUFFIX = '.desc.json'
+DESCRIPTION_INDEX_VERSION = 1
+DESCRIPTION_PREVIEW_CHARS = 120
+DESCRIPTION_CACHE_SIZE = 256
+_SCAN_CHUNK_RECORDS = 1024
+
+def description_preview_text(text):
+    if not isinstance(text, str):
+        return ''
+    return text if len(text) <= DESCRIPTION_PREVIEW_CHARS else text[:DESCRIPTION_PREVIEW_CHARS].rstrip() + '...'
+
+class DescriptionBlob:
+    """ A dataset's descriptions in the sidecar blob, read on demand through mmap and an LRU cache """
+
+    def __init__(self, path, offsets, cache_size=DESCRIPTION_CACHE_SIZE):
+        import mmap
+        self.path = path
+        self.offsets = array('q', offsets)  # record i is blob[offsets[i]:offsets[i + 1] - 1]
+        self.records = []   # LazyRecords by position in the data file
+        self.edited = {}    # id() -> LazyRecord whose description is held in memory instead
+        with open(path, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] else b''
+        self.text = functools.lru_cache(maxsize=cache_size)(self.read)
+
+    def read(self, position):
+        return self._map[self.offsets[position]:self.offsets[position + 1] - 1].decode('utf-8')
+
+    def scan(self, words, is_phrase):
+        """ Return the id()s of the records whose description matches a query term, as SearchIndex would """
+        # The first word leads as a literal (so the regex engine can skip ahead quickly), then a
+        # lookbehind checks it starts a token; phrase words must be whole, adjacent tokens
+        first = re.escape(words[0])
+        pattern = first + r'(?<!\w' + first + ')'
+        if is_phrase:
+            pattern += ''.join(r'[^\w\x00]+' + re.escape(word) for word in words[1:]) + r'(?!\w)'
+        pattern = re.compile(pattern)
+        docs = set()
+        count = len(self.offsets) - 1
+        for start in range(0, count, _SCAN_CHUNK_RECORDS):
+            stop = min(start + _SCAN_CHUNK_RECORDS, count)
+            text = self._map[self.offsets[start]:self.offsets[stop]].decode('utf-8').lower()
+            match = pattern.search(text)
+            if match is None:
+                continue
+            ends = [nul.start() for nul in _NUL_RE.finditer(text)]
+            while match is not None:
+                # One hit is enough for a record: resume the search after its end
+                position = bisect.bisect_right(ends, match.start())
+                record = self.records[start + position]
+                if record._preview is not None:
+                    docs.add(id(record))
+                match = pattern.search(text, ends[position] + 1)
+        for key, record in self.edited.items():
+            text = record.get('description')
+            if isinstance(text, str) and pattern.search(text.lower()):
+                docs.add(key)
+        return docs
+
+_NUL_RE = re.compile('\x00')
+
+class LazyRecord(CompactRecord):
+    """ A CompactRecord whose description stays in its dataset's DescriptionBlob until it is read.
+
+    While the description is in the blob, _description holds its position there and _preview
+    the text shown in the table; once it is set in memory, _preview is None.
+    """
+    __slots__ = ('_blob', '_preview')
+
+    def __init__(self, fields, blob, position, inline=_ABSENT):
+        super().__init__(fields)
+        self._blob = blob
+        self._preview = None
+        if inline is not _ABSENT:
+            self._description = inline
+            blob.edited[id(self)] = self
+        elif self._description is not _ABSENT:
+            self._preview = self._description
+            self._description = position
+
+    def __getitem__(self, field):
+        if field == 'description' and self._preview is not None:
+            return self._blob.text(self._description)
+        return super().__getitem__(field)
+
+    def __setitem__(self, field, value):
+        if field == 'description':
+            self._preview = None
+            self._blob.edited[id(self)] = self
+        super().__setitem__(field, value)
+
+    def __delitem__(self, field):
+        if field == 'description':
+            self._preview = None
+        super().__delitem__(field)
+
+    @property
+    def preview(self):
+        if self._preview is not None:
+            return self._preview
+        return description_preview_text(self.get('description', ''))
+
+    def to_dict(self):
+        # Bulk reads (saving) bypass the cache so they do not evict the descriptions being viewed
+        return {field: self._blob.read(self._description) if field == 'description' and self._preview is not None else self[field]
+                for field in self}
+
+# Function to get the description text the table shows and sorts by; lazy records only keep a preview in memory
+def description_preview(record):
+    if isinstance(record, LazyRecord):
+        return record.preview
+    return record['description']
+
+# Function to write the description index for records; inline maps positions to descriptions kept out of the blob
+def write_description_index(records, offsets, inline, json_path):
+    index_records = []
+    for record in records:
+        fields = dict(record) if not isinstance(record, LazyRecord) else {field: record.preview if field == 'description' else record[field] for field in record}
+        if 'description' in fields:
+            fields['description'] = description_preview_text(fields['description'])
+        index_records.append(fields)
+    index = {
+        'version': DESCRIPTION_INDEX_VERSION, 'source': _file_stamp(json_path),
+        'offsets': list(offsets), 'inline': inline, 'records': index_records,
+    }
+    write_json_atomic(index, json_path + DESCRIPTION_INDEX_SUFFIX, indent=None)
+    return index
+
+def _file_stamp(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+# Function to (re)build a data file's description blob and index from its parsed records
+def build_description_sidecar(records, json_path):
+    offsets, inline = [0], {}
+
+    def write(file):
+        for position, record in enumerate(records):
+            text = record.get('description', '')
+            data = b''
+            if isinstance(text, str) and '\x00' not in text:
+                data = text.encode('utf-8')
+            elif 'description' in record:
+                inline[str(position)] = text
+            file.write(data + b'\x00')
+            offsets.append(offsets[-1] + len(data) + 1)
+    _replace_file(json_path + DESCRIPTION_BLOB_SUFFIX, write, 'wb')
+    return write_description_index(records, offsets, inline, json_path)
+
+# Function to rewrite the description index after we saved the data file, so the next start can use it
+def refresh_description_index(records, json_path):
+    blob = records[0]._blob
+    index_path = json_path + DESCRIPTION_INDEX_SUFFIX
+    if len(records) != len(blob.offsets) - 1 or any(r._preview is not None and r._description != p for p, r in enumerate(records)):
+        # Records were added, removed or reordered: let the next load rebuild the sidecars from the data file
+        if os.path.exists(index_path):
+            os.remove(index_path)
+        return
+    inline = {str(position): record['description'] for position, record in enumerate(records)
+              if record._preview is None and 'description' in record}
+    write_description_index(records, blob.offsets, inline, json_path)
+
+# Function to read a data file's description index, or None when it is missing or out of date
+def read_description_index(json_path):
+    try:
+        with open(json_path + DESCRIPTION_INDEX_SUFFIX, 'r') as file:
+            index = json.load(file)
+        if (index.get('version') != DESCRIPTION_INDEX_VERSION or index['source'] != _file_stamp(json_path)
+                or os.path.getsize(json_path + DESCRIPTION_BLOB_SUFFIX) != index['offsets'][-1]):
+            return None
+        return index
+    except (OSError, ValueError, KeyError, IndexError):
+        return None
+
+# Function to load a data file with its descriptions left on disk, building the sidecars if needed
+def load_lazy_data(json_filename):
+    json_path = resource_path(json_filename)
+    generation = commit_generation(json_filename)
+    index = read_description_index(json_path)
+    if index is None:
+        with open(json_path, 'r') as file:
+            index = build_description_sidecar(json.load(file), json_path)
+    blob = DescriptionBlob(json_path + DESCRIPTION_BLOB_SUFFIX, index['offsets'])
+    inline = index['inline']
+    fields_list = index.pop('records')
+    for position, fields in enumerate(fields_list):
+        fields_list[position] = None
+        blob.records.append(LazyRecord(fields, blob, position, inline.get(str(position), _ABSENT)))
+    replay_journal(blob.records, json_filename)
+    note_generation(json_filename, generation)
+    return blob.records
+
+# Main table columns; Yakuza 4 adds the Character column
+TABLE_COLUMNS = ("ID", "Title", "Description", "Available From", "Status")
+
+# Record field shown in each table column; the game registry adds its extra columns here
+COLUMN_FIELDS = {'ID': 'id', 'Title': 'title', 'Description': 'description', 'Character': 'character', 'Available From': 'available from', 'Status': 'status'}
+
+# Function to make a registry column known to the table and to sorting
+def register_column(name, field):
+    COLUMN_FIELDS.setdefault(name, field)
+    SORT_KEYS.setdefault(name, lambda x: natural_key(str(x.get(field, ''))))
+
+def _column_getter(column):
+    field = COLUMN_FIELDS[column]
+    if field == 'description':
+        return description_preview
+    return lambda record: record.get(field, '')
+
+# Function to build the main table's (iid, values) rows for a list of substories, in column order
+def table_rows(substories, columns=TABLE_COLUMNS):
+    if tuple(columns) == TABLE_COLUMNS:
+        return [(record_iid(s), (s['id'], s['title'], description_preview(s), s.get('available from', ''), s['status'])) for s in substories]
+    getters = [_column_getter(column) for column in columns]
+    return [(record_iid(s), tuple([get(s) for get in getters])) for s in substories]
+
+# Function to bring a Treeview (or anything with its item API) in line with a list of (iid, values) rows, touching only the rows that changed
+def sync_tree_rows(tree, rows):
+    shown = getattr(tree, 'shown_values', None)
+    if shown is None:
+        shown = tree.shown_values = {}
+    wanted = {}
+    for iid, values in rows:
+        wanted.setdefault(iid, values)
+
+    old_iids = tree.get_children()
+    stale = [iid for iid in old_iids if iid not in wanted]
+    if stale:
+        tree.delete(*stale)
+        for iid in stale:
+            shown.pop(iid, None)
+
+    # Surviving rows keep their item (and so their selection); reorder them in a single call if needed
+    survivors = [iid for iid in wanted if iid in shown]
+    if survivors != [iid for iid in old_iids if iid in wanted]:
+        tree.set_children('', *survivors)
+
+    for position, (iid, values) in enumerate(wanted.items()):
+        old_values = shown.get(iid)
+        if old_values is None:
+            tree.insert("", position, iid=iid, values=values)
+        elif old_values != values:
+            tree.item(iid, values=values)
+        shown[iid] = values
+
+# Schema of the optional SQLite backend. Each row keeps its JSON record key (see record_iid) and
+# file position; fields without a column of their own are kept as JSON in `extra`.
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS datasets (
+    name TEXT PRIMARY KEY,
+    kind TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS characters (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS substories (
+    pk INTEGER PRIMARY KEY,
+    dataset TEXT NOT NULL REFERENCES datasets(name),
+    key TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    character_id INTEGER REFERENCES characters(id),
+    title TEXT NOT NULL,
+    description TEXT NOT NULL,
+    chapter TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL,
+    completed INTEGER NOT NULL DEFAULT 0,
+    extra TEXT NOT NULL DEFAULT '{}',
+    UNIQUE (dataset, key)
+);
+CREATE INDEX IF NOT EXISTS substories_status ON substories (dataset, status);
+CREATE INDEX IF NOT EXISTS substories_chapter ON substories (dataset, chapter);
+CREATE INDEX IF NOT EXISTS substories_character ON substories (dataset, character_id);
+CREATE TABLE IF NOT EXISTS revelations (
+    pk INTEGER PRIMARY KEY,
+    dataset TEXT NOT NULL REFERENCES datasets(name),
+    key TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    character_id INTEGER REFERENCES characters(id),
+    title TEXT NOT NULL,
+    description TEXT NOT NULL,
+    status TEXT NOT NULL,
+    extra TEXT NOT NULL DEFAULT '{}',
+    UNIQUE (dataset, key)
+);
+CREATE INDEX IF NOT EXISTS revelations_status ON revelations (dataset, status);
+CREATE INDEX IF NOT EXISTS revelations_character ON revelations (dataset, character_id);
+"""
+
+SQLITE_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS substories_fts USING fts5(
+    title, description, content='substories', content_rowid='pk', prefix='2 3'
+);
+CREATE TRIGGER IF NOT EXISTS substories_fts_insert AFTER INSERT ON substories BEGIN
+    INSERT INTO substories_fts (rowid, title, description) VALUES (new.pk, new.title, new.description);
+END;
+CREATE TRIGGER IF NOT EXISTS substories_fts_delete AFTER DELETE ON substories BEGIN
+    INSERT INTO substories_fts (substories_fts, rowid, title, description) VALUES ('delete', old.pk, old.title, old.description);
+END;
+CREATE TRIGGER IF NOT EXISTS substories_fts_update AFTER UPDATE OF title, description ON substories BEGIN
+    INSERT INTO substories_fts (substories_fts, rowid, title, description) VALUES ('delete', old.pk, old.title, old.description);
+    INSERT INTO substories_fts (rowid, title, description) VALUES (new.pk, new.title, new.description);
+END;
+"""
+
+DEFAULT_DATABASE = 'substories.db'
+
+class SqliteStore:
+    """ Optional SQLite storage for substories and revelations (stdlib sqlite3 only).
+
+    Filtering and sorting run as indexed SQL queries, with an FTS5 table over substory
+    titles and descriptions, and every edit is a single-row UPDATE. The connection is
+    shared by the Tk thread and the background saver, so all access holds a lock.
+    """
+    COLUMNS = {
+        'substories': {'id': 'id', 'title': 'title', 'description': 'description', 'available from': 'chapter', 'status': 'status', 'completed': 'completed'},
+        'revelations': {'id': 'id', 'title': 'title', 'description': 'description', 'status': 'status'},
+    }
+    # ORDER BY terms per table column, matching SORT_KEYS (chapters numerically, then the finale)
+    SORT_COLUMNS = {
+        'ID': ['s.id'],
+        'Title': ['s.title COLLATE NOCASE'],
+        'Description': ['s.description COLLATE NOCASE'],
+        'Character': ["coalesce(c.name, '') COLLATE NOCASE"],
+        'Available From': ["lower(trim(s.chapter)) = 'finale'", "CAST(ltrim(lower(s.chapter), 'chapter ') AS INTEGER)", 's.chapter'],
+        'Status': ["CASE s.status WHEN 'Not Completed' THEN 0 WHEN 'In Progress' THEN 1 WHEN 'Completed' THEN 2 ELSE 3 END", 's.status'],
+    }
+
+    def __init__(self, db_path):
+        import sqlite3
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA foreign_keys=ON')
+        self.conn.executescript(SQLITE_SCHEMA)
+        try:
+            self.conn.executescript(SQLITE_FTS_SCHEMA)
+            self.has_fts = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5: text terms fall back to LIKE scans
+            self.has_fts = False
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def has_dataset(self, dataset):
+        with self._lock:
+            return self.conn.execute('SELECT 1 FROM datasets WHERE name = ?', (dataset,)).fetchone() is not None
+
+    def _character_id(self, name):
+        if not name:
+            return None
+        self.conn.execute('INSERT OR IGNORE INTO characters (name) VALUES (?)', (name,))
+        return self.conn.execute('SELECT id FROM characters WHERE name = ?', (name,)).fetchone()[0]
+
+    def import_records(self, dataset, records, kind):
+        """ Replace a dataset with the given JSON-schema records; kind is 'substories' or 'revelations' """
+        with self._lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO datasets (name, kind) VALUES (?, ?)', (dataset, kind))
+            self.conn.execute(f'DELETE FROM {kind} WHERE dataset = ?', (dataset,))
+            return self._insert(dataset, records, kind, 0)
+
+    def append_records(self, dataset, records):
+        """ Add JSON-schema records after the last record of a dataset """
+        with self._lock, self.conn:
+            kind = self.conn.execute('SELECT kind FROM datasets WHERE name = ?', (dataset,)).fetchone()[0]
+            last = self.conn.execute(f'SELECT max(position) FROM {kind} WHERE dataset = ?', (dataset,)).fetchone()[0]
+            return self._insert(dataset, records, kind, 0 if last is None else last + 1)
+
+    def _insert(self, dataset, records, kind, start):
+        columns = self.COLUMNS[kind]
+        rows = []
+        for position, record in enumerate(records, start):
+            extra = {field: value for field, value in record.items() if field not in columns and field != 'character'}
+            row = {
+                'dataset': dataset, 'key': record_iid(record), 'position': position,
+                'character_id': self._character_id(record.get('character')), 'extra': json.dumps(extra),
+            }
+            for field, column in columns.items():
+                row[column] = record.get(field, False if field == 'completed' else '')
+            rows.append(row)
+        if rows:
+            names = list(rows[0])
+            self.conn.executemany(
+                f"INSERT INTO {kind} ({', '.join(names)}) VALUES ({', '.join(':' + name for name in names)})", rows)
+        return len(rows)
+
+    def load(self, dataset, kind='substories'):
+        """ Return a dataset as a list of records in the JSON schema, in file order """
+        columns = self.COLUMNS[kind]
+        select = ', '.join(f's.{column}' for column in columns.values())
+        with self._lock:
+            rows = self.conn.execute(
+                f'SELECT {select}, c.name, s.extra FROM {kind} s LEFT JOIN characters c ON c.id = s.character_id '
+                'WHERE s.dataset = ? ORDER BY s.position', (dataset,)).fetchall()
+        records = []
+        for row in rows:
+            record = dict(zip(columns, row))
+            if 'completed' in record:
+                record['completed'] = bool(record['completed'])
+            if row[-2] is not None:
+                record['character'] = row[-2]
+            record.update(json.loads(row[-1]))
+            records.append(record)
+        return records
+
+    def _match_sql(self, node):
+        kind = node[0]
+        if kind == 'all':
+            return '1', []
+        if kind == 'not':
+            sql, params = self._match_sql(node[1])
+            return f'NOT ({sql})', params
+        if kind in ('and', 'or'):
+            parts = [self._match_sql(child) for child in node[1]]
+            return f' {kind.upper()} '.join(f'({sql})' for sql, _ in parts), [param for _, params in parts for param in params]
+        _, field, value, is_phrase = node
+        if field == 'id':
+            low, sep, high = value.partition('-')
+            if sep and low.strip().isdigit() and high.strip().isdigit():
+                return 's.id BETWEEN ? AND ?', [int(low), int(high)]
+            if is_phrase:
+                return 'CAST(s.id AS TEXT) = ?', [value]
+            return 'substr(CAST(s.id AS TEXT), 1, ?) = ?', [len(value), value]
+        if self.has_fts:
+            phrase = '"' + ' '.join(value) + '"' + ('' if is_phrase else ' *')
+            return 's.pk IN (SELECT rowid FROM substories_fts WHERE substories_fts MATCH ?)', [f'{field} : {phrase}']
+        return f'lower(s.{field}) LIKE ?', ['%' + ' '.join(value) + '%']
+
+    def query(self, dataset, query, filter_by, status_filters, chapter_filters, character_filters=(), order_by=None, descending=False):
+        """ Return the keys of the substories matching the filters, in display order """
+        sql, params = self._match_sql(parse_query(query, FILTER_BY_FIELDS.get(filter_by, 'title')))
+        where = ['s.dataset = ?', f'({sql})']
+        params = [dataset] + params
+        for column, values in (('s.status', status_filters), ('s.chapter', chapter_filters), ('c.name', character_filters)):
+            if values and 'All' not in values:
+                where.append(f"{column} IN ({', '.join('?' * len(values))})")
+                params.extend(values)
+        terms = [f"{term} {'DESC' if desc else 'ASC'}" for column, desc in sort_order(order_by, descending)
+                 for term in self.SORT_COLUMNS.get(column, [])]
+        order = ', '.join(terms + ['s.position'])
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT s.key FROM substories s LEFT JOIN characters c ON c.id = s.character_id '
+                f"WHERE {' AND '.join(where)} ORDER BY {order}", params).fetchall()
+        return [row[0] for row in rows]
+
+    def apply_changes(self, dataset, changes):
+        """ Apply (record key, field, new value) edits, one single-row UPDATE each """
+        with self._lock, self.conn:
+            kind = self.conn.execute('SELECT kind FROM datasets WHERE name = ?', (dataset,)).fetchone()[0]
+            columns = self.COLUMNS[kind]
+            for key, field, value in changes:
+                if field == 'character':
+                    self.conn.execute(f'UPDATE {kind} SET character_id = ? WHERE dataset = ? AND key = ?',
+                                      (self._character_id(value), dataset, key))
+                elif field in columns:
+                    self.conn.execute(f'UPDATE {kind} SET {columns[field]} = ? WHERE dataset = ? AND key = ?', (value, dataset, key))
+                else:
+                    self.conn.execute(f"UPDATE {kind} SET extra = json_set(extra, '$.' || json_quote(?), json(?)) WHERE dataset = ? AND key = ?",
+                                      (field, json.dumps(value), dataset, key))
+                new_key = rekeyed(key, value) if field == 'id' else recharactered(key, value) if field == 'character' else key
+                if new_key != key:
+                    # Keep the stored key in step with record_iid, so later edits find the row
+                    self.conn.execute(f'UPDATE {kind} SET key = ? WHERE dataset = ? AND key = ?', (new_key, dataset, key))
+
+    def export_json(self, dataset, json_filename, kind='substories'):
+        write_json_atomic(self.load(dataset, kind), json_filename)
+
+# Function to load a substory dataset from JSON, or from the SQLite backend if given
+def load_dataset(json_filename, backend=None, compact=False, lazy=False):
+    if backend is None:
+        return load_lazy_data(json_filename) if lazy else load_data(json_filename, compact)
+    if not backend.has_dataset(json_filename):
+        backend.import_records(json_filename, load_data(json_filename), 'substories')
+    records = backend.load(json_filename)
+    return compact_records(records) if compact else records
+
+# Function to load a revelation dataset from JSON, or from the SQLite backend if given
+def load_revelation_dataset(json_filename, backend=None):
+    if backend is None:
+        return load_revelations(json_filename)
+    if not backend.has_dataset(json_filename):
+        backend.import_records(json_filename, load_revelations(json_filename), 'revelations')
+    return backend.load(json_filename, 'revelations')
+
+# Function to import the JSON datasets into a SQLite database in one go
+def import_json_datasets(store, substory_files=None, revelation_files=None):
+    substory_files = substory_files or [game.file for game in GAMES.values()]
+    revelation_files = revelation_files or [game.revelations for game in GAMES.values() if game.revelations]
+    for json_filename in substory_files:
+        store.import_records(json_filename, load_data(json_filename), 'substories')
+    for json_filename in revelation_files:
+        store.import_records(json_filename, load_revelations(json_filename), 'revelations')
+
+# Streaming import and export: community guides and progress reports move in and out as JSON Lines or
+# CSV, one record at a time, so neither side needs the whole document in memory. Imported records are
+# validated and normalized to the schema below and merged by record key into a dataset
+TRANSFER_FORMATS = {'.jsonl': 'jsonl', '.ndjson': 'jsonl', '.csv': 'csv'}
+RECORD_FIELDS = {
+    'substories': ('id', 'character', 'title', 'available from', 'status', 'description'),
+    'revelations': ('id', 'character', 'title', 'thought', 'status', 'description'),
+}
+IMPORT_ERROR_LIMIT = 100  # rejected rows reported by line; the rest are only counted
+_CHAPTER_RE = re.compile(r'(?:chapter\s*)?(\d+)', re.IGNORECASE)
+
+# Function to pick the transfer format, 'jsonl' or 'csv', from a file name
+def transfer_format(filename):
+    extension = os.path.splitext(filename)[1].lower()
+    if extension not in TRANSFER_FORMATS:
+        raise ValueError(f'Cannot tell the format of {filename}: use a .jsonl or .csv file')
+    return TRANSFER_FORMATS[extension]
+
+# Function to make a validated copy of an imported row in the record schema of kind: only the schema's
+# fields, the ID a positive integer, text stripped, and status, chapter and character spelled the way
+# the game spells them. Empty fields are left out, so a row may carry just the fields it updates
+def normalize_record(row, kind='substories', game=None):
+    record = {}
+    for field in RECORD_FIELDS[kind]:
+        value = row.get(field)
+        if value is None or value == '':
+            continue
+        if field == 'id':
+            if isinstance(value, str) and value.strip().isdigit():
+                value = int(value)
+            if not isinstance(value, int) or isinstance(value, bool) or value <= 0:
+                raise ValueError(f'id must be a positive whole number, not {value!r}')
+        elif not isinstance(value, str):
+            raise ValueError(f'{field} must be text, not {value!r}')
+        else:
+            value = value.strip()
+            if field == 'status':
+                value = next((status for status in STATUSES if status.casefold() == value.casefold()), None)
+                if value is None:
+                    raise ValueError(f"status must be one of {', '.join(STATUSES)}, not {row[field]!r}")
+            elif field == 'available from':
+                match = _CHAPTER_RE.fullmatch(value)
+                value = f'chapter {int(match.group(1))}' if match else ' '.join(value.split()).lower()
+            elif field == 'character':
+                if game is None or not game.characters:
+                    raise ValueError('this game has no characters')
+                value = next((character for character in game.characters if character.casefold() == value.casefold()), None)
+                if value is None:
+                    raise ValueError(f"character must be one of {', '.join(game.characters)}, not {row[field]!r}")
+        record[field] = value
+    if 'id' not in record:
+        raise ValueError('id is missing')
+    if game is not None and game.characters and 'character' not in record:
+        raise ValueError('character is missing')
+    return record
+
+# Function to read rows one at a time from a JSON Lines or CSV file, as (line number, row); a JSON Lines
+# line that does not parse to an object comes through as the ValueError instead
+def read_transfer_rows(file, fmt):
+    if fmt == 'csv':
+        import csv
+        reader = csv.DictReader(file)
+        for row in reader:
+            row.pop(None, None)  # cells past the header
+            yield reader.line_num, row
+        return
+    for number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield number, ValueError(f'not valid JSON: {e}')
+            continue
+        yield number, row if isinstance(row, dict) else ValueError('not a JSON object')
+
+class ImportResult:
+    """ What import_records merged. changed, [(record, {field: value})], and added, [records], are
+    ready for Dataset.apply_diff or apply_record_diff; changes lists the same edits as (record key,
+    field, value) for writing, with the statuses of added records for the progress profile """
+
+    def __init__(self):
+        self.changed = []
+        self.added = []
+        self.changes = []
+        self.unchanged = 0
+        self.rejected = 0
+        self.errors = []  # (line number, message), the first IMPORT_ERROR_LIMIT
+
+    def reject(self, line, message):
+        self.rejected += 1
+        if len(self.errors) < IMPORT_ERROR_LIMIT:
+            self.errors.append((line, str(message)))
+
+    def summary(self):
+        return f"{len(self.added)} added, {len(self.changed)} updated, {self.unchanged} unchanged, {self.rejected} rejected"
+
+# Function to merge rows streamed from a JSON Lines or CSV file (see read_transfer_rows) into records by
+# record key: a known record takes the row's fields, an unknown one is added. records are left as they are
+@traced()
+def import_records(records, file, fmt, kind='substories', game=None):
+    result = ImportResult()
+    by_key = {}
+    for record in records:
+        by_key.setdefault(record_iid(record), record)
+    added = {}
+    for line, row in read_transfer_rows(file, fmt):
+        try:
+            if isinstance(row, ValueError):
+                raise row
+            fields = normalize_record(row, kind, game)
+        except ValueError as e:
+            result.reject(line, e)
+            continue
+        key = record_iid(fields)
+        new = added.get(key)
+        if new is not None:
+            # The file repeats a record it adds: the later row wins
+            new.update(fields)
+            continue
+        record = by_key.get(key)
+        if record is None:
+            if 'title' not in fields:
+                result.reject(line, 'title is missing for a new record')
+                continue
+            if kind == 'substories' and 'available from' not in fields:
+                result.reject(line, 'available from is missing for a new substory')
+                continue
+            fields.setdefault('description', '')
+            fields.setdefault('status', UNSTARTED_STATUS)
+            added[key] = fields
+            result.added.append(fields)
+            continue
+        values = {field: value for field, value in fields.items() if record.get(field, _ABSENT) != value}
+        if not values:
+            result.unchanged += 1
+            continue
+        result.changed.append((record, values))
+        result.changes.extend((key, field, value) for field, value in values.items())
+    result.changes.extend((record_iid(record), 'status', record['status']) for record in result.added)
+    return result
+
+# Function to stream records, e.g. a filter result, to a file as JSON Lines, CSV with the columns of the
+# record schema of kind, or a JSON array, without copying them first
+@traced()
+def export_records(records, file, fmt, kind='substories'):
+    if fmt == 'csv':
+        import csv
+        writer = csv.DictWriter(file, fieldnames=RECORD_FIELDS[kind], extrasaction='ignore')
+        writer.writeheader()
+        for record in records:
+            writer.writerow(record)
+    elif fmt == 'jsonl':
+        for record in records:
+            file.write(json.dumps(record, default=json_default) + '\n')
+    else:
+        # json.dump encodes a list piece by piece as it writes
+        json.dump(records, file, indent=4, default=json_default)
+        file.write('\n')
+
+ID_RANGE_LIMIT = 100000  # IDs in one range of an ID selection, far more than any game has
+
+# Function to parse an ID selection such as "1-40,45,50-52" into a set of IDs; raises ValueError for a
+# range wider than ID_RANGE_LIMIT
+def parse_id_ranges(text):
+    ids = set()
+    for part in text.split(','):
+        low, sep, high = part.strip().partition('-')
+        if not low:
+            continue
+        if sep and int(high) - int(low) >= ID_RANGE_LIMIT:
+            raise ValueError(f'ID range {part.strip()} is too wide (at most {ID_RANGE_LIMIT} IDs)')
+        ids.update(range(int(low), int(high) + 1) if sep else [int(low)])
+    return ids
+
+UNDO_LIMIT = 100  # bulk edits kept for undo, per dataset
+_DATASET_VERSIONS = count(1)  # shared by all datasets, so a version also tells datasets apart
+
+class EditTransaction:
+    """ One bulk edit: the new field values, and per field the records that changed grouped by their old value.
+
+    The inverse is a handful of (field, old value, records) runs rather than a per-record log, so
+    undoing a change to thousands of records costs the same as making it.
+    """
+    __slots__ = ('label', 'values', 'records', 'previous')
+
+    def __init__(self, label, values, records):
+        self.label = label
+        self.values = dict(values)
+        self.records = {}   # field -> the records whose value changed
+        self.previous = {}  # field -> {old value: records}
+        for field, value in self.values.items():
+            groups = self.previous[field] = {}
+            for record in records:
+                old_value = record.get(field, '')
+                if old_value != value:
+                    groups.setdefault(old_value, []).append(record)
+            self.records[field] = [record for group in groups.values() for record in group]
+
+    def __len__(self):
+        return max(map(len, self.records.values()), default=0)
+
+    def inverse(self):
+        return [(field, old_value, records) for field, groups in self.previous.items() for old_value, records in groups.items()]
+
+class EditLog:
+    """ Undo and redo stacks of EditTransactions; a new transaction clears the redo stack """
+
+    def __init__(self, limit=UNDO_LIMIT):
+        self.limit = limit
+        self.done = []
+        self.undone = []
+
+    def push(self, transaction):
+        self.done.append(transaction)
+        del self.done[:-self.limit]
+        self.undone.clear()
+
+    def undo(self):
+        if not self.done:
+            return None
+        transaction = self.done.pop()
+        self.undone.append(transaction)
+        return transaction
+
+    def redo(self):
+        if not self.undone:
+            return None
+        transaction = self.undone.pop()
+        self.done.append(transaction)
+        return transaction
+
+    def clear(self):
+        self.done.clear()
+        self.undone.clear()
+
+def _locked(method):
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return locked
+
+class Dataset:
+    """ A loaded substory dataset: its records, a keyed RecordStore, and SearchIndex, SortCache and FacetIndex over them.
+
+    version changes with every edit made through the dataset, e.g. for HTTP ETags (see substories_api).
+    Reads and edits hold lock, so worker threads (the live search, the API server) never filter
+    half-edited records or fill the lazy sort and prefix caches from them; code editing records
+    in place must hold it too until edited() has run.
+    """
+
+    def __init__(self, json_filename, records, backend=None, snapshot=None):
+        self.json_filename = json_filename
+        self.records = records
+        self.backend = backend
+        self.from_snapshot = snapshot is not None
+        self.store = RecordStore(records)
+        if snapshot is not None:
+            self.index = SearchIndex.unpack(records, snapshot['index'])
+            self.facets = FacetIndex.unpack(records, snapshot['facets'])
+        else:
+            # Lazy descriptions are searched straight from their blob rather than indexed in memory
+            scanners = {'description': records[0]._blob.scan} if records and isinstance(records[0], LazyRecord) else None
+            self.index = SearchIndex(records, scanners)
+            self.facets = FacetIndex(records)
+        self.sorter = SortCache(records)
+        self.history = EditLog()
+        self.version = next(_DATASET_VERSIONS)
+        self.lock = threading.RLock()
+
+    @classmethod
+    @traced('load_dataset')
+    def load(cls, json_filename, backend=None, compact=False, lazy=False, snapshot=None):
+        """ Load a dataset. With snapshot set to one of SNAPSHOT_COMPRESSIONS, a JSON dataset (without lazy
+        descriptions) is restored from its startup snapshot when that is current, and one is written otherwise """
+        if snapshot is None or backend is not None or lazy:
+            return cls(json_filename, load_dataset(json_filename, backend, compact, lazy), backend)
+        raw, digest = source_digest(json_filename)
+        packed = read_snapshot(json_filename, digest)
+        if packed is not None:
+            records = packed['records']
+            if compact:
+                compact_records(records)
+            return cls(json_filename, records, snapshot=packed)
+        records = json.loads(raw)
+        del raw
+        if compact:
+            compact_records(records)
+        replay_journal(records, json_filename)
+        dataset = cls(json_filename, records)
+        try:
+            write_snapshot(dataset, digest, snapshot)
+        except OSError as e:
+            print(f"Error writing the startup snapshot for {json_filename}: {e}")
+        return dataset
+
+    @_locked
+    def filter(self, query='', filter_by='Title', status_filters=('All',), chapter_filters=('All',), character_filters=('All',), order_by=None, descending=False):
+        """ Return the records matching the filters, optionally sorted by a table column or a list of (column, descending) pairs """
+        status_filters, chapter_filters, character_filters = (list(values) or ['All'] for values in (status_filters, chapter_filters, character_filters))
+        if filter_by == FUZZY_FILTER:
+            # Ranked results keep their ranking rather than the column sort
+            if not query.strip():
+                return filter_substories('', self.records, 'Title', status_filters, chapter_filters, character_filters, self.index, self.facets)
+            candidates = None
+            if not all('All' in values for values in (status_filters, chapter_filters, character_filters)):
+                candidates = {id(record) for record in self.facets.select(status_filters, chapter_filters, character_filters)}
+            return [self.index.records[key] for _, key in self.index.fuzzy_search(query, candidates)]
+        if self.backend is not None:
+            keys = self.backend.query(self.json_filename, query, filter_by, status_filters, chapter_filters, character_filters, order_by, descending)
+            return [self.store[key] for key in keys]
+        filtered = filter_substories(query, self.records, filter_by, status_filters, chapter_filters, character_filters, self.index, self.facets)
+        if order_by is not None:
+            filtered = self.sorter.sort(filtered, sort_order(order_by, descending))
+        return filtered
+
+    @_locked
+    def edited(self, record):
+        """ Bring the indexes up to date after a record was edited in place """
+        self.version = next(_DATASET_VERSIONS)
+        self.index.update(record)
+        self.sorter.update(record)
+        self.facets.update(record)
+
+    @traced('apply_progress')
+    @_locked
+    def apply_progress(self, profile):
+        """ Show a progress profile's statuses; returns the records whose status changed """
+        changed = profile.apply(self.json_filename, self.records)
+        self._reindex(changed, ('status',))
+        if changed:
+            self.version = next(_DATASET_VERSIONS)
+            # Undoing an edit made under other statuses would overwrite the ones now shown
+            self.history.clear()
+        if changed and self.backend is not None:
+            # The database holds the statuses being shown, so its status filters keep working
+            self.backend.apply_changes(self.json_filename, [(record_iid(record), 'status', record['status']) for record in changed])
+        return changed
+
+    def _reindex(self, records, fields):
+        """ Bring the indexes up to date after the given fields of many records changed """
+        if len(records) * 8 <= len(self.records):
+            for record in records:
+                self.edited(record)
+            return
+        # Past a few records, rebuilding the affected sort keys and facets beats updating them one by one
+        for column, field in COLUMN_FIELDS.items():
+            if field in fields:
+                self.sorter.forget(column)
+        for facet, field in FacetIndex.FACETS.items():
+            if field in fields:
+                self.facets.refresh(facet)
+        if any(field in fields for field in SearchIndex.TEXT_FIELDS + ('id',)):
+            for record in records:
+                self.index.update(record)
+
+    @_locked
+    def assign(self, assignments):
+        """ Set fields of many records in one pass and update the indexes once; assignments are
+        (field, value, records) triples. Returns the (record key, field, value) changes """
+        changes = []
+        touched = {}
+        fields = set()
+        for field, value, records in assignments:
+            fields.add(field)
+            for record in records:
+                if record.get(field, '') != value:
+                    record[field] = value
+                    changes.append((record_iid(record), field, value))
+                    touched[id(record)] = record
+        if changes:
+            self.version = next(_DATASET_VERSIONS)
+            self._reindex(list(touched.values()), fields)
+        return changes
+
+    @traced('bulk_edit')
+    @_locked
+    def bulk_edit(self, records, values, label=''):
+        """ Set field values (e.g. {'status': 'Completed'}) on many records as one undoable transaction.
+
+        Returns the (record key, field, value) changes, for persisting them in one write.
+        """
+        transaction = EditTransaction(label, values, records)
+        changes = self.assign((field, value, transaction.records[field]) for field, value in values.items())
+        if changes:
+            self.history.push(transaction)
+        return changes
+
+    def _live(self, records):
+        # Records removed by an outside edit since the transaction are left alone
+        return [record for record in records if self.store.get(record_iid(record)) is record]
+
+    @traced('undo')
+    @_locked
+    def undo(self):
+        """ Revert the latest bulk edit; returns its changes, or None when there is nothing to undo """
+        transaction = self.history.undo()
+        if transaction is None:
+            return None
+        return self.assign((field, value, self._live(records)) for field, value, records in transaction.inverse())
+
+    @traced('redo')
+    @_locked
+    def redo(self):
+        """ Repeat the latest undone bulk edit; returns its changes, or None when there is nothing to redo """
+        transaction = self.history.redo()
+        if transaction is None:
+            return None
+        return self.assign((field, value, self._live(transaction.records[field])) for field, value in transaction.values.items())
+
+    @_locked
+    def apply_diff(self, changed, added=(), removed=()):
+        """ Apply outside edits (see merge_external_changes) and bring the indexes up to date """
+        self.version = next(_DATASET_VERSIONS)
+        if added and self.records and isinstance(self.records[0], CompactRecord):
+            blob = self.records[0]._blob if isinstance(self.records[0], LazyRecord) else None
+            added = [LazyRecord(fields, blob, None, fields.get('description', _ABSENT)) if blob else CompactRecord(fields) for fields in added]
+        for record in removed:
+            self.index.remove(record)
+            if isinstance(record, LazyRecord):
+                record._blob.edited.pop(id(record), None)
+        apply_record_diff(self.records, changed, added, removed)
+        for record, _ in changed:
+            self.index.update(record)
+        for record in added:
+            self.index.add(record)
+        if added or removed:
+            # Positions moved: the keyed store, sort keys and facet bitsets are rebuilt
+            self.store = RecordStore(self.records)
+            self.sorter = SortCache(self.records)
+            self.facets = FacetIndex(self.records)
+        else:
+            for record, _ in changed:
+                self.sorter.update(record)
+                self.facets.update(record)
+
+# Startup snapshots: a marshal dump of a dataset's parsed records and its search and facet indexes, kept next
+# to the data file and keyed by a hash of the file and its journal, so a launch can skip parsing and indexing
+SNAPSHOT_SUFFIX = '.snapshot'
+SNAPSHOT_MAGIC = b'SUBSNAP1'
+SNAPSHOT_COMPRESSIONS = ('none', 'zlib', 'lzma')
+# Snapshots are only valid for the marshal format and Python version that wrote them
+_SNAPSHOT_HEADER = SNAPSHOT_MAGIC + bytes([marshal.version, sys.version_info[0], sys.version_info[1]])
+
+# Function to read a data file's bytes and hash them together with its journal
+def source_digest(json_filename):
+    import hashlib
+    note_generation(json_filename, commit_generation(json_filename))
+    with open(resource_path(json_filename), 'rb') as file:
+        raw = file.read()
+    digest = hashlib.sha256(raw)
+    try:
+        with open(journal_path(json_filename), 'rb') as file:
+            digest.update(b'\0journal\0' + file.read())
+    except FileNotFoundError:
+        pass
+    return raw, digest.digest()
+
+# Function to write a freshly built dataset's snapshot; compression is one of SNAPSHOT_COMPRESSIONS
+@traced()
+def write_snapshot(dataset, digest, compression='none'):
+    payload = marshal.dumps({
+        'records': [record.to_dict() if isinstance(record, CompactRecord) else record for record in dataset.records],
+        'index': dataset.index.pack(dataset.records),
+        'facets': dataset.facets.pack(),
+    })
+    if compression == 'zlib':
+        import zlib
+        payload = zlib.compress(payload, 1)
+    elif compression == 'lzma':
+        import lzma
+        payload = lzma.compress(payload, preset=0)
+
+    def write(file):
+        file.write(_SNAPSHOT_HEADER + bytes([SNAPSHOT_COMPRESSIONS.index(compression)]) + digest)
+        file.write(payload)
+    _replace_file(resource_path(dataset.json_filename) + SNAPSHOT_SUFFIX, write, 'wb')
+
+# Function to read a data file's snapshot; returns None unless it was written for this digest and Python
+@traced()
+def read_snapshot(json_filename, digest):
+    try:
+        with open(resource_path(json_filename) + SNAPSHOT_SUFFIX, 'rb') as file:
+            header = file.read(len(_SNAPSHOT_HEADER) + 1 + len(digest))
+            if header[:len(_SNAPSHOT_HEADER)] != _SNAPSHOT_HEADER or header[len(_SNAPSHOT_HEADER) + 1:] != digest:
+                return None
+            payload = file.read()
+    except FileNotFoundError:
+        return None
+    try:
+        compression = SNAPSHOT_COMPRESSIONS[header[len(_SNAPSHOT_HEADER)]]
+        if compression == 'zlib':
+            import zlib
+            payload = zlib.decompress(payload)
+        elif compression == 'lzma':
+            import lzma
+            payload = lzma.decompress(payload)
+        return marshal.loads(payload)
+    except Exception as e:
+        # A damaged snapshot is simply rebuilt from the JSON
+        print(f"Error reading the startup snapshot for {json_filename}: {e}")
+        return None
+
+# Outside edits: the data files are also edited by other tools (e.g. in a synced folder). A FileWatcher
+# notices the change, and the new file contents are merged three-way against fingerprints of the file
+# as last seen, so only the records that changed are touched and conflicting local edits are reported
+WATCH_POLL_MS = 1000
+_IN_CLOSE_WRITE = 0x08
+_IN_MOVED_TO = 0x80
+
+def _fingerprint(value):
+    if value is _ABSENT:
+        return None
+    try:
+        return hash(value)
+    except TypeError:
+        return hash(json.dumps(value, sort_keys=True, default=json_default))
+
+def _field_fingerprints(record):
+    try:
+        return dict(zip(record, map(hash, record.values())))
+    except TypeError:
+        return {field: _fingerprint(value) for field, value in record.items()}
+
+# Function to fingerprint each field of each record, a compact record of a file's contents to diff against later
+def record_fingerprints(records):
+    fingerprints = {}
+    for record in records:
+        key = record_iid(record)
+        if key not in fingerprints:
+            fingerprints[key] = _field_fingerprints(record)
+    return fingerprints
+
+# Function to read a data file as plain records, with its journal applied but no record conversion.
+# Callers that merge them into records in memory then note_generation the generation read before
+def read_json_records(json_filename):
+    with open(resource_path(json_filename), 'r') as file:
+        records = json.load(file)
+    replay_journal(records, json_filename)
+    return records
+
+# Function to compare in-memory records with a fresh read of their file, given fingerprints of the file as
+# last seen. Returns (changed, added, removed, conflicts, fingerprints): changed is [(record, {field: new
+# value})], with _ABSENT for a field the file dropped; conflicts is [(record, field, local value, file value)]
+# for fields edited both here and in the file; fingerprints are the fresh file's, to merge against next time.
+# Fields in ignore (e.g. PROGRESS_FIELDS, kept in a profile instead) are left alone
+@traced()
+def merge_external_changes(records, fresh, base, ignore=()):
+    by_key = {}
+    for record in records:
+        by_key.setdefault(record_iid(record), record)
+    changed, added, conflicts = [], [], []
+    fingerprints = {}
+    for new in fresh:
+        key = record_iid(new)
+        if key in fingerprints:
+            continue
+        new_fingerprints = fingerprints[key] = _field_fingerprints(new)
+        old = base.get(key)
+        if new_fingerprints == old:
+            continue  # the common case: the record is unchanged in the file
+        record = by_key.get(key)
+        if record is None:
+            # A record renamed or removed here keeps its old key in base; only unknown keys are new
+            if old is None:
+                added.append(new)
+            continue
+        old = old or {}
+        values = {}
+        for field in set(new).union(record).difference(ignore):
+            external = new.get(field, _ABSENT)
+            if new_fingerprints.get(field) == old.get(field):
+                continue  # unchanged in the file; any local edit stands
+            local = record.get(field, _ABSENT)
+            if local == external and type(local) is type(external):
+                continue
+            if _fingerprint(local) != old.get(field):
+                conflicts.append((record, field, local, external))
+            else:
+                values[field] = external
+        if values:
+            changed.append((record, values))
+    removed = [record for key, record in by_key.items() if key not in fingerprints and key in base]
+    return changed, added, removed, conflicts, fingerprints
+
+# Function to apply a merge_external_changes result to a plain record list in place
+def apply_record_diff(records, changed, added=(), removed=()):
+    for record, values in changed:
+        for field, value in values.items():
+            if value is _ABSENT:
+                record.pop(field, None)
+            else:
+                record[field] = value
+    if removed:
+        gone = {id(record) for record in removed}
+        records[:] = [record for record in records if id(record) not in gone]
+    records.extend(added)
+
+def _inotify_init():
+    if not sys.platform.startswith('linux'):
+        return None, -1
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None, -1
+    return libc, fd
+
+class FileWatcher:
+    """ Notices watched data files changing on disk.
+
+    On Linux an inotify descriptor (fileno()) becomes readable when a file in a watched
+    directory is written or renamed into place; elsewhere the caller polls check() every
+    WATCH_POLL_MS. Either way check() compares the size and mtime of the file and of its
+    journal, and tells our own commits (see CommitLock) apart from outside ones.
+    """
+
+    def __init__(self, use_inotify=True):
+        self._libc, self._fd = _inotify_init() if use_inotify else (None, -1)
+        self._dirs = set()
+        self._stamps = {}   # json_filename -> (path, (file stamp, journal stamp) last seen)
+
+    def fileno(self):
+        return self._fd if self._fd >= 0 else None
+
+    def watch(self, json_filename):
+        path = resource_path(json_filename)
+        self._stamps[json_filename] = (path, (_stamp_or_none(path), _stamp_or_none(path + JOURNAL_SUFFIX)))
+        directory = os.path.dirname(path)
+        if self._fd >= 0 and directory not in self._dirs:
+            if self._libc.inotify_add_watch(self._fd, os.fsencode(directory), _IN_CLOSE_WRITE | _IN_MOVED_TO) < 0:
+                import ctypes
+                # e.g. out of inotify watches: fall back to polling (fileno() becomes None)
+                print(f"Error watching {directory}: {os.strerror(ctypes.get_errno())}")
+                self.close()
+            self._dirs.add(directory)
+
+    def unwatch(self, json_filename):
+        self._stamps.pop(json_filename, None)
+
+    def check(self):
+        """ Return [(json_filename, ours)] for the watched files changed since the last check """
+        if self._fd >= 0:
+            try:
+                while os.read(self._fd, 65536):
+                    pass
+            except BlockingIOError:
+                pass
+        changes = []
+        for json_filename, (path, stamp) in list(self._stamps.items()):
+            current = (_stamp_or_none(path), _stamp_or_none(path + JOURNAL_SUFFIX))
+            if current[0] is None or current == stamp:
+                continue  # a file briefly missing mid-replace is not a change
+            self._stamps[json_filename] = (path, current)
+            current_generation = is_current(json_filename)
+            if current[0] == stamp[0]:
+                # Only the journal changed: our own appends are in memory already
+                if not current_generation:
+                    changes.append((json_filename, False))
+                continue
+            changes.append((json_filename, current_generation and current[0] == _written_stamps.get(path)))
+        return changes
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+def _stamp_or_none(path):
+    try:
+        return _file_stamp(path)
+    except OSError:
+        return None
+
+# Game registry: games.json describes each game's data file, revelation file, chapters, characters and
+# any extra table columns, so adding a game needs only a new entry there
+GAMES_FILE = 'games.json'
+
+class Game:
+    """ One game's entry in the registry """
+
+    def __init__(self, name, file, revelations=None, chapters=(), characters=(), extra_columns=()):
+        self.name = name
+        self.file = file
+        self.revelations = revelations
+        self.chapters = list(chapters)
+        self.characters = list(characters)
+        self.extra_columns = [dict(column) for column in extra_columns]
+
+    @property
+    def columns(self):
+        """ The game's table columns: the standard ones plus its extra columns, each after the column it names """
+        columns = list(TABLE_COLUMNS)
+        for column in self.extra_columns:
+            after = column.get('after', 'Description')
+            columns.insert(columns.index(after) + 1 if after in columns else len(columns), column['name'])
+        return tuple(columns)
+
+    def column_width(self, column, default=100):
+        for extra in self.extra_columns:
+            if extra['name'] == column:
+                return extra.get('width', default)
+        return default
+
+# Function to load the game registry as an ordered {display name: Game}
+def load_games(json_filename=GAMES_FILE):
+    try:
+        with open(resource_path(json_filename), 'r') as file:
+            entries = json.load(file)
+    except OSError as e:
+        print(f"Error loading the game registry: {e}")
+        return {}
+    games = {}
+    for entry in entries:
+        try:
+            game = Game(**entry)
+        except TypeError as e:
+            raise ValueError(f"{json_filename}: invalid entry for {entry.get('name', '?')!r}: {e}")
+        for column in game.extra_columns:
+            register_column(column['name'], column.get('field', column['name'].lower()))
+        games[game.name] = game
+    return games
+
+GAMES = load_games()
+
+# Mapping of JSON filenames to display names
+json_file_display_names = {game.file: game.name for game in GAMES.values()}
+
+# Revelation file that goes with each substory file
+revelation_files = {game.file: game.revelations for game in GAMES.values() if game.revelations}
+
+# Function to find the registry entry of a substory data file
+def game_for_file(json_filename):
+    for game in GAMES.values():
+        if game.file == json_filename:
+            return game
+    return Game(json_file_display_names.get(json_filename, json_filename), json_filename)
+
+# Parsed datasets: switching back to a game reuses its Dataset (records and indexes) while its data
+# file is unchanged; our own saves are recognised, so only outside changes force a reload
+DATASET_CACHE_SIZE = 4
+_written_stamps = {}  # data file path -> (size, mtime) right after our last write to it
+
+class DatasetCache:
+    """ LRU cache of loaded Datasets, invalidated by the data file's size and mtime, or another process's commit """
+
+    def __init__(self, size=DATASET_CACHE_SIZE, snapshot=None):
+        self.size = size
+        self.snapshot = snapshot  # passed on to Dataset.load
+        self._entries = OrderedDict()  # (file, backend, compact, lazy) -> (stamp when loaded, Dataset)
+
+    def get(self, json_filename, backend=None, compact=False, lazy=False):
+        key = (json_filename, id(backend), compact, lazy)
+        path = resource_path(json_filename)
+        stamp = _file_stamp(path)
+        entry = self._entries.pop(key, None)
+        if entry is not None and stamp in (entry[0], _written_stamps.get(path)) and is_current(json_filename):
+            dataset = entry[1]
+        else:
+            dataset = Dataset.load(json_filename, backend, compact, lazy, self.snapshot)
+        self._entries[key] = (stamp, dataset)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+        return dataset
+
+    def datasets(self):
+        return [dataset for _, dataset in self._entries.values()]
+
+    def refreshed(self, dataset):
+        """ Mark a cached dataset as matching its file again, after merging outside edits into it """
+        for key, (stamp, cached) in self._entries.items():
+            if cached is dataset:
+                self._entries[key] = (_stamp_or_none(resource_path(dataset.json_filename)), dataset)
+
+# Progress profiles: the guide files (substories and revelations) are read-only at runtime, and each
+# named profile keeps its statuses in a small overlay file, so several playthroughs can share one guide
+PROFILES_DIR = 'profiles'
+DEFAULT_PROFILE = 'Default'
+PROFILE_VERSION = 1
+UNSTARTED_STATUS = 'Not Completed'
+PROGRESS_FIELDS = ('status',)
+
+# Function to get a profile's overlay file, refusing names that are not plain file names
+def profile_filename(name):
+    if not name.strip() or name.startswith('.') or any(char in name for char in '/\\:'):
+        raise ValueError(f'"{name}" cannot be used as a profile name.')
+    return os.path.join(PROFILES_DIR, name + '.json')
+
+# Function to list the saved profiles; the default profile is always available
+def list_profiles():
+    try:
+        names = {filename[:-5] for filename in os.listdir(resource_path(PROFILES_DIR)) if filename.endswith('.json')}
+    except FileNotFoundError:
+        names = set()
+    return sorted(names | {DEFAULT_PROFILE}, key=str.casefold)
+
+class ProgressProfile:
+    """ A named playthrough's progress, {data file: {record key: status}}, kept in profiles/<name>.json.
+
+    Only statuses other than UNSTARTED_STATUS are stored. A profile with no entry yet for a
+    data file starts with nothing done, except the default profile, which takes the statuses
+    found in the guide file once so progress from before profiles existed carries over.
+    """
+
+    def __init__(self, name, progress=None, seed_from_guide=False):
+        self.name = name
+        self.progress = progress if progress is not None else {}
+        self.seed_from_guide = seed_from_guide
+        self.dirty = False  # changed since the last snapshot()
+        self.saved = {json_filename: dict(statuses) for json_filename, statuses in self.progress.items()}  # as on disk
+
+    @property
+    def filename(self):
+        return profile_filename(self.name)
+
+    @classmethod
+    def load(cls, name):
+        os.makedirs(resource_path(PROFILES_DIR), exist_ok=True)
+        filename = profile_filename(name)
+        generation = commit_generation(filename)
+        try:
+            with open(resource_path(filename), 'r') as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            note_generation(filename, generation)
+            return cls(name, seed_from_guide=name == DEFAULT_PROFILE)
+        note_generation(filename, generation, data)
+        return cls(name, data.get('progress', {}), data.get('seed_from_guide', False))
+
+    @classmethod
+    def create(cls, name):
+        """ A new profile with nothing started in any game """
+        if os.path.exists(resource_path(profile_filename(name))) or name == DEFAULT_PROFILE:
+            raise ValueError(f'A profile named "{name}" already exists.')
+        os.makedirs(resource_path(PROFILES_DIR), exist_ok=True)
+        profile = cls(name)
+        profile.dirty = True
+        return profile
+
+    def statuses(self, json_filename):
+        statuses = self.progress.get(json_filename)
+        if statuses is None:
+            statuses = self.progress[json_filename] = {}
+            if self.seed_from_guide:
+                try:
+                    for record in read_json_records(json_filename):
+                        if record.get('status', UNSTARTED_STATUS) != UNSTARTED_STATUS:
+                            statuses.setdefault(record_iid(record), record['status'])
+                except (OSError, ValueError) as e:
+                    print(f"Error reading the statuses in {json_filename}: {e}")
+            self.dirty = True
+        return statuses
+
+    def apply(self, json_filename, records):
+        """ Set the records' statuses from the profile; returns the records whose status changed """
+        statuses = self.statuses(json_filename)
+        changed = []
+        for record in records:
+            status = statuses.get(record_iid(record), UNSTARTED_STATUS)
+            if record.get('status') != status:
+                record['status'] = status
+                changed.append(record)
+        return changed
+
+    def record(self, json_filename, changes):
+        """ Take the status edits out of (record key, field, new value) changes; returns the rest, which edit the guide """
+        statuses = self.statuses(json_filename)
+        guide_changes = []
+        for key, field, value in changes:
+            if field in PROGRESS_FIELDS:
+                if value == UNSTARTED_STATUS:
+                    statuses.pop(key, None)
+                else:
+                    statuses[key] = value
+                self.dirty = True
+                continue
+            if field == 'id' and key in statuses:
+                statuses[rekeyed(key, value)] = statuses.pop(key)
+                self.dirty = True
+            guide_changes.append((key, field, value))
+        return guide_changes
+
+    def merge(self, fresh):
+        """ Take the statuses another program changed in the profile file (fresh, as loaded from it); ours stand elsewhere """
+        for json_filename, theirs in fresh.progress.items():
+            base = self.saved.get(json_filename, {})
+            ours = self.progress.setdefault(json_filename, {})
+            for key in set(theirs).union(base):
+                value = theirs.get(key)
+                if value != base.get(key):
+                    if value is None:
+                        ours.pop(key, None)
+                    else:
+                        ours[key] = value
+        self.saved = fresh.saved
+        # Edits of ours the file does not have yet still need writing
+        self.dirty = self.dirty or any(self.progress.get(json_filename) != statuses for json_filename, statuses in self.saved.items())
+
+    def snapshot(self):
+        """ The profile as JSON data for writing out (a copy, so the saver thread can write it while edits go on) """
+        self.dirty = False
+        self.saved = {json_filename: dict(statuses) for json_filename, statuses in self.progress.items()}
+        return {'version': PROFILE_VERSION, 'seed_from_guide': self.seed_from_guide, 'progress': self.saved}
+
+# Load configuration settings
+def load_config():
+    import configparser
+    config = configparser.ConfigParser()
+    generation = commit_generation(CONFIG_FILE)
+    config.read(resource_path(CONFIG_FILE))
+    note_generation(CONFIG_FILE, generation, {section: dict(config[section]) for section in config.sections()})
+    return config
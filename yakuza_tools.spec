@@ -12,7 +12,8 @@ a = Analysis(
         ('config.ini', '.'),
         ('revelations.json', '.'),
         ('substories.json', '.'),
-        ('y4subst.json', '.')
+        ('y4subst.json', '.'),
+        ('games.json', '.')
     ],
     hiddenimports=[],
     hookspath=[],